@@ -0,0 +1,196 @@
+#!python3
+from generator import SystemShape, generate
+from generator import add_shape_arguments, shape_from_arguments
+from parser import parse_file
+from scheduler import Job, run as run_jobs
+from util import write_tmp_file
+
+from dataclasses import dataclass, fields, asdict
+
+from typing import List, Dict, Tuple, Any, Callable
+
+import argparse
+import csv
+import logging
+import os
+import sys
+import time
+import tracemalloc
+
+logger = logging.getLogger(__name__)
+
+
+class BenchmarkError(Exception):
+    pass
+
+
+@dataclass
+class Measurement:
+    parameter: str
+    value: int
+    stage: str
+    seconds: float
+    # peak of the Python heap during the stage, for mona its peak RSS
+    peak_kib: int
+    # characters of the rendered scripts, 0 for other stages
+    output_chars: int
+
+
+def _sized(text: str) -> Tuple[str, int]:
+    return text, len(text)
+
+
+def _run_stages(filename: str, mona: bool, traced: bool
+                ) -> List[Tuple[str, float, int, int]]:
+    # the pipeline of main.py; stage results are (name, seconds, peak KiB,
+    # output characters), peaks only if traced
+    results: List[Tuple[str, float, int, int]] = []
+
+    def stage(name: str, action: Callable[[], Tuple[Any, int]]) -> Any:
+        if traced:
+            tracemalloc.reset_peak()
+        start = time.perf_counter()
+        value, size = action()
+        seconds = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1] // 1024 if traced else 0
+        results.append((name, seconds, peak, size))
+        return value
+
+    def render_scripts() -> Tuple[List[str], int]:
+        scripts = []
+        for property_name in normalized.property_names:
+            script = normalized.render_property_unreachability(
+                    property_name, base_theory)
+            scripts.append(script)
+        return scripts, sum(len(s) for s in scripts)
+
+    interaction = stage("parse", lambda: (parse_file(filename), 0))
+    normalized = stage("normalize", lambda: (interaction.normalize(), 0))
+    base_theory = stage("base theory",
+                        lambda: _sized(normalized.render_base_theory()))
+    scripts = stage("proof scripts", render_scripts)
+    if mona and not traced:
+        files = [write_tmp_file(lambda sink: sink.write(s)) for s in scripts]
+        try:
+            completions = list(run_jobs([Job(["mona", "-q", f])
+                                         for f in files]))
+        finally:
+            for f in files:
+                os.unlink(f)
+        for c in completions:
+            if c.returncode != 0:
+                raise BenchmarkError(f"mona failed: {c.output}")
+        results.append(("mona", sum(c.duration for c in completions),
+                        max(c.peak_rss for c in completions), 0))
+    return results
+
+
+def measure(shape: SystemShape, parameter: str, mona: bool = False,
+            repeat: int = 1) -> List[Measurement]:
+    # times are the best of repeat untraced runs, memory peaks come from a
+    # separate run under tracemalloc, which slows the stages down
+    filename = write_tmp_file(lambda sink: sink.write(generate(shape)))
+    try:
+        timed = [_run_stages(filename, mona, False) for _ in range(repeat)]
+        tracemalloc.start()
+        try:
+            traced = _run_stages(filename, False, True)
+        finally:
+            tracemalloc.stop()
+    finally:
+        os.unlink(filename)
+    peaks = {name: peak for name, _, peak, _ in traced}
+    value = getattr(shape, parameter)
+    measurements = []
+    for i, (name, _, peak, size) in enumerate(timed[0]):
+        seconds = min(run[i][1] for run in timed)
+        measurements.append(Measurement(parameter, value, name, seconds,
+                                        peaks.get(name, peak), size))
+    return measurements
+
+
+def plot(measurements: List[Measurement], path: str):
+    try:
+        import matplotlib
+        matplotlib.use("Agg")
+        import matplotlib.pyplot as plt
+    except ImportError:
+        raise BenchmarkError("Plotting needs matplotlib")
+    by_stage: Dict[str, List[Measurement]] = {}
+    for m in measurements:
+        by_stage.setdefault(m.stage, []).append(m)
+    figure, (time_axis, memory_axis) = plt.subplots(1, 2, figsize=(11, 4))
+    for stage, series in by_stage.items():
+        values = [m.value for m in series]
+        time_axis.plot(values, [m.seconds for m in series], marker="o",
+                       label=stage)
+        memory_axis.plot(values, [m.peak_kib / 1024 for m in series],
+                         marker="o", label=stage)
+    parameter = measurements[0].parameter
+    for axis, label in [(time_axis, "seconds"), (memory_axis, "peak MiB")]:
+        axis.set_xlabel(parameter)
+        axis.set_ylabel(label)
+        axis.set_xscale("log")
+        axis.set_yscale("log")
+        axis.legend()
+    figure.tight_layout()
+    figure.savefig(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+            description=("measure time and memory of every stage for"
+                         + " " + "generated systems of growing size"))
+    parser.add_argument("parameter",
+                        help="shape parameter to vary",
+                        choices=[f.name for f in fields(SystemShape)
+                                 if f.name != "seed"])
+    parser.add_argument("values",
+                        help="values of the varied parameter",
+                        type=int,
+                        nargs="+")
+    add_shape_arguments(parser)
+    parser.add_argument("--mona",
+                        help="also check the proof scripts with mona",
+                        action="store_true")
+    parser.add_argument("--repeat",
+                        help="number of timed runs per value",
+                        type=int,
+                        default=1)
+    parser.add_argument("--csv",
+                        help="write the measurements to this file",
+                        metavar="FILE")
+    parser.add_argument("--plot",
+                        help="plot time and memory per stage (matplotlib)",
+                        metavar="FILE")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    measurements: List[Measurement] = []
+    for value in args.values:
+        shape = shape_from_arguments(args, **{args.parameter: value})
+        logger.info(f"measuring {shape}")
+        try:
+            measurements += measure(shape, args.parameter, args.mona,
+                                    args.repeat)
+        except BenchmarkError as e:
+            logger.error(f"{args.parameter} = {value}: {e}")
+            return 1
+    sink = open(args.csv, "w", newline="") if args.csv else sys.stdout
+    writer = csv.DictWriter(sink,
+                            fieldnames=[f.name for f in fields(Measurement)])
+    writer.writeheader()
+    writer.writerows(asdict(m) for m in measurements)
+    if args.csv:
+        sink.close()
+    if args.plot:
+        try:
+            plot(measurements, args.plot)
+        except BenchmarkError as e:
+            logger.error(str(e))
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,165 @@
+from dataclasses import dataclass
+from enum import Enum
+
+from typing import List, Dict, FrozenSet, Optional
+
+from formula import Interaction, Backend
+from instantiation import Instance, InstantiationError, instantiate
+from structural import bad_markings
+
+import logging
+import re
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class CounterexampleError(Exception):
+    pass
+
+
+# header of the example MONA prints for a satisfiable formula, followed by
+# one "name = value" line per free variable
+_SATISFYING = re.compile(r"A satisfying example of least length \((\d+)\)")
+_ASSIGNMENT = re.compile(r"^\s*(\w+)\s*=\s*(\S.*?)\s*$")
+
+
+def _parse_value(text: str) -> FrozenSet[int]:
+    if text.startswith("{") and text.endswith("}"):
+        return frozenset(int(e) for e in text[1:-1].split(",") if e.strip())
+    return frozenset({int(text)})
+
+
+@dataclass
+class Counterexample:
+    # a model of the proof script: the number of agents and the agents in
+    # every state, elements beyond the universe are dropped
+    size: int
+    states: Dict[str, FrozenSet[int]]
+
+    def marking(self, instance: Instance) -> np.ndarray:
+        if instance.size != self.size:
+            raise CounterexampleError(f"Counterexample of size {self.size}"
+                                      + " for instance of size"
+                                      + f" {instance.size}")
+        index = instance.interaction.system.index
+        marking = np.zeros(instance.net.number_of_places, dtype=np.int32)
+        for state, agents in self.states.items():
+            for agent in agents:
+                marking[instance.place(agent, state)] = 1
+        by_agent = marking.reshape(self.size, len(index.states))
+        for component, states in zip(index.components, index.state_ranges):
+            occupied = by_agent[:, states].sum(axis=1)
+            wrong = np.flatnonzero(occupied != 1)
+            if len(wrong):
+                raise CounterexampleError(
+                        f"Agent {wrong[0]} is in {occupied[wrong[0]]} states"
+                        + f" of {component.name}")
+        return marking
+
+
+def parse_example(output: str, interaction: Interaction,
+                  backend: Backend = Backend.WS1S) -> Counterexample:
+    # decodes the satisfying example of MONA's output; in m2l-str the
+    # universe is the string, its length is the number of agents
+    match = _SATISFYING.search(output)
+    if match is None:
+        raise CounterexampleError("MONA reported no satisfying example")
+    values: Dict[str, FrozenSet[int]] = {}
+    for line in output[match.end():].splitlines()[1:]:
+        if not line.strip():
+            if values:
+                break
+            continue
+        assignment = _ASSIGNMENT.match(line)
+        if assignment is None:
+            continue
+        name, text = assignment.groups()
+        try:
+            values[name] = _parse_value(text)
+        except ValueError:
+            logger.debug(f"ignoring value {text} of {name}")
+    if backend == Backend.M2L_STR:
+        size = int(match.group(1))
+    elif len(values.get("n", ())) == 1:
+        size, = values["n"]
+    else:
+        raise CounterexampleError("Satisfying example assigns no n")
+    states = {}
+    for state in interaction.system.index.states:
+        if state not in values:
+            raise CounterexampleError(f"Satisfying example misses {state}")
+        states[state] = frozenset(a for a in values[state] if a < size)
+    return Counterexample(size, states)
+
+
+class Verdict(Enum):
+    # genuine: a marking violating the property is reachable, spurious: all
+    # reachable markings of the size were explored without finding one
+    GENUINE = "genuine"
+    SPURIOUS = "spurious"
+    UNKNOWN = "unknown"
+
+
+@dataclass
+class Replay:
+    property_name: str
+    size: int
+    verdict: Verdict
+    reason: str
+    explored: int = 0
+    # a reachable marking violating the property, by state
+    witness: Optional[Dict[str, List[int]]] = None
+
+
+def replay(interaction: Interaction, counterexample: Counterexample,
+           property_name: str, limit: int = 1 << 20,
+           chunk: int = 1 << 12) -> Replay:
+    # breadth-first exploration of the instance of the counterexample size
+    # until the decoded marking or another bad marking is reached, at most
+    # limit markings are visited
+    size = counterexample.size
+    try:
+        instance = instantiate(interaction, size)
+        target = counterexample.marking(instance)
+    except (InstantiationError, CounterexampleError) as e:
+        return Replay(property_name, size, Verdict.UNKNOWN, str(e))
+    net = instance.net
+    is_bad = bad_markings(instance, property_name)
+    if not is_bad(target)[0]:
+        return Replay(property_name, size, Verdict.UNKNOWN,
+                      "the decoded marking does not violate the property")
+    initial = net.initial_marking
+    seen = {initial.tobytes()}
+    frontier = initial[None, :]
+    depth = 0
+    while len(frontier):
+        if (frontier == target[None, :]).all(axis=1).any():
+            return Replay(property_name, size, Verdict.GENUINE,
+                          f"reached the decoded marking in {depth} steps",
+                          len(seen), instance.marking(target))
+        bad = is_bad(frontier)
+        if bad.any():
+            return Replay(property_name, size, Verdict.GENUINE,
+                          f"reached another bad marking in {depth} steps",
+                          len(seen), instance.marking(frontier[bad][0]))
+        fresh: List[np.ndarray] = []
+        for start in range(0, len(frontier), chunk):
+            markings = frontier[start:start + chunk]
+            rows, transitions = np.nonzero(net.enabled(markings))
+            for marking in net.fire(markings[rows], transitions):
+                key = marking.tobytes()
+                if key not in seen:
+                    seen.add(key)
+                    fresh.append(marking)
+            if len(seen) > limit:
+                return Replay(property_name, size, Verdict.UNKNOWN,
+                              f"stopped after {len(seen)} markings at depth"
+                              + f" {depth + 1}", len(seen))
+        frontier = np.array(fresh, dtype=initial.dtype
+                            ).reshape(-1, net.number_of_places)
+        depth += 1
+    return Replay(property_name, size, Verdict.SPURIOUS,
+                  f"no bad marking among all {len(seen)} reachable markings",
+                  len(seen))
@@ -1,11 +1,20 @@
-from dataclasses import dataclass, field
+from dataclasses import dataclass, field, fields, replace
 
 from typing import List, Set, Dict, cast, Tuple, FrozenSet, Optional, Union
-from typing import Generic, TypeVar
+from typing import Generic, TypeVar, Any, Iterator, IO, Callable
 
 from system import System, Component
 
+from enum import Enum, unique
+from itertools import permutations
+from functools import partial
+from contextlib import nullcontext
+
 import logging
+import os
+import re
+import shutil
+import weakref
 
 import mona
 
@@ -13,8 +22,12 @@ import jinja2
 
 logger = logging.getLogger(__name__)
 
+# templates are loaded next to this module, their compiled bytecode is kept
+# across processes in the per-user cache of jinja
 env = jinja2.Environment(
-        loader=jinja2.FileSystemLoader('./')
+        loader=jinja2.FileSystemLoader(
+            os.path.dirname(os.path.abspath(__file__))),
+        bytecode_cache=jinja2.FileSystemBytecodeCache()
     )
 
 
@@ -22,6 +35,85 @@ class FormulaError(Exception):
     pass
 
 
+@unique
+class ExactlyOneEncoding(Enum):
+    QUADRATIC = "quadratic"
+    LINEAR = "linear"
+
+
+@unique
+class VariableOrder(Enum):
+    ALPHABETICAL = "alphabetical"
+    COMPONENT = "component"
+    COOCCURRENCE = "cooccurrence"
+
+
+@unique
+class Backend(Enum):
+    # WS1S with a free universe size n, or finite strings of length n
+    WS1S = "ws1s"
+    M2L_STR = "m2l-str"
+
+
+@dataclass(frozen=True)
+class EmissionOptions:
+    exactly_one: ExactlyOneEncoding = ExactlyOneEncoding.QUADRATIC
+    # order of the state variables in declarations and predicate signatures
+    variable_order: VariableOrder = VariableOrder.ALPHABETICAL
+    # pass copies (F, T, one, two) interleaved with the sets they are
+    # compared to instead of one block after the other
+    interleave_copies: bool = False
+    # restrict first-order variables to the universe once by defaultwhere1
+    # instead of guarding every quantifier
+    default_where: bool = False
+    backend: Backend = Backend.WS1S
+
+
+# below this many items the linear encoding renders larger than the
+# quadratic one, so shorter lists keep the quadratic encoding
+LINEAR_EXACTLY_ONE_MINIMUM = 14
+
+
+def exactly_one(name: str,
+                items: List[Tuple[mona.Formula, mona.Formula]],
+                encoding: ExactlyOneEncoding) -> mona.Formula:
+    # items are pairs (item i holds, item i does not hold); states that
+    # precisely one item holds while all others do not
+    if (encoding is ExactlyOneEncoding.QUADRATIC
+            or len(items) < LINEAR_EXACTLY_ONE_MINIMUM):
+        return mona.Disjunction([
+            mona.Conjunction([holds]
+                             + [other for j, (_, other) in enumerate(items)
+                                if i != j])
+            for i, (holds, _) in enumerate(items)])
+    # before_i implies that no item ahead of i holds, after_i that no item
+    # behind i holds; every "does not hold" formula is emitted twice
+    last = len(items) - 1
+    before = [mona.BooleanVariable(f"{name}_before_{i}")
+              for i in range(1, last + 1)]
+    after = [mona.BooleanVariable(f"{name}_after_{i}")
+             for i in range(last)]
+    chain: List[mona.Formula] = []
+    for i in range(1, last + 1):
+        previous = [before[i - 2]] if i > 1 else []
+        chain.append(mona.Implication(
+            before[i - 1],
+            mona.Conjunction(previous + [items[i - 1][1]])))
+    for i in range(last):
+        following = [after[i + 1]] if i + 1 < last else []
+        chain.append(mona.Implication(
+            after[i],
+            mona.Conjunction(following + [items[i + 1][1]])))
+    choice = mona.Disjunction([
+        mona.Conjunction(([before[i - 1]] if i > 0 else [])
+                         + [holds]
+                         + ([after[i]] if i < last else []))
+        for i, (holds, _) in enumerate(items)])
+    return mona.ExistentialZeroOrder(
+            cast(List[mona.Variable], before + after),
+            mona.Conjunction(chain + [choice]))
+
+
 @dataclass(frozen=True)
 class FormulaBase:
     system: System = field(repr=False)
@@ -54,8 +146,54 @@ class Formula(FormulaBase):
     pass
 
 
-@dataclass(frozen=True)
-class Term(FormulaBase):
+_interned: "weakref.WeakValueDictionary[Tuple[Any, ...], Interned]" = \
+        weakref.WeakValueDictionary()
+
+
+class InternedMeta(type):
+    # hash-consing: constructing a node equal to a living one returns that
+    # node, its hash is computed once from the hashes of its children
+    def __call__(cls, *args, **kwargs):
+        if kwargs:
+            args += tuple(kwargs[f.name] for f in fields(cls)[len(args):])
+        key = (cls, id(args[0])) + args[1:]
+        instance = _interned.get(key)
+        if instance is None:
+            instance = cls.__new__(cls)
+            object.__setattr__(instance, '_hash',
+                               cls._structural_hash(args[1:]))
+            instance.__init__(*args)
+            _interned[key] = instance
+        return instance
+
+
+class Interned(metaclass=InternedMeta):
+    # the system is left out of the hash, it is shared by all nodes anyway
+    @classmethod
+    def _structural_hash(cls, values: Tuple[Any, ...]) -> int:
+        return hash((cls.__name__,) + values)
+
+    def _values(self) -> Tuple[Any, ...]:
+        return tuple(getattr(self, f.name)
+                     for f in fields(self))  # type: ignore
+
+    def _same(self, other: "Interned") -> bool:
+        return self._values() == other._values()
+
+    def __hash__(self):
+        return self._hash  # type: ignore
+
+    def __eq__(self, other) -> bool:
+        return self is other or (type(self) is type(other)
+                                 and hash(self) == hash(other)
+                                 and self._same(other))
+
+    def __reduce__(self):
+        return (type(self), self._values())
+
+
+@dataclass(frozen=True, eq=False)
+class Term(Interned, FormulaBase):
     def __post_init__(self):
         super().__post_init__()
         all_terms: Set["Term"] = {self}
@@ -64,6 +202,9 @@ class Term(FormulaBase):
     def as_mona(self) -> mona.Term:
         raise NotImplementedError()
 
+    def evaluate(self, assignment: Dict["Variable", Any], size: int) -> Any:
+        raise NotImplementedError()
+
     def normalize(self,
                   substitution: Dict["Variable",
                                      "Variable"]
@@ -83,7 +224,7 @@ class Term(FormulaBase):
         return str(self) < str(other)
 
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, eq=False)
 class Constant(Term):
     value: int
 
@@ -103,8 +244,11 @@ class Constant(Term):
     def as_mona(self):
         return mona.TermConstant(self.value)
 
+    def evaluate(self, assignment: Dict["Variable", Any], size: int) -> Any:
+        return self.value
 
-@dataclass(frozen=True)
+
+@dataclass(frozen=True, eq=False)
 class Variable(Term):
     name: str
 
@@ -129,8 +273,11 @@ class Variable(Term):
     def as_mona(self):
         return mona.Variable(self.name)
 
+    def evaluate(self, assignment: Dict["Variable", Any], size: int) -> Any:
+        return assignment[self]
 
-@dataclass(frozen=True)
+
+@dataclass(frozen=True, eq=False)
 class Successor(Term):
     argument: Term
 
@@ -159,6 +306,9 @@ class Successor(Term):
     def __str__(self) -> str:
         return f"succ({self.argument})"
 
+    def evaluate(self, assignment: Dict["Variable", Any], size: int) -> Any:
+        return (self.argument.evaluate(assignment, size) + 1) % size
+
 
 @dataclass(frozen=True)
 class Predicate(Formula):
@@ -168,40 +318,23 @@ class Predicate(Formula):
     post: str
 
     def hit_pre(self) -> mona.ElementIn:
-        argument = self.argument.as_mona()
-        if not type(argument) is mona.Variable:
-            raise FormulaError(f"Predicate {self} is not normalized")
-        argument = cast(mona.Variable, argument)
-        return mona.ElementIn(
-                argument,
-                mona.Variable(self.pre))
+        return self._atoms()[0]
 
     def hit_post(self) -> mona.ElementIn:
-        argument = self.argument.as_mona()
-        if not type(argument) is mona.Variable:
-            raise FormulaError(f"Predicate {self} is not normalized")
-        argument = cast(mona.Variable, argument)
-        return mona.ElementIn(
-                argument,
-                mona.Variable(self.post))
+        return self._atoms()[1]
 
     def miss_pre(self) -> mona.ElementNotIn:
-        argument = self.argument.as_mona()
-        if not type(argument) is mona.Variable:
-            raise FormulaError(f"Predicate {self} is not normalized")
-        argument = cast(mona.Variable, argument)
-        return mona.ElementNotIn(
-                argument,
-                mona.Variable(self.pre))
+        return self._atoms()[2]
 
     def miss_post(self) -> mona.ElementNotIn:
-        argument = self.argument.as_mona()
-        if not type(argument) is mona.Variable:
+        return self._atoms()[3]
+
+    def _atoms(self) -> Tuple[mona.ElementIn, mona.ElementIn,
+                              mona.ElementNotIn, mona.ElementNotIn]:
+        atoms = self._hit_miss_atoms  # type: ignore
+        if atoms is None:
             raise FormulaError(f"Predicate {self} is not normalized")
-        argument = cast(mona.Variable, argument)
-        return mona.ElementNotIn(
-                argument,
-                mona.Variable(self.post))
+        return atoms
 
     def __post_init__(self):
         super().__post_init__()
@@ -209,6 +342,18 @@ class Predicate(Formula):
         all_terms: Set[Term] = self.argument.all_terms
         object.__setattr__(self, '_variables', variables)
         object.__setattr__(self, '_all_terms', all_terms)
+        # atoms stating that the argument is in (or not in) the pre and post
+        # state; shared by all formulae mentioning this predicate
+        atoms = None
+        if type(self.argument) is Variable:
+            argument = cast(mona.Variable, self.argument.as_mona())
+            pre = mona.Variable(self.pre)
+            post = mona.Variable(self.post)
+            atoms = (mona.ElementIn(argument, pre),
+                     mona.ElementIn(argument, post),
+                     mona.ElementNotIn(argument, pre),
+                     mona.ElementNotIn(argument, post))
+        object.__setattr__(self, '_hit_miss_atoms', atoms)
 
     def normalize(self,
                   substitution: Dict["Variable",
@@ -262,9 +407,12 @@ class Restriction(Formula):
     def as_mona(self) -> mona.Formula:
         raise NotImplementedError()
 
+    def evaluate(self, assignment: Dict["Variable", Any], size: int) -> Any:
+        raise NotImplementedError()
 
-@dataclass(frozen=True)
-class Last(Restriction):
+
+@dataclass(frozen=True, eq=False)
+class Last(Interned, Restriction):
     argument: Term
 
     def __post_init__(self):
@@ -287,9 +435,12 @@ class Last(Restriction):
         argument = self.argument.as_mona()
         return mona.PredicateCall("is_last", [argument])
 
+    def evaluate(self, assignment: Dict["Variable", Any], size: int) -> Any:
+        return self.argument.evaluate(assignment, size) == size - 1
 
-@dataclass(frozen=True)
-class Comparison(Restriction):
+
+@dataclass(frozen=True, eq=False)
+class Comparison(Interned, Restriction):
     left: Term
     right: Term
 
@@ -316,16 +467,8 @@ class Comparison(Restriction):
     def __str__(self) -> str:
         return f"{self.left} {self.comp_str} {self.right}"
 
-    def __hash__(self):
-        return hash(self.left) & hash(self.right)
-
-    def __eq__(self, other) -> bool:
-        return (type(self) is type(other)
-                and self.left == other.left
-                and self.right == other.right)
-
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, eq=False)
 class IsNext(Comparison):
     def __str__(self) -> str:
         return f"is_next({self.left}, {self.right})"
@@ -335,8 +478,13 @@ class IsNext(Comparison):
         right = self.right.as_mona()
         return mona.PredicateCall("is_next", [left, right])
 
+    def evaluate(self, assignment: Dict["Variable", Any], size: int) -> Any:
+        left = self.left.evaluate(assignment, size)
+        right = self.right.evaluate(assignment, size)
+        return right == (left + 1) % size
 
-@dataclass(frozen=True)
+
+@dataclass(frozen=True, eq=False)
 class Less(Comparison):
     def __post_init__(self):
         super().__post_init__()
@@ -347,8 +495,13 @@ class Less(Comparison):
         right = self.right.as_mona()
         return mona.Less(left, right)
 
+    def evaluate(self, assignment: Dict["Variable", Any], size: int) -> Any:
+        left = self.left.evaluate(assignment, size)
+        right = self.right.evaluate(assignment, size)
+        return left < right
 
-@dataclass(frozen=True)
+
+@dataclass(frozen=True, eq=False)
 class LessEqual(Comparison):
     def __post_init__(self):
         super().__post_init__()
@@ -359,50 +512,69 @@ class LessEqual(Comparison):
         right = self.right.as_mona()
         return mona.LessEqual(left, right)
 
+    def evaluate(self, assignment: Dict["Variable", Any], size: int) -> Any:
+        left = self.left.evaluate(assignment, size)
+        right = self.right.evaluate(assignment, size)
+        return left <= right
 
-@dataclass(frozen=True)
+
+@dataclass(frozen=True, eq=False)
 class Equal(Comparison):
     def __post_init__(self):
         super().__post_init__()
         object.__setattr__(self, '_comp_str', "=")
 
-    def __eq__(self, other) -> bool:
-        return (type(self) is type(other)
+    @classmethod
+    def _structural_hash(cls, values: Tuple[Any, ...]) -> int:
+        return hash((cls.__name__, frozenset(values)))
+
+    def _same(self, other: Interned) -> bool:
+        other = cast(Comparison, other)
+        return (self.system == other.system
                 and ((self.left == other.left
                       and self.right == other.right)
                      or (self.left == other.right
                          and self.right == other.left)))
 
-    def __hash__(self):
-        return hash(self.left) & hash(self.right)
-
     def as_mona(self):
         left = self.left.as_mona()
         right = self.right.as_mona()
         return mona.Equal(left, right)
 
+    def evaluate(self, assignment: Dict["Variable", Any], size: int) -> Any:
+        left = self.left.evaluate(assignment, size)
+        right = self.right.evaluate(assignment, size)
+        return left == right
 
-@dataclass(frozen=True)
+
+@dataclass(frozen=True, eq=False)
 class Unequal(Comparison):
     def __post_init__(self):
         super().__post_init__()
         object.__setattr__(self, '_comp_str', "~=")
 
-    def __eq__(self, other) -> bool:
-        return (type(self) is type(other)
+    @classmethod
+    def _structural_hash(cls, values: Tuple[Any, ...]) -> int:
+        return hash((cls.__name__, frozenset(values)))
+
+    def _same(self, other: Interned) -> bool:
+        other = cast(Comparison, other)
+        return (self.system == other.system
                 and ((self.left == other.left
                       and self.right == other.right)
                      or (self.left == other.right
                          and self.right == other.left)))
 
-    def __hash__(self):
-        return hash(self.left) & hash(self.right)
-
     def as_mona(self):
         left = self.left.as_mona()
         right = self.right.as_mona()
         return mona.Unequal(left, right)
 
+    def evaluate(self, assignment: Dict["Variable", Any], size: int) -> Any:
+        left = self.left.evaluate(assignment, size)
+        right = self.right.evaluate(assignment, size)
+        return left != right
+
 
 T = TypeVar("T",
             Equal,
@@ -441,7 +613,8 @@ class RestrictionCollection(Restriction, Generic[T]):
 
     def __str__(self) -> str:
         if self.restrictions:
-            restrictions = ", ".join([str(r) for r in self.restrictions])
+            restrictions = ", ".join([str(r) for r in sorted(
+                self.restrictions, key=str)])
         else:
             restrictions = "<empty>"
         return f"( {restrictions} )"
@@ -459,27 +632,13 @@ class Broadcast(Formula):
             default_factory=frozenset)
 
     def vertical_invariant(self) -> mona.Formula:
-        substitution = {v: Variable(self.system, f"substitute_{v.name}")
-                        for v in self.quantified_variables}
-        try:
-            renamed_broadcast = self.normalize(substitution)
-        except FormulaError:
-            raise FormulaError("Cannot generate formula for non-normalized"
-                               + " Broadcast {self}")
-        pos_variables = sorted([cast(mona.Variable, v.as_mona())
-                                for v in self.quantified_variables], key=str)
-        pos_guard = self.guard_as_mona()
-        neg_variables = sorted([
-            cast(mona.Variable, v.as_mona())
-            for v in renamed_broadcast.quantified_variables], key=str)
-        neg_guard = renamed_broadcast.guard_as_mona()
+        renamed_broadcast = self.renamed_broadcast
         others_empty = mona.UniversalFirstOrder(
-            neg_variables,
+            self.neg_variables,
             mona.Implication(
                 mona.Conjunction([
-                    neg_guard,
-                    mona.Unequal(cast(mona.Variable,
-                                      substitution[self.variable].as_mona()),
+                    self.neg_guard,
+                    mona.Unequal(self.renamed_variable,
                                  cast(mona.Variable,
                                       self.variable.as_mona()))]),
                 mona.Conjunction([cast(mona.Formula, p.miss_post())
@@ -492,122 +651,130 @@ class Broadcast(Formula):
                               mona.Implication(p.hit_post(), p.hit_pre())])
             for p in self.body.predicates])
         outer = mona.ExistentialFirstOrder(
-                pos_variables,
-                mona.Conjunction([pos_guard, chosen_vertical, others_empty]))
+                self.pos_variables,
+                mona.Conjunction([self.pos_guard, chosen_vertical,
+                                  others_empty]))
         return outer
 
     def one_in_pre(self) -> mona.Formula:
-        substitution = {v: Variable(self.system, f"substitute_{v.name}")
-                        for v in self.quantified_variables}
-        try:
-            renamed_broadcast = self.normalize(substitution)
-        except FormulaError:
-            raise FormulaError("Cannot generate formula for non-normalized"
-                               + " Broadcast {self}")
-        pos_variables = sorted([cast(mona.Variable, v.as_mona())
-                                for v in self.quantified_variables], key=str)
-        pos_guard = self.guard_as_mona()
-        neg_variables = sorted([
-            cast(mona.Variable, v.as_mona())
-            for v in renamed_broadcast.quantified_variables], key=str)
-        neg_guard = renamed_broadcast.guard_as_mona()
+        renamed_broadcast = self.renamed_broadcast
         inner = mona.UniversalFirstOrder(
-                neg_variables,
+                self.neg_variables,
                 mona.Implication(
                     mona.Conjunction(
-                        [neg_guard,
+                        [self.neg_guard,
                          mona.Disjunction([
                              p.hit_pre()
                              for p in renamed_broadcast.body.predicates])]),
-                    mona.Equal(cast(mona.Variable,
-                                    substitution[self.variable].as_mona()),
+                    mona.Equal(self.renamed_variable,
                                cast(mona.Variable, self.variable.as_mona()))))
         outer = mona.ExistentialFirstOrder(
-                pos_variables,
-                mona.Conjunction([pos_guard]
+                self.pos_variables,
+                mona.Conjunction([self.pos_guard]
                                  + [p.hit_pre()
                                     for p in self.body.predicates] + [inner]))
         return outer
 
     def one_in_post(self) -> mona.Formula:
-        substitution = {v: Variable(self.system, f"substitute_{v.name}")
-                        for v in self.quantified_variables}
-        try:
-            renamed_broadcast = self.normalize(substitution)
-        except FormulaError:
-            raise FormulaError("Cannot generate formula for non-normalized"
-                               + " Broadcast {self}")
-        pos_variables = sorted([cast(mona.Variable, v.as_mona())
-                                for v in self.quantified_variables], key=str)
-        pos_guard = self.guard_as_mona()
-        neg_variables = sorted([
-            cast(mona.Variable, v.as_mona())
-            for v in renamed_broadcast.quantified_variables], key=str)
-        neg_guard = renamed_broadcast.guard_as_mona()
+        renamed_broadcast = self.renamed_broadcast
         inner = mona.UniversalFirstOrder(
-                neg_variables,
+                self.neg_variables,
                 mona.Implication(
                     mona.Conjunction(
-                        [neg_guard,
+                        [self.neg_guard,
                          mona.Disjunction([
                              p.hit_post()
                              for p in renamed_broadcast.body.predicates])]),
-                    mona.Equal(cast(mona.Variable,
-                                    substitution[self.variable].as_mona()),
+                    mona.Equal(self.renamed_variable,
                                cast(mona.Variable, self.variable.as_mona()))))
         outer = mona.ExistentialFirstOrder(
-                pos_variables,
-                mona.Conjunction([pos_guard]
+                self.pos_variables,
+                mona.Conjunction([self.pos_guard]
                                  + [p.hit_post()
                                     for p in self.body.predicates] + [inner]))
         return outer
 
     def disjoint_all_pre(self) -> mona.Formula:
-        guard = self.guard_as_mona()
-        variables = sorted([cast(mona.Variable, v.as_mona())
-                            for v in self.quantified_variables], key=str)
         inner = mona.Conjunction([p.miss_pre() for p in self.body.predicates])
-        return mona.UniversalFirstOrder(variables, mona.Implication(guard,
-                                                                    inner))
+        return mona.UniversalFirstOrder(self.pos_variables,
+                                        mona.Implication(self.pos_guard,
+                                                         inner))
 
     def disjoint_all_post(self) -> mona.Formula:
-        guard = self.guard_as_mona()
-        variables = sorted([cast(mona.Variable, v.as_mona())
-                            for v in self.quantified_variables], key=str)
         inner = mona.Conjunction([p.miss_post() for p in self.body.predicates])
-        return mona.UniversalFirstOrder(variables, mona.Implication(guard,
-                                                                    inner))
+        return mona.UniversalFirstOrder(self.pos_variables,
+                                        mona.Implication(self.pos_guard,
+                                                         inner))
 
     def one_post(self) -> mona.Formula:
-        guard = self.guard_as_mona()
-        variables = sorted([cast(mona.Variable, v.as_mona())
-                            for v in self.quantified_variables], key=str)
         all_hit = mona.Conjunction([p.hit_post()
                                     for p in self.body.predicates])
         return mona.ExistentialFirstOrder(
-                variables,
-                mona.Conjunction([guard, all_hit]))
+                self.pos_variables,
+                mona.Conjunction([self.pos_guard, all_hit]))
 
     def vertical_hit(self) -> mona.Formula:
-        guard = self.guard_as_mona()
-        variables = sorted([cast(mona.Variable, v.as_mona())
-                            for v in self.quantified_variables], key=str)
         pre_post_hit = mona.Conjunction([
             mona.Implication(p.hit_pre(), p.hit_post())
             for p in self.body.predicates])
         return mona.UniversalFirstOrder(
-                variables,
-                mona.Implication(guard, pre_post_hit))
+                self.pos_variables,
+                mona.Implication(self.pos_guard, pre_post_hit))
 
     def is_dead(self) -> mona.Formula:
-        variables = sorted([cast(mona.Variable, v.as_mona())
-                            for v in self.quantified_variables], key=str)
         all_dead = mona.Conjunction([p.miss_pre()
                                      for p in self.body.predicates])
-        complete_guard = self.guard_as_mona()
         return mona.ExistentialFirstOrder(
-                variables,
-                mona.Conjunction([complete_guard, all_dead]))
+                self.pos_variables,
+                mona.Conjunction([self.pos_guard, all_dead]))
+
+    @property
+    def pos_variables(self) -> List[mona.Variable]:
+        if "_pos_variables" not in self.__dict__:
+            object.__setattr__(self, '_pos_variables', sorted(
+                [cast(mona.Variable, v.as_mona())
+                 for v in self.quantified_variables], key=str))
+        return self._pos_variables  # type: ignore
+
+    @property
+    def pos_guard(self) -> mona.Formula:
+        if "_pos_guard" not in self.__dict__:
+            object.__setattr__(self, '_pos_guard', self.guard_as_mona())
+        return self._pos_guard  # type: ignore
+
+    @property
+    def substitution(self) -> Dict[Variable, Variable]:
+        if "_substitution" not in self.__dict__:
+            object.__setattr__(self, '_substitution', {
+                v: Variable(self.system, f"substitute_{v.name}")
+                for v in self.quantified_variables})
+        return self._substitution  # type: ignore
+
+    @property
+    def renamed_broadcast(self) -> "Broadcast":
+        # copy of this broadcast with all quantified variables renamed to
+        # substitute_*, used to quantify over all other instances
+        if "_renamed_broadcast" not in self.__dict__:
+            try:
+                renamed_broadcast = self.normalize(self.substitution)
+            except FormulaError:
+                raise FormulaError("Cannot generate formula for"
+                                   + f" non-normalized Broadcast {self}")
+            object.__setattr__(self, '_renamed_broadcast', renamed_broadcast)
+        return self._renamed_broadcast  # type: ignore
+
+    @property
+    def renamed_variable(self) -> mona.Variable:
+        return cast(mona.Variable,
+                    self.substitution[self.variable].as_mona())
+
+    @property
+    def neg_variables(self) -> List[mona.Variable]:
+        return self.renamed_broadcast.pos_variables
+
+    @property
+    def neg_guard(self) -> mona.Formula:
+        return self.renamed_broadcast.pos_guard
 
     def guard_as_mona(self) -> mona.Formula:
         return mona.Disjunction([
@@ -687,8 +854,8 @@ class Broadcast(Formula):
 
     def __str__(self):
         return "broadcasting {{ {variables}: {guard}. {body} }}".format(
-                variables=", ".join([str(v)
-                                     for v in self.quantified_variables]),
+                variables=", ".join(sorted([str(v) for v in
+                                            self.quantified_variables])),
                 guard=self.guard,
                 body=" | ".join([str(p) for p in sorted(
                     self.body.predicates, key=str)]))
@@ -699,17 +866,23 @@ class Clause(Formula):
     guard: RestrictionCollection  # Conjunction of Atoms
     ports: PredicateCollection
     broadcasts: List[Broadcast]
+    # guards of merged clauses, the clause is enabled if any guard holds
+    alternative_guards: Tuple[RestrictionCollection, ...] = ()
 
-    def invariant_predicate(self, number: int) -> mona.Formula:
+    def invariant_predicate(self, number: int,
+                            options: EmissionOptions = EmissionOptions(),
+                            state_variables: Optional[List[mona.Variable]]
+                            = None) -> mona.Formula:
         inner = mona.Disjunction([
             # disjoint pre and post
             mona.Conjunction([self.disjoint_all_pre(),
                               self.disjoint_all_post()]),
             # unique pre and post
-            mona.Conjunction([self.one_in_pre(), self.one_in_post()]),
+            mona.Conjunction([self.one_in_pre(options),
+                              self.one_in_post(options)]),
             # more than one in pre
             mona.Conjunction([mona.Negation(self.disjoint_all_pre()),
-                              mona.Negation(self.one_in_pre())]),
+                              mona.Negation(self.one_in_pre(options))]),
             ])
         variables = sorted([cast(mona.Variable, v.as_mona())
                             for v in self.free_variables], key=str)
@@ -719,41 +892,41 @@ class Clause(Formula):
                 mona.Implication(guard, inner))
         return mona.PredicateDefinition(
                 f"invariant_transition_{number}",
-                self.system.state_variables,
+                state_variables or self.system.state_variables,
                 [],
                 quantification).simplify()
 
-    def one_in_all_broadcasts_pre(self) -> mona.Formula:
-        tmp = mona.Disjunction([
-            mona.Conjunction(
-                [b.one_in_pre()]
-                + [o.disjoint_all_pre()
-                   for j, o in enumerate(self.broadcasts) if i != j])
-            for i, b in enumerate(self.broadcasts)])
-        return tmp
-
-    def one_in_all_broadcasts_post(self) -> mona.Formula:
-        tmp = mona.Disjunction([
-            mona.Conjunction(
-                [b.one_in_post()]
-                + [o.disjoint_all_post()
-                   for j, o in enumerate(self.broadcasts) if i != j])
-            for i, b in enumerate(self.broadcasts)])
-        return tmp
-
-    def one_in_pre(self) -> mona.Formula:
+    def one_in_all_broadcasts_pre(self,
+                                  options: EmissionOptions = EmissionOptions()
+                                  ) -> mona.Formula:
+        return exactly_one("broadcast_pre",
+                           [(b.one_in_pre(), b.disjoint_all_pre())
+                            for b in self.broadcasts],
+                           options.exactly_one)
+
+    def one_in_all_broadcasts_post(self,
+                                   options: EmissionOptions = EmissionOptions()
+                                   ) -> mona.Formula:
+        return exactly_one("broadcast_post",
+                           [(b.one_in_post(), b.disjoint_all_post())
+                            for b in self.broadcasts],
+                           options.exactly_one)
+
+    def one_in_pre(self, options: EmissionOptions = EmissionOptions()
+                   ) -> mona.Formula:
         return mona.Disjunction([
-            mona.Conjunction([self.one_in_free_pre(),
+            mona.Conjunction([self.one_in_free_pre(options),
                               self.disjoint_all_broadcasts_pre()]),
             mona.Conjunction([self.disjoint_all_free_pre(),
-                              self.one_in_all_broadcasts_pre()])])
+                              self.one_in_all_broadcasts_pre(options)])])
 
-    def one_in_post(self) -> mona.Formula:
+    def one_in_post(self, options: EmissionOptions = EmissionOptions()
+                    ) -> mona.Formula:
         return mona.Disjunction([
-            mona.Conjunction([self.one_in_free_post(),
+            mona.Conjunction([self.one_in_free_post(options),
                               self.disjoint_all_broadcasts_post()]),
             mona.Conjunction([self.disjoint_all_free_post(),
-                              self.one_in_all_broadcasts_post()])])
+                              self.one_in_all_broadcasts_post(options)])])
 
     def disjoint_all_broadcasts_pre(self) -> mona.Formula:
         return mona.Conjunction([b.disjoint_all_pre()
@@ -779,21 +952,23 @@ class Clause(Formula):
         return mona.Conjunction([self.disjoint_all_free_post(),
                                  self.disjoint_all_broadcasts_post()])
 
-    def one_in_free_pre(self) -> mona.Formula:
-        return mona.Disjunction([
-            mona.Conjunction([cast(mona.Formula, p.hit_pre())]
-                             + [o.miss_pre()
-                                for o in self.ports.predicates if o != p])
-            for p in self.ports.predicates])
-
-    def one_in_free_post(self) -> mona.Formula:
-        return mona.Disjunction([
-            mona.Conjunction([cast(mona.Formula, p.hit_post())]
-                             + [o.miss_post()
-                                for o in self.ports.predicates if o != p])
-            for p in self.ports.predicates])
-
-    def trap_predicate(self, number: int) -> mona.Formula:
+    def one_in_free_pre(self, options: EmissionOptions = EmissionOptions()
+                        ) -> mona.Formula:
+        return exactly_one("port_pre",
+                           [(p.hit_pre(), p.miss_pre())
+                            for p in self.ports.predicates],
+                           options.exactly_one)
+
+    def one_in_free_post(self, options: EmissionOptions = EmissionOptions()
+                         ) -> mona.Formula:
+        return exactly_one("port_post",
+                           [(p.hit_post(), p.miss_post())
+                            for p in self.ports.predicates],
+                           options.exactly_one)
+
+    def trap_predicate(self, number: int,
+                       state_variables: Optional[List[mona.Variable]] = None
+                       ) -> mona.Formula:
         guard = self.guard_as_mona()
         variables = sorted([cast(mona.Variable, v.as_mona())
                             for v in self.free_variables], key=str)
@@ -820,10 +995,13 @@ class Clause(Formula):
         formula = mona.UniversalFirstOrder(variables,
                                            mona.Implication(guard, inner))
         return mona.PredicateDefinition(f"trap_transition_{number}",
-                                        self.system.state_variables,
+                                        (state_variables
+                                         or self.system.state_variables),
                                         [], formula).simplify()
 
-    def is_dead_predicate(self, number: int) -> mona.Formula:
+    def is_dead_predicate(self, number: int,
+                          state_variables: Optional[List[mona.Variable]]
+                          = None) -> mona.Formula:
         dead_free = mona.Disjunction(
                 [p.miss_pre() for p in self.ports.predicates])
         dead_broadcasts = mona.Disjunction(
@@ -836,11 +1014,29 @@ class Clause(Formula):
                                             for v in self.free_variables],
                                            inner)
         return mona.PredicateDefinition(f"dead_transition_{number}",
-                                        self.system.state_variables,
+                                        (state_variables
+                                         or self.system.state_variables),
                                         [], formula).simplify()
 
     def guard_as_mona(self):
-        return mona.Conjunction([c.as_mona() for c in self.guard.restrictions])
+        if not self.alternative_guards:
+            return mona.Conjunction([c.as_mona()
+                                     for c in self.guard.restrictions])
+        return mona.Disjunction([
+            mona.Conjunction([c.as_mona() for c in g.restrictions])
+            for g in self.guards])
+
+    @property
+    def guards(self) -> List[RestrictionCollection]:
+        return [self.guard] + list(self.alternative_guards)
+
+    @property
+    def interface_variables(self) -> Set[Variable]:
+        # free variables the ports and broadcasts depend on
+        variables: Set[Variable] = set(self.ports.variables)
+        for b in self.broadcasts:
+            variables |= b.free_variables
+        return variables
 
     def __post_init__(self):
         super().__post_init__()
@@ -849,6 +1045,10 @@ class Clause(Formula):
         free_variables: Set[Variable] = (self.ports.variables
                                          | self.guard.variables)
         all_terms: Set[Term] = self.guard.all_terms | self.ports.all_terms
+        for g in self.alternative_guards:
+            variables |= g.variables
+            free_variables |= g.variables
+            all_terms |= g.all_terms
         for b in self.broadcasts:
             variables |= b.variables
             free_variables |= b.free_variables
@@ -876,10 +1076,14 @@ class Clause(Formula):
         return self._free_variables  # type: ignore
 
     def __str__(self) -> str:
-        if res := self.guard.restrictions:  # noqa: E203, E701, E231
-            guard = " & ".join([str(g) for g in sorted(res, key=str)])
-        else:
-            guard = "true"
+        guards: List[str] = []
+        for g in self.guards:
+            if res := g.restrictions:  # noqa: E203, E701, E231
+                guards.append(" & ".join([str(r)
+                                          for r in sorted(res, key=str)]))
+            else:
+                guards.append("true")
+        guard = " | ".join(guards)
         if preds := self.ports.predicates:  # noqa: E203, E701, E231
             ports = " & ".join([str(p) for p in sorted(preds, key=str)])
         else:
@@ -980,53 +1184,300 @@ class Clause(Formula):
         return n_clause
 
     def construct_normalized_clause(self) -> "Clause":
+        if self.alternative_guards:
+            raise FormulaError(f"Cannot normalize merged clause {self}")
         n_clause = self.normalize_terms()
         n_clause = n_clause.check_type_consistency()
         return n_clause
 
 
+# clauses with more free variables are only compared under their given names
+CANONICAL_PERMUTATION_LIMIT = 6
+
+
+def _term_text(term: Term, renaming: Dict[Variable, str]) -> str:
+    if isinstance(term, Variable):
+        return renaming.get(term, term.name)
+    elif isinstance(term, Successor):
+        return f"succ({_term_text(term.argument, renaming)})"
+    return str(term)
+
+
+def _restriction_text(restriction: Restriction,
+                      renaming: Dict[Variable, str]) -> str:
+    if isinstance(restriction, RestrictionCollection):
+        return "( " + " & ".join(sorted([
+            _restriction_text(r, renaming)
+            for r in restriction.restrictions])) + " )"
+    if isinstance(restriction, Last):
+        return f"last({_term_text(restriction.argument, renaming)})"
+    restriction = cast(Comparison, restriction)
+    operands = [_term_text(restriction.left, renaming),
+                _term_text(restriction.right, renaming)]
+    if isinstance(restriction, (Equal, Unequal)):
+        # symmetric, either order may have been interned first
+        operands.sort()
+    return f"{type(restriction).__name__}({', '.join(operands)})"
+
+
+def _predicate_text(predicate: Predicate,
+                    renaming: Dict[Variable, str]) -> str:
+    return f"{predicate.name}({_term_text(predicate.argument, renaming)})"
+
+
+def _broadcast_text(broadcast: Broadcast, renaming: Dict[Variable, str]
+                    ) -> str:
+    # the quantified variables are named after the position of the
+    # broadcast in its clause, which is irrelevant for the key
+    name = broadcast.variable.name
+    local = {**renaming, **{v: v.name.replace(name, "@")
+                            for v in broadcast.quantified_variables}}
+    guard = " | ".join(sorted(
+        [_restriction_text(c, local) for c in broadcast.guard.restrictions]))
+    body = " | ".join(sorted([_predicate_text(p, local)
+                              for p in broadcast.body.predicates]))
+    return f"{guard}. {body}"
+
+
+def _canonical_renaming(parts: Callable[[Dict[Variable, str]], List[str]],
+                        variables: Set[Variable]
+                        ) -> Tuple[str, Dict[Variable, str]]:
+    # renames the variables to placeholders such that the joined parts are
+    # minimal; equal keys imply equal parts up to renaming. Placeholders
+    # cannot clash with names of the system.
+    ordered = sorted(variables, key=lambda v: v.name)
+    if len(ordered) > CANONICAL_PERMUTATION_LIMIT:
+        orders: Any = [ordered]
+    else:
+        orders = permutations(ordered)
+    best: Optional[Tuple[str, Dict[Variable, str]]] = None
+    for order in orders:
+        renaming = {v: f"#{i}" for i, v in enumerate(order)}
+        key = "\n".join(sorted(parts(renaming)))
+        if best is None or key < best[0]:
+            best = (key, renaming)
+    return cast(Tuple[str, Dict[Variable, str]], best)
+
+
+def _interface_parts(clause: Clause, renaming: Dict[Variable, str]
+                     ) -> List[str]:
+    return ([f"port {_predicate_text(p, renaming)}"
+             for p in clause.ports.predicates]
+            + [f"broadcast {_broadcast_text(b, renaming)}"
+               for b in clause.broadcasts])
+
+
+def clause_key(clause: Clause) -> str:
+    # identical for normalized clauses that only differ in the names of their
+    # free variables or in the order of their broadcasts
+    def parts(renaming: Dict[Variable, str]) -> List[str]:
+        return (_interface_parts(clause, renaming)
+                + [f"guard {_restriction_text(g, renaming)}"
+                   for g in clause.guards])
+
+    return _canonical_renaming(parts, clause.free_variables)[0]
+
+
+def clause_content(clause: Clause) -> str:
+    # identical only for clauses with the same variables, guards and
+    # broadcasts in the same order, unlike clause_key; such clauses normalize
+    # and render alike
+    parts = [" | ".join([_restriction_text(g, {}) for g in clause.guards]),
+             " & ".join(sorted([_predicate_text(p, {})
+                                for p in clause.ports.predicates]))]
+    for b in clause.broadcasts:
+        quantified = ", ".join(sorted([v.name
+                                       for v in b.quantified_variables]))
+        body = " | ".join(sorted([_predicate_text(p, {})
+                                  for p in b.body.predicates]))
+        parts.append(f"{b.variable.name} {quantified}:"
+                     + f" {_restriction_text(b.guard, {})}. {body}")
+    return "\n".join(parts)
+
+
+def _rename_term(term: Term, renaming: Dict[Variable, Variable]) -> Term:
+    if isinstance(term, Variable):
+        return renaming.get(term, term)
+    elif isinstance(term, Successor):
+        return Successor(term.system, _rename_term(term.argument, renaming))
+    return term
+
+
+def _rename_guard(guard: RestrictionCollection,
+                  renaming: Dict[Variable, Variable]
+                  ) -> RestrictionCollection:
+    restrictions: Set[Restriction] = set()
+    for r in guard.restrictions:
+        if isinstance(r, Last):
+            restrictions.add(Last(r.system,
+                                  _rename_term(r.argument, renaming)))
+        else:
+            restrictions.add(type(r)(r.system,
+                                     _rename_term(r.left, renaming),
+                                     _rename_term(r.right, renaming)))
+    return RestrictionCollection(guard.system, frozenset(restrictions))
+
+
+def _merged_guards(clause: Clause, into: Clause,
+                   renaming: Dict[Variable, Variable]
+                   ) -> List[RestrictionCollection]:
+    # variables only occurring in the guard are existentially quantified by
+    # the guard, they just must not capture a variable of the ports
+    taken = {v.name for v in into.interface_variables}
+    renaming = dict(renaming)
+    for v in sorted(clause.free_variables - clause.interface_variables):
+        name, i = v.name, 0
+        while name in taken:
+            name, i = f"x_{i}", i + 1
+        taken.add(name)
+        renaming[v] = Variable(v.system, name)
+    return [_rename_guard(g, renaming) for g in clause.guards]
+
+
+@dataclass
+class ClauseCache:
+    # work on single clauses shared by the interactions derived from one
+    # another, keyed by clause_content: the normalized clauses, and the
+    # rendered dead, trap and invariant predicates per state order and
+    # emission options together with the number they were rendered under
+    normalized: Dict[str, Clause] = field(default_factory=dict)
+    predicates: Dict[Tuple[Tuple[str, ...], EmissionOptions],
+                     Dict[str, Tuple[int, Tuple[str, ...]]]] = field(
+                             default_factory=dict)
+
+
+def _renumbered(definition: str, number: int) -> str:
+    # "pred kind_transition_i(..." as "pred kind_transition_number(..."
+    head, tail = definition.split("(", 1)
+    return f"{head.rsplit('_', 1)[0]}_{number}({tail}"
+
+
+def m2l_str_formula(formula: str) -> str:
+    # the universe size n is one past the last position $ of the string
+    translated = re.sub(r"<\s*n\b", "<= $", formula)
+    translated = re.sub(r"\bn\s*-\s*1\b", "$", translated)
+    if re.search(r"\bn\b", translated):
+        raise FormulaError(f"Cannot express {formula} in m2l-str")
+    return translated
+
+
+def _clause_predicates(clause: Clause) -> List[Predicate]:
+    predicates = list(clause.ports.predicates)
+    for b in clause.broadcasts:
+        predicates += b.body.predicates
+    return predicates
+
+
+def _clause_states(clause: Clause) -> Set[str]:
+    return {s for p in _clause_predicates(clause) for s in (p.pre, p.post)}
+
+
+def _clause_components(clause: Clause) -> FrozenSet[Component]:
+    return frozenset(clause.system.components_of_labels[p.name]
+                     for p in _clause_predicates(clause))
+
+
+def state_order(system: System, clauses: List[Clause],
+                strategy: VariableOrder) -> List[str]:
+    states = sorted(system.states)
+    if strategy == VariableOrder.COMPONENT:
+        grouped = [s for c in sorted(system.components, key=lambda c: c.name)
+                   for s in c.states]
+        return list(dict.fromkeys(grouped))
+    if strategy == VariableOrder.COOCCURRENCE:
+        # greedy: repeatedly append the state sharing the most clauses with
+        # the states placed so far, the most frequent one first
+        frequency = {s: 0 for s in states}
+        together: Dict[str, Dict[str, int]] = {s: {} for s in states}
+        for c in clauses:
+            touched = _clause_states(c)
+            for u in touched:
+                frequency[u] += 1
+                for v in touched - {u}:
+                    together[u][v] = together[u].get(v, 0) + 1
+        affinity = {s: 0 for s in states}
+        order: List[str] = []
+        remaining = list(states)
+        while remaining:
+            best = max(remaining, key=lambda s: (affinity[s], frequency[s]))
+            remaining.remove(best)
+            order.append(best)
+            for v, count in together[best].items():
+                affinity[v] += count
+        return order
+    return states
+
+
 @dataclass(frozen=True)
 class Interaction:
     clauses: List[Clause]
     system: System
     assumptions: Dict[str, str]
     properties: Dict[str, str]
+    options: EmissionOptions = field(default_factory=EmissionOptions)
+
+    def __post_init__(self):
+        order = state_order(self.system, self.clauses,
+                            self.options.variable_order)
+        object.__setattr__(self, '_state_order', order)
+        object.__setattr__(self, '_state_variables',
+                           [mona.Variable(s) for s in order])
+        object.__setattr__(self, '_clause_cache', ClauseCache())
+
+    @property
+    def state_order(self) -> List[str]:
+        return self._state_order  # type: ignore
+
+    @property
+    def state_variables(self) -> List[mona.Variable]:
+        # the state variables in the order of the emission options
+        return self._state_variables  # type: ignore
+
+    def copies(self, prefix: str) -> List[mona.Variable]:
+        return [mona.Variable(f"{prefix}{s}") for s in self.state_order]
+
+    def paired(self, first: List[mona.Variable],
+               second: List[mona.Variable]) -> List[mona.Variable]:
+        # arguments of the predicates comparing two sets per state
+        if self.options.interleave_copies:
+            return [v for pair in zip(first, second) for v in pair]
+        return first + second
 
     def invariant_predicate(self) -> mona.Formula:
         inner = mona.Conjunction([
             mona.PredicateCall(
                 f"invariant_transition_{number}",
-                self.system.state_variables)
+                self.state_variables)
             for number in range(1, len(self.clauses) + 1)])
         return mona.PredicateDefinition(
                 f"invariant",
-                self.system.state_variables,
+                self.state_variables,
                 [],
                 inner).simplify()
 
     def initially_uniquely_marked_flow_predicate(self) -> mona.Formula:
         inner = mona.Conjunction([
             mona.PredicateCall("invariant",
-                               self.system.state_variables),
+                               self.state_variables),
             mona.PredicateCall("uniquely_intersects_initial",
-                               self.system.state_variables)])
+                               self.state_variables)])
         return mona.PredicateDefinition(
                 "initially_uniquely_marked_flow",
-                self.system.state_variables,
+                self.state_variables,
                 [],
                 inner).simplify()
 
     def flow_invariant_predicate(self) -> mona.Formula:
-        flow_states = [mona.Variable(f"F{s}") for s in self.system.states]
+        flow_states = self.copies("F")
         precondition = mona.PredicateCall(
                 "initially_uniquely_marked_flow",
                 flow_states)
         postcondition = mona.PredicateCall(
                 "unique_intersection",
-                flow_states + self.system.state_variables)
+                self.paired(flow_states, self.state_variables))
         return mona.PredicateDefinition(
                 "flow_invariant",
-                self.system.state_variables,
+                self.state_variables,
                 [], mona.UniversalSecondOrder(
                     flow_states, mona.Implication(precondition, postcondition))
                 ).simplify()
@@ -1045,12 +1496,12 @@ class Interaction:
                         for pos in c.state_variables])
                     for c in self.system.components]))
         flow_invariant = mona.PredicateCall("flow_invariant",
-                                            self.system.state_variables)
+                                            self.state_variables)
         trap_invariant = mona.PredicateCall("trap_invariant",
-                                            self.system.state_variables)
+                                            self.state_variables)
         return mona.PredicateDefinition(
                 "marking",
-                self.system.state_variables,
+                self.state_variables,
                 [],
                 mona.Conjunction([
                     unique_in_component,
@@ -1058,89 +1509,308 @@ class Interaction:
                     trap_invariant,
                 ])).simplify()
 
+    def raw_formula(self, formula: str) -> str:
+        if self.options.backend == Backend.M2L_STR:
+            return m2l_str_formula(formula)
+        return formula
+
     def custom_property(self, name: str, formula: str) -> mona.Formula:
         return mona.PredicateDefinition(
                 name,
-                self.system.state_variables,
+                self.state_variables,
                 [],
-                mona.RawFormula(formula)).simplify()
+                mona.RawFormula(self.raw_formula(formula))).simplify()
+
+    def _emission_context(self):
+        # first-order variables of m2l-str are positions of the string
+        if (not self.options.default_where
+                and self.options.backend == Backend.WS1S):
+            return nullcontext()
+        return mona.default_restriction()
+
+    def _generate(self, template_name: str, **context: Any
+                  ) -> Iterator[str]:
+        # the emission mode holds while a chunk is produced, never while the
+        # stream is suspended, so renders in between keep their own mode
+        chunks = env.get_template(template_name).generate(interaction=self,
+                                                          **context)
+        while True:
+            with self._emission_context():
+                chunk = next(chunks, None)
+            if chunk is None:
+                return
+            yield chunk
+
+    def stream_base_theory(self) -> Iterator[str]:
+        return self._generate("base-theory.mona")
 
     def render_base_theory(self) -> str:
-        template = env.get_template("base-theory.mona")
-        return template.render(interaction=self)
+        return "".join(self.stream_base_theory())
+
+    def stream_property_unreachability(
+            self,
+            property_name: str,
+            cached_base_theory: Optional[str] = None) -> Iterator[str]:
+        # without a cached base theory the template includes it
+        return self._generate("proof-script.mona",
+                              base_theory=cached_base_theory,
+                              property_name=property_name)
 
     def render_property_unreachability(
             self,
             property_name: str,
             cached_base_theory: Optional[str] = None) -> str:
-        base_theory = (cached_base_theory if cached_base_theory
-                       else self.render_base_theory())
-        template = env.get_template("proof-script.mona")
-        return template.render(
-                interaction=self,
-                base_theory=base_theory,
-                property_name=property_name)
+        return "".join(self.stream_property_unreachability(
+            property_name, cached_base_theory))
+
+    def write_property_unreachability(
+            self,
+            property_name: str,
+            sink: IO[str],
+            base_theory: Optional[IO[str]] = None):
+        # copies the base theory from an already rendered file if given
+        cached_base_theory = None
+        if base_theory is not None:
+            shutil.copyfileobj(base_theory, sink)
+            cached_base_theory = ""
+        for chunk in self.stream_property_unreachability(
+                property_name, cached_base_theory):
+            sink.write(chunk)
+
+    def clause_predicates(self, number: int, clause: Clause
+                          ) -> Tuple[str, ...]:
+        # the rendered dead, trap and invariant predicates of the clause,
+        # reused from any interaction sharing the clause cache
+        rendered = self._clause_cache.predicates.setdefault(  # type: ignore
+                (tuple(self.state_order), self.options), {})
+        content = clause_content(clause)
+        if content in rendered:
+            old, definitions = rendered[content]
+            if old == number:
+                return definitions
+            return tuple(_renumbered(d, number) for d in definitions)
+        variables = self.state_variables
+        definitions = tuple(d.render() for d in [
+            clause.is_dead_predicate(number, variables),
+            clause.trap_predicate(number, variables),
+            clause.invariant_predicate(number, self.options, variables)])
+        rendered[content] = (number, definitions)
+        return definitions
 
     def property_check(self, property_name: str) -> mona.Formula:
-        return mona.PredicateCall(property_name, self.system.state_variables)
+        return mona.PredicateCall(property_name, self.state_variables)
 
     def marking_predicate_call(self) -> mona.Formula:
-        return mona.PredicateCall("marking", self.system.state_variables)
+        return mona.PredicateCall("marking", self.state_variables)
 
     @property
     def property_names(self) -> List[str]:
         return sorted(list(self.properties.keys()) + ["deadlock"])
 
     def normalize(self) -> "Interaction":
-        return Interaction([c.construct_normalized_clause()
-                            for c in self.clauses],
-                           self.system,
-                           self.assumptions,
-                           self.properties)
+        normalized = self._clause_cache.normalized  # type: ignore
+        clauses: List[Clause] = []
+        for clause in self.clauses:
+            content = clause_content(clause)
+            if content not in normalized:
+                result = clause.construct_normalized_clause()
+                normalized[content] = result
+                # normalizing a normalized clause again hits the cache too
+                normalized.setdefault(clause_content(result), result)
+            clauses.append(normalized[content])
+        return self._derive(clauses=clauses)
+
+    def _derive(self, **changes: Any) -> "Interaction":
+        # the changed interaction shares the clause cache, so unchanged
+        # clauses are neither normalized nor rendered again
+        derived = replace(self, **changes)
+        object.__setattr__(derived, '_clause_cache',
+                           self._clause_cache)  # type: ignore
+        return derived
+
+    def with_clause(self, clause: Clause, index: Optional[int] = None
+                    ) -> "Interaction":
+        # adds the clause at index, at the end by default
+        clauses = list(self.clauses)
+        clauses.insert(len(clauses) if index is None else index, clause)
+        return self._derive(clauses=clauses)
+
+    def replacing_clause(self, index: int, clause: Clause) -> "Interaction":
+        clauses = list(self.clauses)
+        clauses[index] = clause
+        return self._derive(clauses=clauses)
+
+    def without_clause(self, index: int) -> "Interaction":
+        clauses = list(self.clauses)
+        del clauses[index]
+        return self._derive(clauses=clauses)
+
+    def with_property(self, name: str, formula: str) -> "Interaction":
+        # adds the property or replaces the one of the same name
+        return self._derive(properties={**self.properties, name: formula})
+
+    def without_property(self, name: str) -> "Interaction":
+        if name not in self.properties:
+            raise FormulaError(f"No property {name}")
+        return self._derive(properties={n: f for n, f
+                                        in self.properties.items()
+                                        if n != name})
+
+    def with_assumption(self, name: str, formula: str) -> "Interaction":
+        # adds the assumption or replaces the one of the same name
+        return self._derive(assumptions={**self.assumptions, name: formula})
+
+    def without_assumption(self, name: str) -> "Interaction":
+        if name not in self.assumptions:
+            raise FormulaError(f"No assumption {name}")
+        return self._derive(assumptions={n: f for n, f
+                                         in self.assumptions.items()
+                                         if n != name})
+
+    def influencing_components(self, property_name: str
+                               ) -> FrozenSet[Component]:
+        # the components of the states the property or an assumption
+        # mentions and, transitively, all components sharing a clause with
+        # them; the deadlock property depends on every clause
+        if property_name not in self.properties:
+            return self.system.components
+        text = " ".join([self.properties[property_name],
+                         *self.assumptions.values()])
+        words = set(re.findall(r"\w+", text))
+        cone = {c for c in self.system.components if words & set(c.states)}
+        touched = [_clause_components(c) for c in self.clauses]
+        grown = True
+        while grown:
+            grown = False
+            for components in touched:
+                if components & cone and not components <= cone:
+                    cone |= components
+                    grown = True
+        return frozenset(cone)
+
+    def restricted_to(self, components: FrozenSet[Component],
+                      property_name: str) -> "Interaction":
+        # the interaction of the given components and their clauses with
+        # just the property. Clauses of the other components never change a
+        # state of the given ones, so the reachable markings restricted to
+        # them are those of the restricted interaction and unreachability of
+        # a property of their states carries over.
+        clauses: List[Clause] = []
+        for clause in self.clauses:
+            touched = _clause_components(clause)
+            if touched <= components:
+                clauses.append(clause)
+            elif touched & components:
+                raise FormulaError(f"{clause} connects kept and removed"
+                                   + " components")
+        properties = {n: f for n, f in self.properties.items()
+                      if n == property_name}
+        return self._derive(clauses=clauses, system=System(components),
+                            properties=properties)
+
+    def cone_of_influence(self, property_name: str) -> "Interaction":
+        # the interaction restricted to the components that can influence
+        # the property, itself if there are no others
+        cone = self.influencing_components(property_name)
+        if not cone or cone == self.system.components:
+            return self
+        for component in sorted(self.system.components - cone,
+                                key=lambda c: c.name):
+            logger.info(f"{property_name}: leaving out component"
+                        + f" {component.name}, it cannot influence the"
+                        + " property")
+        reduced = self.restricted_to(cone, property_name)
+        for clause in self.clauses:
+            if not _clause_components(clause) <= cone:
+                logger.info(f"{property_name}: leaving out clause {clause}")
+        return reduced
+
+    def optimize_clauses(self) -> "Interaction":
+        # every clause is encoded as "for all free variables: guard implies
+        # a formula over ports and broadcasts", and all clauses are
+        # conjoined; so equivalent clauses are redundant and clauses with
+        # equal ports and broadcasts can share one disjunctive guard
+        unique: Dict[str, Clause] = {}
+        for clause in self.clauses:
+            key = clause_key(clause)
+            if key in unique:
+                logger.info(f"removing clause\n\t{clause}\nequivalent to"
+                            + f"\n\t{unique[key]}")
+            else:
+                unique[key] = clause
+        groups: Dict[str, List[Tuple[Clause, Dict[Variable, str]]]] = {}
+        for clause in unique.values():
+            key, renaming = _canonical_renaming(
+                    partial(_interface_parts, clause),
+                    clause.interface_variables)
+            groups.setdefault(key, []).append((clause, renaming))
+        clauses: List[Clause] = []
+        for group in groups.values():
+            first, first_renaming = group[0]
+            if len(group) == 1:
+                clauses.append(first)
+                continue
+            names: Dict[str, Variable] = {
+                    placeholder: v
+                    for v, placeholder in first_renaming.items()}
+            guards = first.guards
+            for clause, renaming in group[1:]:
+                to_first = {v: names[renaming[v]]
+                            for v in clause.interface_variables}
+                for guard in _merged_guards(clause, first, to_first):
+                    if guard not in guards:
+                        guards.append(guard)
+            merged = Clause(self.system, first.guard, first.ports,
+                            first.broadcasts, tuple(guards[1:]))
+            logger.info("merged clauses\n\t"
+                        + "\n\t".join([str(c) for c, _ in group])
+                        + f"\nto\n\t{merged}")
+            clauses.append(merged)
+        return self._derive(clauses=clauses)
 
     def trap_predicate(self) -> mona.Formula:
         inner = mona.Conjunction(
                 [mona.PredicateCall(f"trap_transition_{number}",
-                                    self.system.state_variables)
+                                    self.state_variables)
                  for number in range(1, len(self.clauses) + 1)])
         return mona.PredicateDefinition(
                 "trap",
-                self.system.state_variables,
+                self.state_variables,
                 [],
                 inner).simplify()
 
     def deadlock_predicate(self) -> mona.Formula:
         inner = mona.Conjunction(
                 [mona.PredicateCall(f"dead_transition_{number}",
-                                    self.system.state_variables)
+                                    self.state_variables)
                  for number in range(1, len(self.clauses) + 1)])
         return mona.PredicateDefinition(
                 "deadlock",
-                self.system.state_variables,
+                self.state_variables,
                 [],
                 inner).simplify()
 
     def initially_marked_trap_predicate(self) -> mona.Formula:
         inner = mona.Conjunction([
             mona.PredicateCall("trap",
-                               self.system.state_variables),
+                               self.state_variables),
             mona.PredicateCall("intersects_initial",
-                               self.system.state_variables)])
+                               self.state_variables)])
         return mona.PredicateDefinition(
                 "initially_marked_trap",
-                self.system.state_variables,
+                self.state_variables,
                 [],
                 inner).simplify()
 
     def trap_invariant_predicate(self) -> mona.Formula:
-        trap_states = [mona.Variable(f"T{s}") for s in self.system.states]
+        trap_states = self.copies("T")
         precondition = mona.PredicateCall("initially_marked_trap", trap_states)
         postcondition = mona.PredicateCall(
                 "intersection",
-                trap_states + self.system.state_variables)
+                self.paired(trap_states, self.state_variables))
         return mona.PredicateDefinition(
                 "trap_invariant",
-                self.system.state_variables,
+                self.state_variables,
                 [],
                 mona.UniversalSecondOrder(trap_states,
                                           mona.Implication(precondition,
@@ -1149,8 +1819,8 @@ class Interaction:
 
     def intersection_predicate(self) -> mona.Formula:
         x = mona.Variable("x")
-        one_states = [mona.Variable(f"one{s}") for s in self.system.states]
-        two_states = [mona.Variable(f"two{s}") for s in self.system.states]
+        one_states = self.copies("one")
+        two_states = self.copies("two")
         in_both_states = cast(List[mona.Formula],
                               [mona.Conjunction([mona.ElementIn(x, o),
                                                  mona.ElementIn(x, t)])
@@ -1158,31 +1828,25 @@ class Interaction:
         quantified_formula = mona.ExistentialFirstOrder(
                 [x], mona.Disjunction(in_both_states))
         return mona.PredicateDefinition("intersection",
-                                        one_states + two_states,
+                                        self.paired(one_states, two_states),
                                         [], quantified_formula
                                         ).simplify()
 
     def unique_intersection_predicate(self) -> mona.Formula:
         x = mona.Variable("x")
         y = mona.Variable("y")
-        one_states = [mona.Variable(f"one{s}") for s in self.system.states]
-        two_states = [mona.Variable(f"two{s}") for s in self.system.states]
+        one_states = self.copies("one")
+        two_states = self.copies("two")
         pairs = list(zip(one_states, two_states))
 
-        statements: List[mona.Formula] = []
         # fix x in intersection of one state:
-        for pair in pairs:
-            pos = [cast(mona.Formula, mona.ElementIn(x, state))
-                   for state in pair]
-            different_pairs = [p for p in pairs if p != pair]
-            neg = [  # negated statement from above
-                    cast(mona.Formula, mona.Negation(
-                        mona.Conjunction(
-                            [mona.ElementIn(x, state) for state in pair])))
-                    # for all other pairs
-                    for pair in different_pairs]
-            statements.append(mona.Conjunction(pos + neg))
-        fix_x = mona.Disjunction(statements)
+        in_pair = [mona.Conjunction([mona.ElementIn(x, state)
+                                     for state in pair])
+                   for pair in pairs]
+        fix_x = exactly_one("pair",
+                            [(cast(mona.Formula, p), mona.Negation(p))
+                             for p in in_pair],
+                            self.options.exactly_one)
         # make sure x is unique:
         # y is in intersection
         y_in_intersection = mona.Disjunction([
@@ -1196,7 +1860,7 @@ class Interaction:
                                                                     unique_x]))
         return mona.PredicateDefinition(
                 "unique_intersection",
-                one_states + two_states, [], formula).simplify()
+                self.paired(one_states, two_states), [], formula).simplify()
 
     def intersects_initial_predicate(self) -> mona.Formula:
         x = mona.Variable("x")
@@ -1206,7 +1870,7 @@ class Interaction:
                 [mona.ElementIn(x, init) for init in initial_states])
         formula = mona.ExistentialFirstOrder([x], x_initial)
         return mona.PredicateDefinition("intersects_initial",
-                                        self.system.state_variables,
+                                        self.state_variables,
                                         [], formula).simplify()
 
     def uniquely_intersects_initial_predicate(self) -> mona.Formula:
@@ -1214,15 +1878,11 @@ class Interaction:
         y = mona.Variable("y")
         initial_states = [mona.Variable(c.initial_state)
                           for c in self.system.components]
-        statements: List[mona.Formula] = []
-        for init in initial_states:
-            other_initial_states = [i for i in initial_states if i != init]
-            x_only_in_init = mona.Conjunction(
-                    [cast(mona.Formula, mona.ElementIn(x, init))]
-                    + [cast(mona.Formula, mona.ElementNotIn(x, i))
-                       for i in other_initial_states])
-            statements.append(x_only_in_init)
-        x_in_only_one_initial = mona.Disjunction(statements)
+        x_in_only_one_initial = exactly_one(
+                "initial",
+                [(mona.ElementIn(x, init), mona.ElementNotIn(x, init))
+                 for init in initial_states],
+                self.options.exactly_one)
         y_in_initial = mona.Disjunction(
                 [mona.ElementIn(y, i) for i in initial_states])
         x_unique = mona.UniversalFirstOrder([y], mona.Implication(
@@ -1232,4 +1892,4 @@ class Interaction:
                 mona.Conjunction([x_in_only_one_initial, x_unique]))
         return mona.PredicateDefinition(
                 "uniquely_intersects_initial",
-                self.system.state_variables, [], formula).simplify()
+                self.state_variables, [], formula).simplify()
@@ -0,0 +1,143 @@
+#!python3
+from dataclasses import dataclass, fields
+
+from typing import List
+from random import Random
+
+import argparse
+
+
+@dataclass(frozen=True)
+class SystemShape:
+    # size of a generated system; broadcasts are spread over the clauses
+    # round-robin, every guard term is nested in up to succ_depth succ(.)
+    components: int = 2
+    states: int = 4
+    clauses: int = 8
+    broadcasts: int = 2
+    guard_size: int = 1
+    succ_depth: int = 0
+    seed: int = 0
+
+
+_COMPARISONS = ["~=", "<", "<=", "="]
+
+
+def _state(component: int, state: int) -> str:
+    return f"c{component}s{state}"
+
+
+def _step(component: int, state: int) -> str:
+    return f"c{component}step{state}"
+
+
+def _stay(component: int, state: int) -> str:
+    return f"c{component}is{state}"
+
+
+def _component(shape: SystemShape, c: int) -> List[str]:
+    # a ring of steps through all states and a self loop in every state, so
+    # broadcasts can offer a label to every agent
+    lines = [f"Component C{c} <{_state(c, 0)}> {{"]
+    for s in range(shape.states):
+        lines.append(f"  {_state(c, s)} -> {_step(c, s)}"
+                     + f" -> {_state(c, (s + 1) % shape.states)}")
+    for s in range(shape.states):
+        lines.append(f"  {_state(c, s)} -> {_stay(c, s)} -> {_state(c, s)}")
+    lines.append("}")
+    return lines
+
+
+def _term(shape: SystemShape, random: Random, variable: str) -> str:
+    term = variable
+    for _ in range(random.randint(0, shape.succ_depth)):
+        term = f"succ({term})"
+    return term
+
+
+def _guard(shape: SystemShape, random: Random, variables: List[str]
+           ) -> List[str]:
+    # every restriction relates a variable to a constant or to another
+    # variable, so guards are rarely contradictory
+    restrictions = []
+    for _ in range(shape.guard_size):
+        left, *others = random.sample(variables, len(variables))
+        if others and random.random() < 0.5:
+            right = _term(shape, random, others[0])
+        else:
+            right = str(random.randrange(3))
+        comparison = random.choice(_COMPARISONS)
+        if comparison == "<" and right == "0":
+            comparison = "~="
+        restrictions.append(f"{_term(shape, random, left)} {comparison}"
+                            + f" {right}")
+    return restrictions
+
+
+def _clause(shape: SystemShape, random: Random, number: int) -> str:
+    ports = [(random.randrange(shape.components), "x")]
+    if random.random() < 0.5:
+        c = random.randrange(shape.components)
+        # two ports of one component need two agents
+        ports.append((c, "y" if c == ports[0][0] else random.choice("xy")))
+    variables = sorted({v for _, v in ports})
+    predicates = [f"{_step(c, random.randrange(shape.states))}({v})"
+                  for c, v in ports]
+    text = " & ".join(predicates)
+    guard = _guard(shape, random, variables)
+    if len(variables) > 1:
+        guard.append("x ~= y")
+    if guard:
+        text = f"{' & '.join(guard)}. {text}"
+    broadcasts = range(number, shape.broadcasts, shape.clauses)
+    for i, _ in enumerate(broadcasts):
+        c = random.randrange(shape.components)
+        moving = random.randrange(shape.states)
+        body = [f"{_step(c, s) if s == moving else _stay(c, s)}(b{i})"
+                for s in range(shape.states)]
+        exclude = " & ".join(f"b{i} ~= {v}" for v in variables)
+        text += (f"\n    broadcasting {{ b{i}: {exclude}."
+                 + f" {' | '.join(body)} }}")
+    return text
+
+
+def generate(shape: SystemShape) -> str:
+    random = Random(shape.seed)
+    lines = [f"# generated: {shape}", ""]
+    for c in range(shape.components):
+        lines += _component(shape, c) + [""]
+    lines.append("Formula {")
+    for number in range(shape.clauses):
+        lines.append(f"  {_clause(shape, random, number)};")
+    lines += ["}", ""]
+    last = _state(0, shape.states - 1)
+    lines += ["property \"crowded\" {",
+              "  \"ex1 i, j: 0 <= i & i < n & 0 <= j & j < n & i ~= j"
+              + f" & i in {last} & j in {last}\"",
+              "}", ""]
+    return "\n".join(lines)
+
+
+def add_shape_arguments(parser: argparse.ArgumentParser):
+    for f in fields(SystemShape):
+        parser.add_argument(f"--{f.name.replace('_', '-')}",
+                            type=int,
+                            default=f.default)
+
+
+def shape_from_arguments(args: argparse.Namespace, **overrides: int
+                         ) -> SystemShape:
+    values = {f.name: getattr(args, f.name) for f in fields(SystemShape)}
+    values.update(overrides)
+    return SystemShape(**values)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+            description="print a synthetic system of the given shape")
+    add_shape_arguments(parser)
+    print(generate(shape_from_arguments(parser.parse_args())), end="")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+from dataclasses import dataclass
+
+from typing import List, Dict, Optional
+from datetime import datetime
+
+import hashlib
+import logging
+import sqlite3
+
+logger = logging.getLogger(__name__)
+
+
+class HistoryError(Exception):
+    pass
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    system_hash TEXT NOT NULL,
+    filename TEXT NOT NULL,
+    property TEXT NOT NULL,
+    options TEXT NOT NULL,
+    started REAL NOT NULL,
+    duration REAL NOT NULL,
+    peak_rss INTEGER NOT NULL,
+    verdict TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS runs_by_check
+    ON runs (system_hash, property, options, started);
+CREATE INDEX IF NOT EXISTS runs_by_file ON runs (filename, started);
+"""
+
+
+def system_hash(filename: str) -> str:
+    with open(filename, "rb") as system_file:
+        return hashlib.sha256(system_file.read()).hexdigest()
+
+
+@dataclass
+class Run:
+    system_hash: str
+    filename: str
+    property_name: str
+    # emission options the script was rendered with
+    options: str
+    # seconds since the epoch, wall-clock seconds and peak RSS in KiB
+    started: float
+    duration: float
+    peak_rss: int
+    verdict: str
+
+
+@dataclass
+class Estimate:
+    duration: float
+    peak_rss: int
+
+
+class History:
+    # durations, peak memory and verdicts of past checks in a local SQLite
+    # database; estimates average the most recent runs of the same check
+    recent = 5
+
+    def __init__(self, path: str):
+        try:
+            self.connection = sqlite3.connect(path)
+            self.connection.executescript(_SCHEMA)
+        except sqlite3.Error as e:
+            raise HistoryError(f"Cannot open history {path}: {e}")
+
+    def close(self):
+        self.connection.close()
+
+    def record(self, run: Run):
+        with self.connection:
+            self.connection.execute(
+                    "INSERT INTO runs VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (run.system_hash, run.filename, run.property_name,
+                     run.options, run.started, run.duration, run.peak_rss,
+                     run.verdict))
+
+    def estimate(self, system_hash: str, property_name: str, options: str
+                 ) -> Optional[Estimate]:
+        # failed runs say little about the cost of a check
+        rows = self.connection.execute(
+                "SELECT duration, peak_rss FROM runs"
+                + " WHERE system_hash = ? AND property = ? AND options = ?"
+                + " AND verdict != 'error' ORDER BY started DESC LIMIT ?",
+                (system_hash, property_name, options, self.recent)
+                ).fetchall()
+        if not rows:
+            return None
+        return Estimate(sum(d for d, _ in rows) / len(rows),
+                        max(r for _, r in rows))
+
+    def runs(self, filename: str) -> List[Run]:
+        return [Run(*row) for row in self.connection.execute(
+            "SELECT system_hash, filename, property, options, started,"
+            + " duration, peak_rss, verdict FROM runs WHERE filename = ?"
+            + " ORDER BY started", (filename,))]
+
+    def report(self, filename: str) -> List[str]:
+        # per property the runs over time: latest against first and mean,
+        # and how many versions of the system were checked
+        runs = self.runs(filename)
+        if not runs:
+            return [f"{filename}: no recorded runs"]
+        by_property: Dict[str, List[Run]] = {}
+        for run in runs:
+            by_property.setdefault(run.property_name, []).append(run)
+        versions = len({r.system_hash for r in runs})
+        lines = [f"{filename}: {len(runs)} runs of {versions} versions"]
+        for property_name, history in sorted(by_property.items()):
+            first, last = history[0], history[-1]
+            mean = sum(r.duration for r in history) / len(history)
+            change = ""
+            if first.duration > 0:
+                change = f" ({last.duration / first.duration - 1:+.0%})"
+            date = datetime.fromtimestamp(last.started).strftime(
+                    "%Y-%m-%d %H:%M")
+            lines.append(
+                    f"  {property_name}: {len(history)} runs, last {date}"
+                    + f" {last.verdict} in {last.duration:.2f}s"
+                    + f" using {last.peak_rss / 1024:.0f} MiB,"
+                    + f" first {first.duration:.2f}s{change},"
+                    + f" mean {mean:.2f}s")
+        return lines
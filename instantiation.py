@@ -0,0 +1,199 @@
+from dataclasses import dataclass
+
+from typing import List, Dict, Tuple, Any, Iterator
+from itertools import combinations, product
+from math import prod
+
+from formula import Interaction, Clause, Broadcast, Predicate
+from formula import RestrictionCollection
+from processnet import PetriNet, Process
+
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class InstantiationError(Exception):
+    pass
+
+
+@dataclass
+class Instance:
+    # the net of an interaction for a fixed number of agents; agent i in
+    # state s is place i * |states| + id of s in the system index
+    interaction: Interaction
+    size: int
+    net: PetriNet
+
+    def place(self, agent: int, state: str) -> int:
+        index = self.interaction.system.index
+        return agent * len(index.states) + index.state_ids[state]
+
+    def marking(self, marking: np.ndarray) -> Dict[str, List[int]]:
+        states = self.interaction.system.index.states
+        marked = np.asarray(marking).reshape(self.size, len(states)) > 0
+        return {s: np.flatnonzero(marked[:, j]).tolist()
+                for j, s in enumerate(states)}
+
+
+def _evaluate_guards(guards: List[RestrictionCollection],
+                     assignment: Dict[Any, Any], size: int,
+                     shape: Tuple[int, ...]) -> np.ndarray:
+    holds = np.zeros(shape, dtype=bool)
+    for guard in guards:
+        conjunct = np.ones(shape, dtype=bool)
+        for r in guard.restrictions:
+            conjunct &= r.evaluate(assignment, size)
+        holds |= conjunct
+    return holds
+
+
+class _ClauseInstantiation:
+    def __init__(self, instance: Instance, clause: Clause, number: int):
+        self.instance = instance
+        self.clause = clause
+        self.number = number
+        self.size = instance.size
+        self.index = instance.interaction.system.index
+        self.ports = sorted(clause.ports.predicates, key=str)
+        self.variables = sorted(clause.free_variables, key=str)
+
+    def component(self, predicate: Predicate) -> int:
+        return self.index.edges[predicate.name][0]
+
+    def agents(self, predicate: Predicate, assignment: Dict[Any, Any],
+               shape: Tuple[int, ...]) -> np.ndarray:
+        # agents a port refers to, constants beyond the instance yield -1
+        agents = np.broadcast_to(
+                predicate.argument.evaluate(assignment, self.size), shape)
+        return np.where(agents < self.size, agents, -1)
+
+    def assignments(self, chunk: int = 1 << 16
+                    ) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+        # assignments of the free variables satisfying guard and ports, in
+        # chunks of the size ** variables candidates
+        k = len(self.variables)
+        total = self.size ** k
+        for start in range(0, total, chunk):
+            numbers = np.arange(start, min(start + chunk, total))
+            grid = np.zeros((k, len(numbers)), dtype=np.int64)
+            for i in reversed(range(k)):
+                grid[i] = numbers % self.size
+                numbers = numbers // self.size
+            yield self._valid(grid)
+
+    def _valid(self, grid: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        shape = (grid.shape[1],)
+        assignment = {v: grid[i] for i, v in enumerate(self.variables)}
+        valid = _evaluate_guards(self.clause.guards, assignment, self.size,
+                                 shape)
+        agents = [self.agents(p, assignment, shape) for p in self.ports]
+        for a in agents:
+            valid &= a >= 0
+        for (i, p), (j, q) in combinations(enumerate(self.ports), 2):
+            if self.component(p) == self.component(q):
+                valid &= agents[i] != agents[j]
+        agents_array = np.array(agents, dtype=np.int64
+                                ).reshape(len(agents), shape[0])
+        return grid[:, valid], agents_array[:, valid]
+
+    def broadcast_options(self, broadcast: Broadcast,
+                          assignment: Dict[Any, Any],
+                          ports: List[int]
+                          ) -> List[List[Tuple[int, Predicate]]]:
+        # for every participating agent the (affected agent, predicate)
+        # pairs it may choose from
+        everyone = np.arange(self.size)
+        local = dict(assignment)
+        local[broadcast.variable] = everyone
+        try:
+            participating = np.zeros(self.size, dtype=bool)
+            for conjunct in broadcast.guard.restrictions:
+                participating |= _evaluate_guards(
+                        [conjunct], local, self.size, (self.size,))
+        except KeyError:
+            raise InstantiationError("Cannot instantiate normalized"
+                                     + f" broadcast {broadcast}")
+        body = sorted(broadcast.body.predicates, key=str)
+        component = self.component(body[0])
+        # as in the normalization, ports of the same type are never shadowed
+        for p, agent in zip(self.ports, ports):
+            if self.component(p) == component:
+                participating[agent] = False
+        affected = [self.agents(p, local, (self.size,)) for p in body]
+        return [[(int(a[b]), p) for a, p in zip(affected, body) if a[b] >= 0]
+                for b in np.flatnonzero(participating)]
+
+    def add_transitions(self, budget: int) -> int:
+        added = 0
+        for grid, agents in self.assignments():
+            added += self._add_transitions(grid, agents, budget - added)
+        return added
+
+    def _add_transitions(self, grid: np.ndarray, agents: np.ndarray,
+                         budget: int) -> int:
+        states = len(self.index.states)
+        added = 0
+        for column in range(grid.shape[1]):
+            assignment = {v: int(grid[i, column])
+                          for i, v in enumerate(self.variables)}
+            ports = [int(a) for a in agents[:, column]]
+            pre = [a * states + self.index.state_ids[p.pre]
+                   for a, p in zip(ports, self.ports)]
+            post = [a * states + self.index.state_ids[p.post]
+                    for a, p in zip(ports, self.ports)]
+            used = {(self.component(p), a) for a, p in zip(ports, self.ports)}
+            options: List[List[Tuple[int, Predicate]]] = []
+            for b in self.clause.broadcasts:
+                options += self.broadcast_options(b, assignment, ports)
+            if any(not o for o in options):
+                continue
+            count = prod([len(o) for o in options])
+            if added + count > budget:
+                raise InstantiationError(
+                        f"Clause {self.number} exceeds the transition limit"
+                        + f" for size {self.size}")
+            label = (self.number, tuple(sorted(
+                (str(v), a) for v, a in assignment.items())))
+            for choice in product(*options):
+                moved = [(self.component(p), a) for a, p in choice]
+                if len(set(moved) | used) != len(moved) + len(used):
+                    # an agent cannot take two steps in one transition
+                    continue
+                self.instance.net.add_transition(
+                        pre + [a * states + self.index.state_ids[p.pre]
+                               for a, p in choice],
+                        post + [a * states + self.index.state_ids[p.post]
+                                for a, p in choice],
+                        label + (tuple((a, p.name) for a, p in choice),))
+                added += 1
+        return added
+
+
+def instantiate(interaction: Interaction, size: int,
+                max_transitions: int = 1000000) -> Instance:
+    # expects the clauses as parsed, broadcasts are expanded into one
+    # transition per choice of every participating agent
+    if size < 1:
+        raise InstantiationError("Instances have at least one agent")
+    index = interaction.system.index
+    root = Process(0, "system")
+    net = PetriNet(root)
+    initial = {c.initial_state for c in index.components}
+    for agent in range(size):
+        process = root.add_child_process(agent)
+        for state in index.states:
+            net.add_place(process.add_place(state),
+                          1 if state in initial else 0)
+    instance = Instance(interaction, size, net)
+    budget = max_transitions
+    for number, clause in enumerate(interaction.clauses, 1):
+        added = _ClauseInstantiation(instance, clause, number
+                                     ).add_transitions(budget)
+        logger.debug(f"clause {number} yields {added} transitions")
+        budget -= added
+    logger.info(f"instantiated {net.number_of_places} places and"
+                + f" {net.number_of_transitions} transitions for size {size}")
+    return instance
@@ -1,19 +1,26 @@
 #!python3
 from parser import parse_file
+from formula import EmissionOptions, ExactlyOneEncoding, VariableOrder
+from formula import LINEAR_EXACTLY_ONE_MINIMUM
+from formula import Backend, FormulaError, Interaction
+
+from history import Run, system_hash
+from scheduler import Job, order, run as run_jobs
+from util import write_tmp_file
+
+from dataclasses import replace
+from contextlib import ExitStack
+
+from typing import IO
 
 import argparse
 import logging
+import os
+import time
 
 logger = logging.getLogger(__name__)
 
 
-def write_tmp_file(content: str) -> str:
-    from tempfile import NamedTemporaryFile
-    with NamedTemporaryFile(mode="w", delete=False) as tmp_file:
-        print(content, file=tmp_file, flush=True)
-        return tmp_file.name
-
-
 def call_mona(scriptfile: str) -> str:
     from subprocess import run
     result = run(f"mona -q {scriptfile}",
@@ -24,6 +31,23 @@ def call_mona(scriptfile: str) -> str:
     return result.stdout
 
 
+def replay_counterexample(filename: str, interaction: Interaction,
+                          property_name: str, output: str, backend: Backend,
+                          limit: int):
+    from counterexample import CounterexampleError, parse_example, replay
+    try:
+        counterexample = parse_example(output, interaction, backend)
+    except CounterexampleError as e:
+        logger.warning(f"cannot decode counterexample: {e}")
+        return
+    logger.info(f"replaying counterexample of size {counterexample.size}")
+    result = replay(interaction, counterexample, property_name, limit)
+    print(f"{filename}: Counterexample to {property_name} of size"
+          + f" {result.size} is {result.verdict.value} ({result.reason})")
+    if result.witness is not None:
+        logger.info(f"reachable marking: {result.witness}")
+
+
 def main():
     parser = argparse.ArgumentParser()
 
@@ -43,7 +67,140 @@ def main():
                         action="count",
                         default=0)
 
+    parser.add_argument("--simulate",
+                        help=("randomly simulate instances of the given size"
+                              + " " + "before proving to falsify properties"),
+                        type=int,
+                        metavar="SIZE")
+
+    parser.add_argument("--runs",
+                        help="number of simultaneous simulation runs",
+                        type=int,
+                        default=256)
+
+    parser.add_argument("--steps",
+                        help="number of steps of every simulation run",
+                        type=int,
+                        default=1000)
+
+    parser.add_argument("--exactly-one",
+                        help=("encoding of \"exactly one port or broadcast\""
+                              + " " + "in flow invariant predicates; linear"
+                              + " " + "only applies from"
+                              + " " + f"{LINEAR_EXACTLY_ONE_MINIMUM} items on,"
+                              + " " + "below it renders larger"),
+                        choices=[e.value for e in ExactlyOneEncoding],
+                        default=ExactlyOneEncoding.QUADRATIC.value)
+
+    parser.add_argument("--merge-clauses",
+                        help=("remove equivalent clauses and merge clauses"
+                              + " " + "that only differ in their guard"),
+                        action="store_true")
+
+    parser.add_argument("--cone-of-influence",
+                        help=("leave the components that cannot influence a"
+                              + " " + "property and their clauses out of its"
+                              + " " + "proof script"),
+                        action="store_true")
+
+    parser.add_argument("--variable-order",
+                        help=("order of the state variables in declarations"
+                              + " " + "and predicate signatures"),
+                        choices=[o.value for o in VariableOrder],
+                        default=VariableOrder.ALPHABETICAL.value)
+
+    parser.add_argument("--interleave-copies",
+                        help=("interleave copies of the state variables with"
+                              + " " + "the sets they are compared to"),
+                        action="store_true")
+
+    parser.add_argument("--default-where",
+                        help=("restrict first-order variables to the universe"
+                              + " " + "once by defaultwhere1 instead of"
+                              + " " + "guarding every quantifier; this also"
+                              + " " + "bounds the quantifiers of properties"
+                              + " " + "and assumptions, which are otherwise"
+                              + " " + "left unguarded (experimental, the use"
+                              + " " + "of n in defaultwhere1 is not yet"
+                              + " " + "checked against MONA)"),
+                        action="store_true")
+
+    parser.add_argument("--backend",
+                        help=("logic of the emitted scripts, m2l-str encodes"
+                              + " " + "the universe as the positions of a"
+                              + " " + "finite string"),
+                        choices=[b.value for b in Backend],
+                        default=Backend.WS1S.value)
+
+    parser.add_argument("--replay",
+                        help=("decode the example of every property MONA"
+                              + " " + "cannot prove and classify it as"
+                              + " " + "genuine or spurious by exploring the"
+                              + " " + "instance of its size"),
+                        action="store_true")
+
+    parser.add_argument("--replay-limit",
+                        help="number of markings explored per replay",
+                        type=int,
+                        default=1 << 20)
+
+    parser.add_argument("--jobs",
+                        help="number of proof scripts checked at once",
+                        type=int,
+                        default=1)
+
+    parser.add_argument("--memory-budget",
+                        help=("start a check only if the peak memory of the"
+                              + " " + "running checks, as recorded in the"
+                              + " " + "history, stays within this budget;"
+                              + " " + "checks without a record run alone"
+                              + " " + "unless --default-memory is given"),
+                        type=int,
+                        metavar="MIB")
+
+    parser.add_argument("--default-memory",
+                        help=("peak memory expected of a check without a"
+                              + " " + "record in the history"),
+                        type=int,
+                        metavar="MIB")
+
+    parser.add_argument("--history",
+                        help=("SQLite database recording duration, peak"
+                              + " " + "memory and verdict of every check;"
+                              + " " + "checks expected to take longest are"
+                              + " " + "started first"),
+                        metavar="FILE")
+
+    parser.add_argument("--report",
+                        help=("print the recorded performance of the given"
+                              + " " + "files over time instead of checking"
+                              + " " + "them"),
+                        action="store_true")
+
+    parser.add_argument("--profile",
+                        help=("profile every phase with cProfile and write"
+                              + " " + "pstats and collapsed stacks for"
+                              + " " + "flame graphs per phase to this"
+                              + " " + "directory"),
+                        metavar="DIR")
+
+    parser.add_argument("--profile-mona",
+                        help="also profile the wait for mona",
+                        action="store_true")
+
+    parser.add_argument("--memory-report",
+                        help=("trace allocations and write peak and retained"
+                              + " " + "memory of every phase by object type"
+                              + " " + "and allocation site to this file;"
+                              + " " + "slow"),
+                        metavar="FILE")
+
     args = parser.parse_args()
+    options = EmissionOptions(ExactlyOneEncoding(args.exactly_one),
+                              VariableOrder(args.variable_order),
+                              args.interleave_copies,
+                              args.default_where,
+                              Backend(args.backend))
 
     verbosity = 2 + args.v - args.q
     verbosity = max(0, min(verbosity, 4))
@@ -59,30 +216,163 @@ def main():
     elif verbosity == 4:
         logging.basicConfig(level=logging.DEBUG)
 
+    history = None
+    if args.history:
+        from history import History
+        history = History(args.history)
+    if args.report:
+        if history is None:
+            parser.error("--report needs --history")
+        for filename in args.file:
+            print("\n".join(history.report(filename)))
+        history.close()
+        return
+
+    # the options the scripts are rendered with, as recorded in the history
+    settings = (f"{options}"
+                + f" merge_clauses={args.merge_clauses}"
+                + (" cone_of_influence" if args.cone_of_influence else ""))
+    profiler = None
+    if args.profile:
+        from profiling import Profiler
+        profiler = Profiler(args.profile)
+    accounting = None
+    if args.memory_report:
+        from memory import MemoryAccounting
+        accounting = MemoryAccounting()
+
+    def phase(name: str) -> ExitStack:
+        stack = ExitStack()
+        # the accounting walks the heap, which must not end up in profiles
+        if accounting is not None and name != "mona":
+            stack.enter_context(accounting.phase(name))
+        if profiler is not None and (name != "mona" or args.profile_mona):
+            stack.enter_context(profiler.phase(name))
+        return stack
+
+    jobs = []
     for filename in args.file:
-        n_interaction = parse_file(filename).normalize()
+        with phase("parse"):
+            interaction = parse_file(filename)
+        falsified = set()
+        if args.simulate:
+            from simulation import Simulator
+            logger.info(f"simulating {args.runs} runs of size {args.simulate}")
+            with phase("simulate"):
+                simulator = Simulator(interaction, args.simulate, args.runs)
+                result = simulator.run(args.steps)
+            logger.info(f"simulated {result.agent_steps_per_second:.0f}"
+                        + " agent-steps per second")
+            for property_name, violation in result.violations.items():
+                print(f"{filename}: Reached {property_name} in simulation of"
+                      + f" size {result.size} after {violation.step} steps")
+                falsified.add(property_name)
+        with phase("normalize"):
+            n_interaction = replace(interaction, options=options).normalize()
+            if args.merge_clauses:
+                n_interaction = n_interaction.optimize_clauses()
+                logger.info(f"reduced {len(interaction.clauses)} clauses to"
+                            + f" {len(n_interaction.clauses)}")
+        digest = system_hash(filename)
         logger.info("rendering base theory")
-        base_theory = n_interaction.render_base_theory()
-        for property_name in n_interaction.property_names:
-            logger.info(f"checking {property_name}")
-            proof_script = n_interaction.render_property_unreachability(
-                    property_name,
-                    base_theory)
-            proof_file = write_tmp_file(proof_script)
-            logger.info(f"writing proof script to {proof_file}")
-            try:
-                logger.info("calling mona")
-                result = call_mona(proof_file)
-            except ChildProcessError as e:
-                logger.warning(f"mona reported error {e}")
-                continue
-            if "Formula is unsatisfiable" in result:
-                if verbosity > 0:
-                    print(f"{filename}: Successfully proven unreachability of "
-                          + str(property_name))
-            else:
-                print(f"{filename}: Unable to prove unreachability of "
+        with phase("render"):
+            base_theory_file = write_tmp_file(
+                    lambda sink: sink.writelines(
+                        n_interaction.stream_base_theory()))
+            for property_name in n_interaction.property_names:
+                if property_name in falsified:
+                    continue
+                checked, replayed = n_interaction, interaction
+                checked_base_theory = base_theory_file
+                if args.cone_of_influence:
+                    checked = n_interaction.cone_of_influence(property_name)
+                if checked is not n_interaction:
+                    components = checked.system.components
+                    logger.info(f"checking {property_name} on"
+                                + f" {len(components)} of"
+                                + f" {len(n_interaction.system.components)}"
+                                + " components")
+                    replayed = interaction.restricted_to(components,
+                                                         property_name)
+                    checked_base_theory = write_tmp_file(
+                            lambda sink: sink.writelines(
+                                checked.stream_base_theory()))
+
+                def write_proof_script(sink: IO[str]):
+                    with open(checked_base_theory) as base_theory:
+                        checked.write_property_unreachability(
+                                property_name, sink, base_theory)
+                    print(file=sink)
+
+                try:
+                    proof_file = write_tmp_file(write_proof_script)
+                except FormulaError as e:
+                    logger.warning(f"cannot render {property_name}: {e}")
+                    continue
+                finally:
+                    if checked_base_theory != base_theory_file:
+                        os.unlink(checked_base_theory)
+                logger.info(f"writing proof script to {proof_file}")
+                job = Job(["mona", "-q", proof_file],
+                          payload=(filename, replayed, property_name,
+                                   digest))
+                if history is not None:
+                    estimate = history.estimate(digest, property_name,
+                                                settings)
+                    if estimate is not None:
+                        job.duration = estimate.duration
+                        job.peak_rss = estimate.peak_rss
+                jobs.append(job)
+        os.unlink(base_theory_file)
+
+    budget = args.memory_budget * 1024 if args.memory_budget else None
+    default_memory = (args.default_memory * 1024
+                      if args.default_memory is not None else None)
+    completions = run_jobs(order(jobs), args.jobs, budget, default_memory)
+    while True:
+        # the wait for mona is only profiled on request
+        with phase("mona"):
+            completion = next(completions, None)
+        if completion is None:
+            break
+        filename, interaction, property_name, digest = completion.job.payload
+        logger.info(f"mona checked {property_name} of {filename} in"
+                    + f" {completion.duration:.2f}s using"
+                    + f" {completion.peak_rss} KiB")
+        if completion.returncode != 0:
+            logger.warning("mona reported error executing"
+                           + f" {completion.job.arguments}:\n"
+                           + completion.output)
+            verdict = "error"
+        elif "Formula is unsatisfiable" in completion.output:
+            verdict = "proven"
+            if verbosity > 0:
+                print(f"{filename}: Successfully proven unreachability of "
                       + str(property_name))
+        else:
+            verdict = "unproven"
+            print(f"{filename}: Unable to prove unreachability of "
+                  + str(property_name))
+            if args.replay:
+                with phase("replay"):
+                    replay_counterexample(filename, interaction,
+                                          property_name, completion.output,
+                                          options.backend, args.replay_limit)
+        if history is not None:
+            history.record(Run(digest, filename, property_name, settings,
+                               time.time() - completion.duration,
+                               completion.duration, completion.peak_rss,
+                               verdict))
+    if history is not None:
+        history.close()
+    if profiler is not None:
+        phases = profiler.write()
+        logger.info(f"wrote profiles of {', '.join(phases)} to"
+                    + f" {args.profile}")
+    if accounting is not None:
+        accounting.stop()
+        with open(args.memory_report, "w") as sink:
+            sink.writelines(f"{line}\n" for line in accounting.report())
 
 
 if __name__ == "__main__":
@@ -0,0 +1,202 @@
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+
+from typing import List, Dict, Set, Iterator, Optional
+from types import FrameType
+
+import gc
+import os
+import sys
+import tracemalloc
+
+# name -> [bytes, count]
+Histogram = Dict[str, List[int]]
+
+# allocations of the accounting itself are not attributed to a phase
+_IGNORED = {tracemalloc.__file__, __file__}
+
+_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+
+
+def _site(traceback: tracemalloc.Traceback) -> str:
+    # the innermost frame in our own sources, so allocations in generated
+    # dataclass methods count where the dataclass is created, otherwise the
+    # innermost frame with a source file
+    frames = list(reversed(traceback))
+    sources = [f for f in frames if f.filename != "<string>"] or frames
+    for frame in sources:
+        if os.path.dirname(os.path.abspath(frame.filename)) == _DIRECTORY:
+            break
+    else:
+        frame = sources[0]
+    return f"{os.path.basename(frame.filename)}:{frame.lineno}"
+
+
+def _sites() -> Histogram:
+    # grouped by traceback first, filters match every trace on their own
+    sites: Histogram = {}
+    for statistic in tracemalloc.take_snapshot().statistics("traceback"):
+        if any(frame.filename in _IGNORED for frame in statistic.traceback):
+            continue
+        entry = sites.setdefault(_site(statistic.traceback), [0, 0])
+        entry[0] += statistic.size
+        entry[1] += statistic.count
+    return sites
+
+
+def _own(*histograms: Histogram) -> Set[int]:
+    # ids of the histograms and everything in them
+    own = set()
+    for histogram in histograms:
+        own.add(id(histogram))
+        for name, entry in histogram.items():
+            own.update([id(name), id(entry), *map(id, entry)])
+    return own
+
+
+def _types(exclude: Set[int]) -> Histogram:
+    # live objects by type: the objects tracked by the garbage collector and
+    # the untracked ones they refer to, such as strings. An instance
+    # dictionary counts towards its object, so dataclasses show their size.
+    # Every allocation here is traced too, so the walk allocates little.
+    objects = gc.get_objects()
+    exclude = exclude | {id(objects), id(exclude)}
+    owned = set()
+    for obj in objects:
+        if type(getattr(obj, "__dict__", None)) is dict:
+            owned.add(id(obj.__dict__))
+    untracked = set()
+    by_type: Dict[type, List[int]] = {}
+
+    def account(obj: object):
+        size = sys.getsizeof(obj)
+        attributes = getattr(obj, "__dict__", None)
+        if type(attributes) is dict:
+            size += sys.getsizeof(attributes)
+        entry = by_type.get(type(obj))
+        if entry is None:
+            entry = by_type[type(obj)] = [0, 0]
+        entry[0] += size
+        entry[1] += 1
+
+    # frames are no objects to the collector, so the untracked objects only
+    # held by local variables, such as rendered strings, are found by walking
+    # the stack
+    frame: Optional[FrameType] = sys._getframe(1)
+    while frame is not None:
+        for value in list(frame.f_locals.values()):
+            if not gc.is_tracked(value) and id(value) not in untracked:
+                untracked.add(id(value))
+                account(value)
+        frame = frame.f_back
+    for obj in objects:
+        if id(obj) in owned or id(obj) in exclude:
+            continue
+        account(obj)
+        for referent in gc.get_referents(obj):
+            if not gc.is_tracked(referent) and id(referent) not in untracked:
+                untracked.add(id(referent))
+                account(referent)
+    return {f"{kind.__module__}.{kind.__qualname__}": entry
+            for kind, entry in by_type.items()}
+
+
+def _difference(after: Histogram, before: Histogram) -> Histogram:
+    difference = {}
+    for name in after.keys() | before.keys():
+        size, count = after.get(name, (0, 0))
+        old_size, old_count = before.get(name, (0, 0))
+        if size != old_size or count != old_count:
+            difference[name] = [size - old_size, count - old_count]
+    return difference
+
+
+@dataclass
+class PhaseMemory:
+    name: str
+    sections: int = 0
+    # bytes allocated above the start of a section, largest of all sections
+    peak: int = 0
+    # growth of the traced memory, by allocation site and by type of the
+    # live objects, summed over all sections
+    sites: Histogram = field(default_factory=dict)
+    types: Histogram = field(default_factory=dict)
+
+    @property
+    def retained(self) -> int:
+        return sum(size for size, _ in self.sites.values())
+
+    def add(self, peak: int, sites: Histogram, types: Histogram):
+        self.sections += 1
+        self.peak = max(self.peak, peak)
+        for mine, other in [(self.sites, sites), (self.types, types)]:
+            for name, (size, count) in other.items():
+                entry = mine.setdefault(name, [0, 0])
+                entry[0] += size
+                entry[1] += count
+
+
+class MemoryAccounting:
+    # peak and retained memory per phase by tracemalloc snapshots, the
+    # retained memory broken down by allocation site and by object type.
+    # Slow, every section walks the whole heap twice.
+    def __init__(self, frames: int = 4, top: int = 12):
+        self.top = top
+        self.phases: Dict[str, PhaseMemory] = {}
+        # tracing started by someone else is left running by stop
+        self.started = not tracemalloc.is_tracing()
+        if self.started:
+            tracemalloc.start(frames)
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        gc.collect()
+        types = _types(_own(*self._histograms()))
+        sites = _sites()
+        start = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        try:
+            yield
+        finally:
+            peak = tracemalloc.get_traced_memory()[1] - start
+            gc.collect()
+            sites_after = _sites()
+            types_after = _types(_own(types, sites, sites_after,
+                                      *self._histograms()))
+            self.phases.setdefault(name, PhaseMemory(name)).add(
+                    peak, _difference(sites_after, sites),
+                    _difference(types_after, types))
+
+    def _histograms(self) -> List[Histogram]:
+        return [h for p in self.phases.values() for h in [p.sites, p.types]]
+
+    def report(self) -> List[str]:
+        lines = []
+        for memory in self.phases.values():
+            lines.append(f"{memory.name}: peak {memory.peak / 1024:.0f} KiB,"
+                         + f" retained {memory.retained / 1024:.0f} KiB"
+                         + f" ({memory.sections} sections)")
+            modules: Dict[str, int] = {}
+            for name, (size, _) in memory.types.items():
+                module = name.rsplit(".", 1)[0]
+                modules[module] = modules.get(module, 0) + size
+            lines.append("  retained by module: " + ", ".join(
+                f"{module} {size / 1024:.0f} KiB"
+                for module, size in sorted(modules.items(),
+                                           key=lambda i: -abs(i[1]))
+                if abs(size) >= 1024))
+            lines.append("  retained by type:")
+            lines += self._largest(memory.types, "objects")
+            lines.append("  retained by allocation site:")
+            lines += self._largest(memory.sites, "blocks")
+        return lines
+
+    def _largest(self, histogram: Histogram, unit: str) -> List[str]:
+        entries = sorted(histogram.items(), key=lambda i: -abs(i[1][0]))
+        return [f"    {name:<48} {size / 1024:>9.1f} KiB {count:>8} {unit}"
+                for name, (size, count) in entries[:self.top]]
+
+    def stop(self):
+        if self.started:
+            tracemalloc.stop()
+            self.started = False
@@ -1,5 +1,7 @@
-from typing import List, Union
+from typing import List, Union, Iterator
 from dataclasses import dataclass
+from contextlib import contextmanager
+from contextvars import ContextVar
 
 VarStr = Union[str, "Variable"]
 
@@ -8,6 +10,21 @@ class MonaError(Exception):
     pass
 
 
+# first-order quantifiers restrict their variables to 0 <= v < n themselves
+# unless the restriction is declared once for all of them with defaultwhere1
+_explicit_guards: ContextVar[bool] = ContextVar("explicit_guards",
+                                                default=True)
+
+
+@contextmanager
+def default_restriction() -> Iterator[None]:
+    token = _explicit_guards.set(False)
+    try:
+        yield
+    finally:
+        _explicit_guards.reset(token)
+
+
 class Formula(object):
     def render(self) -> str:
         raise NotImplementedError()
@@ -181,7 +198,11 @@ class Negation(Formula):
         return f"~(\n{i}\n)"
 
     def simplify(self):
-        return self.inner.negate().simplify()
+        negated = self.inner.negate()
+        if type(negated) is Negation:
+            # the inner formula has no proper negation
+            return Negation(negated.inner.simplify())
+        return negated.simplify()
 
     def negate(self):
         return self.inner
@@ -192,6 +213,12 @@ class Atom(Formula):
     pass
 
 
+@dataclass
+class BooleanVariable(Variable, Atom):
+    def negate(self):
+        return Negation(self)
+
+
 @dataclass
 class Comparison(Atom):
     left: Term
@@ -329,6 +356,26 @@ class GuardedFirstOrderQuantification(Quantification):
             ])
 
 
+@dataclass
+class ExistentialZeroOrder(Quantification):
+    def __post_init__(self):
+        super().__post_init__()
+        self.kind = "ex0"
+
+    def negate(self):
+        return UniversalZeroOrder(self.variables, self.inner.negate())
+
+
+@dataclass
+class UniversalZeroOrder(Quantification):
+    def __post_init__(self):
+        super().__post_init__()
+        self.kind = "all0"
+
+    def negate(self):
+        return ExistentialZeroOrder(self.variables, self.inner.negate())
+
+
 @dataclass
 class ExistentialSecondOrder(Quantification):
     def __post_init__(self):
@@ -346,6 +393,8 @@ class ExistentialFirstOrder(GuardedFirstOrderQuantification):
         self.kind = "ex1"
 
     def _actual_inner(self):
+        if not _explicit_guards.get():
+            return self.inner
         return Conjunction([self.guard, self.inner]).simplify()
 
     def negate(self):
@@ -369,6 +418,8 @@ class UniversalFirstOrder(GuardedFirstOrderQuantification):
         self.kind = "all1"
 
     def _actual_inner(self):
+        if not _explicit_guards.get():
+            return self.inner
         return Implication(self.guard, self.inner).simplify()
 
     def negate(self):
@@ -1,6 +1,7 @@
 import lark  # type: ignore
 import system
 import logging
+import os
 import formula
 
 
@@ -11,9 +12,11 @@ class ParserError(Exception):
     pass
 
 
-grammar_file = "language-spec.lark"
+grammar_file = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            "language-spec.lark")
 logger.debug(f"Instantiating parser from {grammar_file}")
-parser = lark.Lark(open(grammar_file))
+with open(grammar_file) as grammar:
+    parser = lark.Lark(grammar)
 
 
 class FormulaParser(lark.Transformer):
@@ -1,6 +1,14 @@
 from dataclasses import dataclass
+from functools import lru_cache
+from array import array
+from enum import IntEnum
 
-from typing import Set, Any, Optional, FrozenSet, Tuple
+from typing import Set, Any, Optional, FrozenSet, Tuple, List, Dict, Iterable
+from typing import Type, TypeVar, Iterator
+
+import re
+
+import numpy as np
 
 
 class ProcessnetError(Exception):
@@ -8,75 +16,260 @@ class ProcessnetError(Exception):
         self.msg = msg
 
 
-@dataclass
+@lru_cache(maxsize=None)
+def _pattern(query: str) -> re.Pattern:
+    return re.compile(query)
+
+
+class Kind(IntEnum):
+    PROCESS = 0
+    PLACE = 1
+
+
+# processes with fewer children are searched without the index
+INDEXED_CHILDREN = 16
+
+
+class Arena:
+    # the nodes of one process tree in parallel arrays, nodes are numbered
+    # in the order they are added and the root is node 0
+    def __init__(self):
+        self.parent = array("q")
+        self.identifier = array("q")
+        self.kind = array("b")
+        self.value_id = array("q")  # -1 for no value
+        self.name_id = array("q")
+        # children as linked lists in the order they were added
+        self.first_child = array("q")
+        self.last_child = array("q")
+        self.next_sibling = array("q")
+        # number of child processes and child places
+        self.counts = (array("q"), array("q"))
+        self.values: List[Any] = []
+        self._value_ids: Dict[Any, int] = {}
+        self.names: List[str] = []
+        self._name_ids: Dict[str, int] = {}
+        # node by name id and parent, packed into one integer, for the
+        # children of processes with many children
+        self._index: Dict[int, int] = {}
+        self._leaves: Dict[int, FrozenSet["Place"]] = {}
+
+    def __len__(self) -> int:
+        return len(self.parent)
+
+    def _intern_value(self, value: Any) -> int:
+        if value is None:
+            return -1
+        # keeps apart values that compare equal, such as 1 and True
+        key = value if type(value) in (str, int) else (type(value), value)
+        try:
+            value_id = self._value_ids.setdefault(key, len(self.values))
+        except TypeError:
+            value_id = len(self.values)
+        if value_id == len(self.values):
+            self.values.append(value)
+        return value_id
+
+    def _intern_name(self, name: str) -> int:
+        name_id = self._name_ids.setdefault(name, len(self.names))
+        if name_id == len(self.names):
+            self.names.append(name)
+        return name_id
+
+    def add(self, parent: int, kind: Kind, value: Any = None,
+            identifier: Optional[int] = None) -> int:
+        node = len(self.parent)
+        if identifier is None:
+            identifier = self.counts[kind][parent]
+        if parent >= 0:
+            self.counts[kind][parent] += 1
+        value_id = self._intern_value(value)
+        name_id = self._intern_name(str(value) if value is not None
+                                    else str(identifier))
+        self.parent.append(parent)
+        self.identifier.append(identifier)
+        self.kind.append(kind)
+        self.value_id.append(value_id)
+        self.name_id.append(name_id)
+        self.first_child.append(-1)
+        self.last_child.append(-1)
+        self.next_sibling.append(-1)
+        self.counts[Kind.PROCESS].append(0)
+        self.counts[Kind.PLACE].append(0)
+        if parent >= 0:
+            if self.last_child[parent] < 0:
+                self.first_child[parent] = node
+            else:
+                self.next_sibling[self.last_child[parent]] = node
+            self.last_child[parent] = node
+            size = (self.counts[Kind.PROCESS][parent]
+                    + self.counts[Kind.PLACE][parent])
+            if size == INDEXED_CHILDREN:
+                for child in self.children(parent):
+                    self._register(parent, child)
+            elif size > INDEXED_CHILDREN:
+                self._register(parent, node)
+            while parent >= 0:
+                self._leaves.pop(parent, None)
+                parent = self.parent[parent]
+        return node
+
+    def _register(self, parent: int, node: int):
+        # the first node registered under a name shadows later ones
+        self._index.setdefault(self.name_id[node] << 32 | parent, node)
+
+    def children(self, node: int) -> Iterator[int]:
+        child = self.first_child[node]
+        while child >= 0:
+            yield child
+            child = self.next_sibling[child]
+
+    def child(self, node: int, name: str) -> int:
+        name_id = self._name_ids.get(name)
+        if name_id is None:
+            return -1
+        if (self.counts[Kind.PROCESS][node] + self.counts[Kind.PLACE][node]
+                >= INDEXED_CHILDREN):
+            return self._index.get(name_id << 32 | node, -1)
+        for child in self.children(node):
+            if self.name_id[child] == name_id:
+                return child
+        return -1
+
+    def leaves(self, node: int) -> List[int]:
+        if (self.counts[Kind.PROCESS][node] + self.counts[Kind.PLACE][node]
+                >= INDEXED_CHILDREN):
+            # for wide processes follow the parents of all places at once
+            parent = np.frombuffer(self.parent, dtype=np.int64)
+            places = np.flatnonzero(
+                    np.frombuffer(self.kind, dtype=np.int8) == Kind.PLACE)
+            ancestors = parent[places]
+            inside = np.zeros(len(places), dtype=bool)
+            while True:
+                inside |= ancestors == node
+                open_places = ancestors > node
+                if not open_places.any():
+                    return places[inside].tolist()
+                ancestors = np.where(open_places, parent[ancestors], -1)
+        found: List[int] = []
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            if self.kind[node] == Kind.PLACE:
+                found.append(node)
+            else:
+                stack.extend(self.children(node))
+        return found
+
+    def view(self, node: int) -> "Indexable":
+        return _VIEWS[self.kind[node]]._view(self, node)
+
+
+V = TypeVar("V", bound="Indexable")
+
+
 class Indexable:
-    identification_number: int
-    value: Any = None
-    host_process: Optional["Process"] = None
+    # a node of an arena; views of the same node are equal
+    __slots__ = ("arena", "node")
+    kind = Kind.PROCESS
+    arena: Arena
+    node: int
 
-    def __post_init__(self):
-        self.comp_str: str = (str(self.value) if self.value is not None
-                              else str(self.identification_number))
-        if not self.host_process:
-            parent_index: Tuple[str, ...] = tuple()
+    def __init__(self, identification_number: int, value: Any = None,
+                 host_process: Optional["Process"] = None):
+        if host_process is None:
+            self.arena = Arena()
+            self.node = self.arena.add(-1, self.kind, value,
+                                       identification_number)
         else:
-            parent_index: Tuple[str, ...] = self.host_process.full_index
-        self.full_index: Tuple[int, ...] = (parent_index
-                                            + (self.identification_number,))
+            self.arena = host_process.arena
+            self.node = self.arena.add(host_process.node, self.kind, value,
+                                       identification_number)
+
+    @classmethod
+    def _view(cls: Type[V], arena: Arena, node: int) -> V:
+        view = cls.__new__(cls)
+        view.arena = arena
+        view.node = node
+        return view
 
     @property
-    def all_leaves(self) -> Set["Place"]:
-        raise NotImplementedError()
+    def identification_number(self) -> int:
+        return self.arena.identifier[self.node]
 
-    def get(self, query: str, separator: str = "/") -> "Indexable":
-        query_list = query.split(separator)
-        rest_query = separator.join(query_list[1:])
-        try:
-            next_index = query_list[0]
-            for process in self.children:
-                if next_index == process.comp_str:
-                    return process.get(rest_query, separator=separator)
-            raise ProcessnetError(f"Cannot find {next_index} in {self}")
-        except IndexError:
-            return self
+    @property
+    def value(self) -> Any:
+        value_id = self.arena.value_id[self.node]
+        return None if value_id < 0 else self.arena.values[value_id]
 
-    def get_regex(self, query: str, separator: str = "/") -> Set["Indexable"]:
-        from re import compile
-        query_list = query.split(separator)
-        rest_query = separator.join(query_list[1:])
-        try:
-            next_index = query_list[0]
-            regex = compile(next_index)
-            found_elements = [
-                    process.get_regex(rest_query, separator=separator)
-                    for process in self.children
-                    if regex.match(process.comp_str)]
-            all_elements: Set["Indexable"] = set()
-            for e in found_elements:
-                all_elements |= e
-            return all_elements
-        except IndexError:
-            return {self}
+    @property
+    def comp_str(self) -> str:
+        return self.arena.names[self.arena.name_id[self.node]]
 
     @property
-    def children(self) -> Set["Indexable"]:
-        raise NotImplementedError()
+    def host_process(self) -> Optional["Process"]:
+        parent = self.arena.parent[self.node]
+        return None if parent < 0 else Process._view(self.arena, parent)
+
+    @property
+    def full_index(self) -> Tuple[int, ...]:
+        index: List[int] = []
+        node = self.node
+        while node >= 0:
+            index.append(self.arena.identifier[node])
+            node = self.arena.parent[node]
+        return tuple(reversed(index))
 
     @property
     def full_name(self) -> Tuple[str, ...]:
-        parent_name = (tuple() if not self.host_process
-                       else self.host_process.full_name)
-        return parent_name + (str(self),)
+        name: List[str] = []
+        node = self.node
+        while node >= 0:
+            name.append(str(self.arena.view(node)))
+            node = self.arena.parent[node]
+        return tuple(reversed(name))
+
+    @property
+    def all_leaves(self) -> FrozenSet["Place"]:
+        leaves = self.arena._leaves.get(self.node)
+        if leaves is None:
+            leaves = frozenset(Place._view(self.arena, n)
+                               for n in self.arena.leaves(self.node))
+            self.arena._leaves[self.node] = leaves
+        return leaves
+
+    @property
+    def children(self) -> List["Indexable"]:
+        return [self.arena.view(c) for c in self.arena.children(self.node)]
+
+    def get(self, query: str, separator: str = "/") -> "Indexable":
+        node = self.node
+        if query:
+            for name in query.split(separator):
+                node = self.arena.child(node, name)
+                if node < 0:
+                    raise ProcessnetError(f"Cannot find {query} in {self}")
+        return self.arena.view(node)
+
+    def get_regex(self, query: str, separator: str = "/") -> Set["Indexable"]:
+        found = [self.node]
+        if query:
+            arena = self.arena
+            for next_index in query.split(separator):
+                regex = _pattern(next_index)
+                found = [c for node in found
+                         for c in arena.children(node)
+                         if regex.match(arena.names[arena.name_id[c]])]
+        return {self.arena.view(n) for n in found}
 
     def __hash__(self):
-        return hash(self.full_index)
+        return hash(self.node)
 
     def __eq__(self, other):
         try:
             return (type(self) == type(other)
-                    and self.host_process == other.host_process
-                    and (self.identification_number
-                         == other.identification_number))
+                    and self.arena is other.arena
+                    and self.node == other.node)
         except AttributeError:
             return False
 
@@ -86,39 +279,35 @@ class Indexable:
         else:
             return f"Process<{self.identification_number}>"
 
+    def __repr__(self):
+        return f"{type(self).__name__}({self.full_index}, {self.value!r})"
+
 
-@dataclass
 class Place(Indexable):
-    def all_leaves(self) -> Set["Place"]:
-        return {self}
+    __slots__ = ()
+    kind = Kind.PLACE
 
 
-@dataclass
 class Process(Indexable):
-    def __post_init__(self):
-        super().__post_init__()
-        self._children: Set[Indexable] = set()
-        self.places: Set[Place] = set()
+    __slots__ = ()
+    kind = Kind.PROCESS
 
     @property
-    def children(self) -> Set[Indexable]:
-        return self._children
-
-    def all_leaves(self) -> Set["Place"]:
-        all_leaves: Set["Place"] = set()
-        for c in self._children:
-            all_leaves |= c.all_leaves
-        return all_leaves
+    def places(self) -> Set[Place]:
+        return {Place._view(self.arena, c)
+                for c in self.arena.children(self.node)
+                if self.arena.kind[c] == Kind.PLACE}
 
     def add_child_process(self, value: Any = None) -> "Process":
-        new_process = Process(len(self._children), value, self)
-        self._children.add(new_process)
-        return new_process
+        return Process._view(self.arena, self.arena.add(
+                self.node, Kind.PROCESS, value))
 
     def add_place(self, value: Any = None) -> Place:
-        new_place = Place(len(self.places), value, self)
-        self.places.add(new_place)
-        return new_place
+        return Place._view(self.arena, self.arena.add(
+                self.node, Kind.PLACE, value))
+
+
+_VIEWS = (Process, Place)
 
 
 @dataclass
@@ -127,7 +316,7 @@ class Transition:
     postset: FrozenSet[Place]
 
     def __hash__(self):
-        return hash(self.preset) & hash(self.postset)
+        return hash((self.preset, self.postset))
 
     def __eq__(self, other):
         try:
@@ -140,7 +329,27 @@ class Transition:
     def __str__(self):
         preset = ", ".join([str(p) for p in self.preset])
         postset = ", ".join([str(p) for p in self.postset])
-        return f"{{ {preset} }} ->  {self} -> {{ {postset} }}"
+        return f"{{ {preset} }} -> {{ {postset} }}"
+
+
+def _csr(rows: List[List[int]]) -> Tuple[np.ndarray, np.ndarray]:
+    indptr = np.zeros(len(rows) + 1, dtype=np.int64)
+    np.cumsum([len(r) for r in rows], out=indptr[1:])
+    indices = np.fromiter((i for r in rows for i in r), dtype=np.int64,
+                          count=int(indptr[-1]))
+    return indptr, indices
+
+
+def gather(indptr: np.ndarray, indices: np.ndarray,
+           rows: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    # (position in rows, index) for all entries of the given rows of a CSR
+    # matrix, such as the places of transitions
+    starts = indptr[rows]
+    lengths = indptr[rows + 1] - starts
+    positions = np.repeat(np.arange(len(rows)), lengths)
+    offsets = (np.arange(int(lengths.sum()))
+               - np.repeat(np.cumsum(lengths) - lengths, lengths))
+    return positions, indices[np.repeat(starts, lengths) + offsets]
 
 
 @dataclass
@@ -148,4 +357,196 @@ class PetriNet:
     root_process: Process
 
     def __post_init__(self):
-        self.transitions = set()
+        # arena nodes of the places and the place of every arena node
+        self._place_nodes = array("q")
+        self._place_ids = array("q")
+        self.labels: List[Any] = []
+        self._tokens = array("q")
+        self._pending_pre: List[List[int]] = []
+        self._pending_post: List[List[int]] = []
+        # transition id by sorted preset and postset, for deduplication
+        self._transition_ids: Dict[Tuple[Tuple[int, ...], Tuple[int, ...]],
+                                   int] = {}
+        # incidence in compressed sparse row form, row t lists the places in
+        # the preset (postset) of transition t; all arcs have weight one
+        self.pre_indptr = np.zeros(1, dtype=np.int64)
+        self.pre_indices = np.zeros(0, dtype=np.int64)
+        self.post_indptr = np.zeros(1, dtype=np.int64)
+        self.post_indices = np.zeros(0, dtype=np.int64)
+        # transition ids and their presets as dense rows, grouped by the
+        # size of the preset
+        self._pre_buckets: List[Tuple[np.ndarray, np.ndarray]] = []
+        # the transposed incidence, row p lists the transitions consuming
+        # (producing) place p; built on demand
+        self._consumers: Optional[Tuple[np.ndarray, np.ndarray]] = None
+        self._producers: Optional[Tuple[np.ndarray, np.ndarray]] = None
+
+    def add_place(self, place: Place, tokens: int = 0) -> int:
+        if place.arena is not self.root_process.arena:
+            raise ProcessnetError(f"{place} is not part of the process tree")
+        missing = len(place.arena) - len(self._place_ids)
+        if missing > 0:
+            self._place_ids.extend([-1] * missing)
+        if self._place_ids[place.node] >= 0:
+            raise ProcessnetError(f"{place} is already part of the net")
+        self._place_ids[place.node] = len(self._place_nodes)
+        self._place_nodes.append(place.node)
+        self._tokens.append(tokens)
+        return self._place_ids[place.node]
+
+    def place(self, p: int) -> Place:
+        return Place._view(self.root_process.arena, self._place_nodes[p])
+
+    def place_id(self, place: Place) -> int:
+        if (place.arena is not self.root_process.arena
+                or place.node >= len(self._place_ids)
+                or self._place_ids[place.node] < 0):
+            raise ProcessnetError(f"{place} is not part of the net")
+        return self._place_ids[place.node]
+
+    def add_transition(self, preset: Iterable[int], postset: Iterable[int],
+                       label: Any = None) -> int:
+        # a transition with the preset and postset of an existing one is
+        # not added again, the id (and label) of the existing one is kept
+        pre = tuple(sorted(set(preset)))
+        post = tuple(sorted(set(postset)))
+        t = self._transition_ids.setdefault((pre, post), len(self.labels))
+        if t == len(self.labels):
+            self._pending_pre.append(list(pre))
+            self._pending_post.append(list(post))
+            self.labels.append(label)
+        return t
+
+    def transition_id(self, preset: Iterable[int], postset: Iterable[int]
+                      ) -> int:
+        key = (tuple(sorted(set(preset))), tuple(sorted(set(postset))))
+        try:
+            return self._transition_ids[key]
+        except KeyError:
+            raise ProcessnetError("No transition with this preset and"
+                                  + " postset")
+
+    def compile(self):
+        # moves the transitions added since the last call into the CSR
+        # incidence
+        if not self._pending_pre:
+            return
+        pre_indptr, pre_indices = _csr(self._pending_pre)
+        post_indptr, post_indices = _csr(self._pending_post)
+        self.pre_indptr = np.concatenate(
+                [self.pre_indptr, pre_indptr[1:] + self.pre_indptr[-1]])
+        self.pre_indices = np.concatenate([self.pre_indices, pre_indices])
+        self.post_indptr = np.concatenate(
+                [self.post_indptr, post_indptr[1:] + self.post_indptr[-1]])
+        self.post_indices = np.concatenate([self.post_indices, post_indices])
+        self._pending_pre, self._pending_post = [], []
+        self._consumers, self._producers = None, None
+        lengths = np.diff(self.pre_indptr)
+        self._pre_buckets = []
+        for length in np.unique(lengths):
+            ids = np.flatnonzero(lengths == length)
+            rows = self.pre_indices[self.pre_indptr[ids][:, None]
+                                    + np.arange(length)[None, :]]
+            self._pre_buckets.append((ids, rows))
+
+    def _transpose(self, indptr: np.ndarray, indices: np.ndarray
+                   ) -> Tuple[np.ndarray, np.ndarray]:
+        transitions = np.repeat(np.arange(len(indptr) - 1), np.diff(indptr))
+        order = np.argsort(indices, kind="stable")
+        transposed_indptr = np.zeros(self.number_of_places + 1,
+                                     dtype=np.int64)
+        np.cumsum(np.bincount(indices, minlength=self.number_of_places),
+                  out=transposed_indptr[1:])
+        return transposed_indptr, transitions[order]
+
+    @property
+    def consumers(self) -> Tuple[np.ndarray, np.ndarray]:
+        # (indptr, indices) of the transitions consuming from each place
+        self.compile()
+        if (self._consumers is None
+                or len(self._consumers[0]) != self.number_of_places + 1):
+            self._consumers = self._transpose(self.pre_indptr,
+                                              self.pre_indices)
+        return self._consumers
+
+    @property
+    def producers(self) -> Tuple[np.ndarray, np.ndarray]:
+        # (indptr, indices) of the transitions producing into each place
+        self.compile()
+        if (self._producers is None
+                or len(self._producers[0]) != self.number_of_places + 1):
+            self._producers = self._transpose(self.post_indptr,
+                                              self.post_indices)
+        return self._producers
+
+    def consuming(self, p: int) -> np.ndarray:
+        indptr, indices = self.consumers
+        return indices[indptr[p]:indptr[p + 1]]
+
+    def producing(self, p: int) -> np.ndarray:
+        indptr, indices = self.producers
+        return indices[indptr[p]:indptr[p + 1]]
+
+    @property
+    def number_of_places(self) -> int:
+        return len(self._place_nodes)
+
+    @property
+    def number_of_transitions(self) -> int:
+        return len(self.labels)
+
+    @property
+    def initial_marking(self) -> np.ndarray:
+        return np.frombuffer(self._tokens, dtype=np.int64).astype(np.int32)
+
+    def transition(self, t: int) -> "Transition":
+        self.compile()
+        pre = self.pre_indices[self.pre_indptr[t]:self.pre_indptr[t + 1]]
+        post = self.post_indices[self.post_indptr[t]:self.post_indptr[t + 1]]
+        return Transition(frozenset(self.place(p) for p in pre),
+                          frozenset(self.place(p) for p in post))
+
+    def enabled(self, markings: np.ndarray) -> np.ndarray:
+        # markings has shape (batch, places), the result (batch, transitions)
+        self.compile()
+        markings = np.atleast_2d(markings)
+        enabled = np.ones((len(markings), self.number_of_transitions),
+                          dtype=bool)
+        for ids, rows in self._pre_buckets:
+            enabled[:, ids] = (markings[:, rows] > 0).all(axis=2)
+        return enabled
+
+    def fire(self, markings: np.ndarray, transitions: np.ndarray
+             ) -> np.ndarray:
+        # fires transitions[i] in markings[i], a negative entry fires nothing
+        self.compile()
+        markings = np.array(np.atleast_2d(markings))
+        transitions = np.asarray(transitions)
+        batch = np.flatnonzero(transitions >= 0)
+        rows, places = gather(self.pre_indptr, self.pre_indices,
+                              transitions[batch])
+        np.subtract.at(markings, (batch[rows], places), 1)
+        if (markings[batch] < 0).any():
+            raise ProcessnetError("Fired transition that is not enabled")
+        rows, places = gather(self.post_indptr, self.post_indices,
+                              transitions[batch])
+        np.add.at(markings, (batch[rows], places), 1)
+        return markings
+
+    def reachable_markings(self) -> np.ndarray:
+        # all markings reachable from the initial one by breadth-first
+        # search, one per row; only feasible for small nets
+        seen = {self.initial_marking.tobytes()}
+        markings = [self.initial_marking]
+        frontier = self.initial_marking[None, :]
+        while len(frontier):
+            rows, transitions = np.nonzero(self.enabled(frontier))
+            fresh = []
+            for marking in self.fire(frontier[rows], transitions):
+                key = marking.tobytes()
+                if key not in seen:
+                    seen.add(key)
+                    fresh.append(marking)
+            markings += fresh
+            frontier = np.array(fresh).reshape(-1, self.number_of_places)
+        return np.array(markings)
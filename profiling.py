@@ -0,0 +1,113 @@
+from contextlib import contextmanager
+
+from typing import List, Dict, Tuple, Iterator, IO, Optional
+
+import cProfile
+import glob
+import logging
+import os
+import pstats
+import uuid
+
+logger = logging.getLogger(__name__)
+
+# frames as in pstats: (file, line, function)
+Frame = Tuple[str, int, str]
+
+
+class Profiler:
+    # one cProfile profile per phase, enabled around every section of that
+    # phase. Every process writes its profiles as parts into the directory,
+    # tagged with the run; write merges and removes the parts of its run, so
+    # profiles of workers given the run of the main profiler end up in the
+    # same files and parts of other runs are left alone.
+    def __init__(self, directory: str, run: Optional[str] = None):
+        self.directory = directory
+        self.run = run or uuid.uuid4().hex
+        self.profiles: Dict[str, cProfile.Profile] = {}
+        os.makedirs(os.path.join(directory, "parts"), exist_ok=True)
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        profile = self.profiles.setdefault(name, cProfile.Profile())
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+
+    def write_parts(self):
+        # called by every worker before it exits
+        for name, profile in self.profiles.items():
+            profile.dump_stats(os.path.join(
+                self.directory, "parts",
+                f"{name}.{self.run}.{os.getpid()}-{id(self)}.prof"))
+
+    def write(self) -> List[str]:
+        # pstats and collapsed stacks per phase, returns the phases
+        self.write_parts()
+        parts: Dict[str, List[str]] = {}
+        for path in glob.glob(os.path.join(self.directory, "parts",
+                                           f"*.{self.run}.*.prof")):
+            name = os.path.basename(path).rsplit(".", 3)[0]
+            parts.setdefault(name, []).append(path)
+        for name, paths in sorted(parts.items()):
+            stats = pstats.Stats(*sorted(paths))
+            stats.dump_stats(os.path.join(self.directory, f"{name}.prof"))
+            with open(os.path.join(self.directory, f"{name}.collapsed"),
+                      "w") as sink:
+                write_collapsed(stats, sink)
+            logger.info(f"profile of {name} merged from {len(paths)} parts")
+            for path in paths:
+                os.unlink(path)
+        return sorted(parts)
+
+
+def _label(frame: Frame) -> str:
+    filename, line, function = frame
+    if filename == "~":
+        return function
+    return f"{os.path.basename(filename)}:{line}({function})"
+
+
+def write_collapsed(stats: pstats.Stats, sink: IO[str],
+                    threshold: float = 1e-3):
+    # cProfile only records caller-callee edges, so stacks are rebuilt from
+    # the roots on and the time of a function is split among its callers in
+    # proportion to their calls; paths below threshold of the total time
+    # are dropped. Counts are microseconds, as flamegraph tools expect.
+    entries = stats.stats  # type: ignore
+    callees: Dict[Frame, List[Tuple[Frame, float]]] = {}
+    # time of a function not spent in calls from recorded callers, such as
+    # calls from the frame the profiler was enabled in; generators resumed
+    # by next also make cycles without any function lacking callers
+    roots: List[Tuple[Frame, float]] = []
+    for frame, (_, _, _, cumulative, callers) in entries.items():
+        called = 0.0
+        for caller, edge in callers.items():
+            callees.setdefault(caller, []).append((frame, edge[3]))
+            if caller != frame:
+                called += edge[3]
+        if cumulative > called:
+            roots.append((frame, cumulative - called))
+    total = sum(t for _, t in roots) or 1.0
+    lines: Dict[str, float] = {}
+
+    def visit(frame: Frame, stack: List[str], budget: float):
+        _, _, own, cumulative, _ = entries[frame]
+        share = budget / cumulative if cumulative else 0.0
+        stack = stack + [_label(frame).replace(";", ",")]
+        key = ";".join(stack)
+        lines[key] = lines.get(key, 0.0) + own * share
+        for callee, edge in callees.get(frame, []):
+            spent = edge * share
+            if spent >= threshold * total and _label(callee) not in stack:
+                visit(callee, stack, spent)
+
+    for root, budget in roots:
+        if budget >= threshold * total:
+            visit(root, [], budget)
+    for key, seconds in sorted(lines.items()):
+        microseconds = round(seconds * 1e6)
+        if microseconds > 0:
+            sink.write(f"{key} {microseconds}\n")
@@ -0,0 +1,105 @@
+from dataclasses import dataclass
+
+from typing import List, Dict, Tuple, Any, Optional, Iterator, IO
+from tempfile import TemporaryFile
+from subprocess import Popen, STDOUT
+
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Job:
+    arguments: List[str]
+    # expected wall-clock seconds and peak RSS in KiB, None if unknown
+    duration: Optional[float] = None
+    peak_rss: Optional[int] = None
+    # passed through to the completion for the caller
+    payload: Any = None
+
+
+@dataclass
+class Completion:
+    job: Job
+    returncode: int
+    output: str
+    duration: float
+    peak_rss: int
+
+
+def order(jobs: List[Job]) -> List[Job]:
+    # longest expected first, so short jobs fill the gaps at the end; jobs
+    # never run before go first as they may be the longest, otherwise the
+    # given order is kept
+    return sorted(jobs, key=lambda j: (j.duration is not None,
+                                       -(j.duration or 0)))
+
+
+def run(jobs: List[Job], workers: int = 1,
+        memory_budget: Optional[int] = None,
+        default_peak_rss: Optional[int] = None) -> Iterator[Completion]:
+    # runs the jobs in the given order with at most workers at once; a job
+    # only starts if the expected peak RSS of all running jobs stays within
+    # memory_budget KiB, a job that alone exceeds the budget runs alone.
+    # A job without an estimate is expected to take default_peak_rss KiB,
+    # or the whole budget if that is None, so it runs alone. Later jobs that
+    # fit may overtake one waiting for memory.
+    pending = list(jobs)
+    running: Dict[int, Tuple[Job, Popen, IO[bytes], float, int]] = {}
+    reserved = 0
+    delay = 0.0
+    while pending or running:
+        started = True
+        while started and pending and len(running) < max(1, workers):
+            started = False
+            for i, job in enumerate(pending):
+                expected = job.peak_rss
+                if expected is None:
+                    expected = default_peak_rss
+                if expected is None:
+                    expected = memory_budget or 0
+                if (running and memory_budget is not None
+                        and reserved + expected > memory_budget):
+                    continue
+                del pending[i]
+                started = True
+                output = TemporaryFile()
+                try:
+                    process = Popen(job.arguments, stdout=output,
+                                    stderr=STDOUT)
+                except OSError as e:
+                    output.close()
+                    yield Completion(job, -1, str(e), 0.0, 0)
+                    break
+                logger.debug(f"started {job.arguments} as {process.pid}")
+                running[process.pid] = (job, process, output,
+                                        time.monotonic(), expected)
+                reserved += expected
+                break
+        if not running:
+            continue
+        # only our own children are waited for, others of the process stay
+        # untouched; polled with a growing delay as Popen.wait does
+        for pid in list(running):
+            waited, status, usage = os.wait4(pid, os.WNOHANG)
+            if waited:
+                break
+        else:
+            delay = min(delay * 2 or 0.0005, 0.05)
+            time.sleep(delay)
+            continue
+        delay = 0.0
+        job, process, sink, start, expected = running.pop(pid)
+        duration = time.monotonic() - start
+        # the child is reaped already, Popen must not wait for it again
+        process.returncode = os.waitstatus_to_exitcode(status)
+        reserved -= expected
+        sink.seek(0)
+        text = sink.read().decode("utf-8", errors="replace")
+        sink.close()
+        # ru_maxrss is in KiB on Linux
+        yield Completion(job, process.returncode, text, duration,
+                         usage.ru_maxrss)
@@ -0,0 +1,653 @@
+from dataclasses import dataclass, field
+
+from typing import List, Dict, Tuple, Optional, Any, Set, cast
+from itertools import combinations
+
+from formula import Interaction, Clause, Broadcast, Predicate, Term
+from formula import Variable, Successor, Constant, RestrictionCollection
+from system import System
+
+import logging
+import re
+import time
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class SimulationError(Exception):
+    pass
+
+
+# Properties are raw MONA formulae. The simulator understands the first-order
+# fragment used by the bundled examples: ex1/all1 quantification, the boolean
+# connectives, membership of index terms in state sets and comparisons of index
+# terms. First-order variables range over the instance 0, ..., n-1.
+_TOKEN = re.compile(r"\s*(?:(?P<number>\d+)"
+                    + r"|(?P<name>[A-Za-z_$][A-Za-z0-9_$']*)"
+                    + r"|(?P<symbol><=>|=>|<=|>=|~=|[~&|()<>=+\-,:]))")
+_COMMENT = re.compile(r"/\*.*?\*/", re.DOTALL)
+_COMPARISONS = {"=", "~=", "<", "<=", ">", ">="}
+_QUANTIFIERS = {"ex1": "ex", "all1": "all"}
+_UNSUPPORTED = {"ex0", "all0", "ex2", "all2", "sub", "empty"}
+
+PropertyNode = Tuple[Any, ...]
+
+
+def _tokenize(text: str) -> List[str]:
+    text = _COMMENT.sub(" ", text).strip()
+    tokens: List[str] = []
+    position = 0
+    while position < len(text):
+        match = _TOKEN.match(text, position)
+        if not match or match.end() == position:
+            raise SimulationError(
+                    f"Cannot tokenize property at '{text[position:]}'")
+        tokens.append(match.group(match.lastgroup))  # type: ignore
+        position = match.end()
+        while position < len(text) and text[position].isspace():
+            position += 1
+    return tokens
+
+
+class PropertyParser:
+    def __init__(self, text: str):
+        self.tokens = _tokenize(text)
+        self.position = 0
+
+    def parse(self) -> PropertyNode:
+        node = self.formula()
+        if self.peek() is not None:
+            raise SimulationError(f"Unexpected token {self.peek()}")
+        return node
+
+    def peek(self) -> Optional[str]:
+        if self.position < len(self.tokens):
+            return self.tokens[self.position]
+        return None
+
+    def take(self, expected: Optional[str] = None) -> str:
+        token = self.peek()
+        if token is None or (expected is not None and token != expected):
+            raise SimulationError(f"Expected {expected} but found {token}")
+        self.position += 1
+        return token
+
+    def formula(self) -> PropertyNode:
+        left = self.implication()
+        while self.peek() == "<=>":
+            self.take()
+            left = ("iff", left, self.implication())
+        return left
+
+    def implication(self) -> PropertyNode:
+        left = self.disjunction()
+        if self.peek() == "=>":
+            self.take()
+            return ("implies", left, self.implication())
+        return left
+
+    def disjunction(self) -> PropertyNode:
+        left = self.conjunction()
+        while self.peek() == "|":
+            self.take()
+            left = ("or", left, self.conjunction())
+        return left
+
+    def conjunction(self) -> PropertyNode:
+        left = self.unary()
+        while self.peek() == "&":
+            self.take()
+            left = ("and", left, self.unary())
+        return left
+
+    def unary(self) -> PropertyNode:
+        token = self.peek()
+        if token == "~":
+            self.take()
+            return ("not", self.unary())
+        elif token in _QUANTIFIERS:
+            self.take()
+            variables = [self.take()]
+            while self.peek() == ",":
+                self.take()
+                variables.append(self.take())
+            self.take(":")
+            # the scope of a quantifier extends as far to the right as possible
+            return (_QUANTIFIERS[token], tuple(variables), self.formula())
+        elif token in _UNSUPPORTED:
+            raise SimulationError(f"Unsupported construct {token}")
+        elif token in {"true", "false"}:
+            self.take()
+            return ("bool", token == "true")
+        elif token == "(":
+            start = self.position
+            try:
+                return self.atom()
+            except SimulationError:
+                self.position = start
+            self.take("(")
+            inner = self.formula()
+            self.take(")")
+            return inner
+        return self.atom()
+
+    def atom(self) -> PropertyNode:
+        left = self.term()
+        token = self.take()
+        if token in {"in", "notin"}:
+            return ("in", left, self.take(), token == "in")
+        elif token in _COMPARISONS:
+            return ("cmp", token, left, self.term())
+        raise SimulationError(f"Unexpected token {token}")
+
+    def term(self) -> PropertyNode:
+        token = self.take()
+        if token == "(":
+            node = self.term()
+            self.take(")")
+        elif token.isdigit():
+            node = ("int", int(token))
+        elif token == "n":
+            node = ("size",)
+        elif token in _QUANTIFIERS or token in _UNSUPPORTED:
+            raise SimulationError(f"Unexpected token {token}")
+        else:
+            node = ("var", token)
+        while self.peek() in {"+", "-"}:
+            sign = 1 if self.take() == "+" else -1
+            node = ("add", node, sign * int(self.take()))
+        return node
+
+
+def _lift(value: Any, depth: int) -> np.ndarray:
+    value = np.asarray(value)
+    if value.ndim == 0:
+        return np.full((1,) * (1 + depth), value)
+    return value
+
+
+def _evaluate_term(node: PropertyNode, bound: Dict[str, int], depth: int,
+                   size: int) -> Any:
+    kind = node[0]
+    if kind == "int":
+        return node[1]
+    elif kind == "size":
+        return size
+    elif kind == "add":
+        return _evaluate_term(node[1], bound, depth, size) + node[2]
+    elif node[1] not in bound:
+        raise SimulationError(f"Free first-order variable {node[1]}")
+    shape = [1] * (1 + depth)
+    shape[bound[node[1]]] = size
+    return np.arange(size).reshape(shape)
+
+
+_OPERATORS = {
+        "=": np.equal,
+        "~=": np.not_equal,
+        "<": np.less,
+        "<=": np.less_equal,
+        ">": np.greater,
+        ">=": np.greater_equal,
+        }
+
+
+def _evaluate(node: PropertyNode, bound: Dict[str, int], depth: int,
+              size: int, membership: Any) -> np.ndarray:
+    kind = node[0]
+    if kind == "bool":
+        return _lift(node[1], depth)
+    elif kind == "not":
+        return ~_evaluate(node[1], bound, depth, size, membership)
+    elif kind in {"and", "or", "implies", "iff"}:
+        left = _evaluate(node[1], bound, depth, size, membership)
+        right = _evaluate(node[2], bound, depth, size, membership)
+        if kind == "and":
+            return left & right
+        elif kind == "or":
+            return left | right
+        elif kind == "implies":
+            return ~left | right
+        return left == right
+    elif kind == "cmp":
+        left = _evaluate_term(node[2], bound, depth, size)
+        right = _evaluate_term(node[3], bound, depth, size)
+        return _lift(_OPERATORS[node[1]](left, right), depth)
+    elif kind == "in":
+        marked = membership(node[2])
+        index = _lift(_evaluate_term(node[1], bound, depth, size), depth)
+        valid = (index >= 0) & (index < size)
+        index = np.where(valid, index, 0)
+        found = marked[:, index.reshape(-1)].reshape(
+                (marked.shape[0],) + index.shape[1:]) & valid
+        return found if node[3] else ~found
+    variables = node[1]
+    inner_bound = dict(bound)
+    for offset, name in enumerate(variables):
+        inner_bound[name] = 1 + depth + offset
+    inner = _evaluate(node[2], inner_bound, depth + len(variables), size,
+                      membership)
+    axes = tuple(range(1 + depth, 1 + depth + len(variables)))
+    if kind == "ex":
+        return np.asarray(inner.any(axis=axes))
+    return np.asarray(inner.all(axis=axes))
+
+
+class CompiledProperty:
+    # upper bound on the number of booleans evaluated at once by the dense
+    # evaluation of a property
+    dense_budget = 1 << 24
+    # largest group of pairwise distinct variables decided by counting
+    counting_limit = 10
+
+    def __init__(self, name: str, text: str):
+        self.name = name
+        self.tree = PropertyParser(text).parse()
+        self.quantifier_depth = self._depth(self.tree)
+        self.counting = self._counting_form(self.tree)
+
+    def _depth(self, node: PropertyNode) -> int:
+        kind = node[0]
+        if kind in {"ex", "all"}:
+            return len(node[1]) + self._depth(node[2])
+        elif kind == "not":
+            return self._depth(node[1])
+        elif kind in {"and", "or", "implies", "iff"}:
+            return max(self._depth(node[1]), self._depth(node[2]))
+        return 0
+
+    def _counting_form(self, node: PropertyNode
+                       ) -> Optional[Tuple[List[Tuple[str, ...]],
+                                           List[PropertyNode]]]:
+        # recognizes ex1 x_1, ..., x_k: A_1 & ... & A_m where every atom
+        # constrains a single variable or states that two variables differ;
+        # these properties are decided by counting instead of enumerating
+        # all k-tuples of indices
+        variables: Tuple[str, ...] = tuple()
+        while node[0] == "ex":
+            variables += node[1]
+            node = node[2]
+        if not variables:
+            return None
+        atoms: List[PropertyNode] = []
+        pending = [node]
+        while pending:
+            current = pending.pop()
+            if current[0] == "and":
+                pending += [current[1], current[2]]
+            else:
+                atoms.append(current)
+        groups = {v: {v} for v in variables}
+        distinct: Set[Tuple[str, str]] = set()
+        local: List[PropertyNode] = []
+        for atom in atoms:
+            mentioned = self._variables(atom)
+            if len(mentioned) > 2 or not mentioned <= set(variables):
+                return None
+            elif len(mentioned) == 2:
+                if (atom[0] != "cmp" or atom[1] != "~="
+                        or atom[2][0] != "var" or atom[3][0] != "var"):
+                    return None
+                first, second = sorted(mentioned)
+                distinct.add((first, second))
+                merged = groups[first] | groups[second]
+                for v in merged:
+                    groups[v] = merged
+            else:
+                local.append(atom)
+        # the variables have to split into groups of pairwise distinct ones
+        cliques: List[Tuple[str, ...]] = []
+        for v in variables:
+            clique = tuple(sorted(groups[v]))
+            if clique in cliques:
+                continue
+            pairs = set(combinations(clique, 2))
+            if (not pairs <= distinct
+                    or len(clique) > self.counting_limit):
+                return None
+            cliques.append(clique)
+        return (cliques, local)
+
+    def _variables(self, node: PropertyNode) -> Set[str]:
+        kind = node[0]
+        if kind == "var":
+            return {node[1]}
+        elif kind in {"int", "size", "bool"}:
+            return set()
+        elif kind == "add":
+            return self._variables(node[1])
+        elif kind == "in":
+            return self._variables(node[1])
+        elif kind == "cmp":
+            return self._variables(node[2]) | self._variables(node[3])
+        elif kind == "not":
+            return self._variables(node[1])
+        elif kind in {"ex", "all"}:
+            return self._variables(node[2]) - set(node[1])
+        return self._variables(node[1]) | self._variables(node[2])
+
+    def holds(self, membership: Any, runs: int, size: int) -> np.ndarray:
+        if self.counting is not None:
+            return self._holds_by_counting(membership, runs, size)
+        chunk = max(1, self.dense_budget // max(1, size
+                                                ** self.quantifier_depth))
+        result = np.zeros(runs, dtype=bool)
+        for start in range(0, runs, chunk):
+            selection = slice(start, min(runs, start + chunk))
+
+            def sliced(state: str) -> np.ndarray:
+                return membership(state)[selection]
+            value = _evaluate(self.tree, {}, 0, size, sliced)
+            result[selection] = value.reshape(-1)
+        return result
+
+    def _holds_by_counting(self, membership: Any, runs: int, size: int
+                           ) -> np.ndarray:
+        cliques, atoms = cast(Tuple[List[Tuple[str, ...]],
+                                    List[PropertyNode]],
+                              self.counting)
+        candidates = {v: np.ones((runs, size), dtype=bool)
+                      for clique in cliques for v in clique}
+        for atom in atoms:
+            mentioned = self._variables(atom)
+            if not mentioned:
+                value = _evaluate(atom, {}, 0, size, membership)
+                for v in candidates:
+                    candidates[v] &= value.reshape(-1, 1)
+                continue
+            v = mentioned.pop()
+            candidates[v] &= _evaluate(atom, {v: 1}, 1, size, membership)
+        # Hall's condition: pairwise distinct witnesses exist iff every
+        # subset of a group has at least as many candidates as members
+        result = np.ones(runs, dtype=bool)
+        for clique in cliques:
+            for count in range(1, len(clique) + 1):
+                for subset in combinations(clique, count):
+                    union = np.logical_or.reduce(
+                            [candidates[v] for v in subset])
+                    result &= union.sum(axis=1) >= count
+        return result
+
+    def supported_size(self, size: int) -> bool:
+        return (self.counting is not None
+                or size ** self.quantifier_depth <= self.dense_budget)
+
+
+@dataclass
+class _Port:
+    component: int
+    source: int
+    target: int
+    term: Term
+
+
+@dataclass
+class _CompiledBroadcast:
+    broadcast: Broadcast
+    component: int
+    options: List[_Port]
+
+
+class CompiledClause:
+    def __init__(self, clause: Clause, simulator: "Simulator"):
+        self.clause = clause
+        self.size = simulator.size
+        self.ports = [simulator.port(p)
+                      for p in sorted(clause.ports.predicates, key=str)]
+        self.broadcasts: List[_CompiledBroadcast] = []
+        for b in clause.broadcasts:
+            options = [simulator.port(p)
+                       for p in sorted(b.body.predicates, key=str)]
+            self.broadcasts.append(_CompiledBroadcast(
+                b, options[0].component, options))
+        self.variables = sorted(clause.free_variables, key=str)
+        self.sampling = {v: self._sampling_port(v) for v in self.variables}
+        self.feasible = all(self._valid_constant(p.term) for p in self.ports)
+
+    def _valid_constant(self, term: Term) -> bool:
+        if isinstance(term, Constant):
+            return term.value < self.size
+        elif isinstance(term, Successor):
+            return self._valid_constant(term.argument)
+        return True
+
+    def _sampling_port(self, variable: Variable
+                       ) -> Optional[Tuple[_Port, int]]:
+        # a variable is drawn among the agents that can take one of its ports
+        # instead of uniformly, so that rarely enabled clauses still fire
+        best: Optional[Tuple[_Port, int]] = None
+        for port in self.ports:
+            term, offset = port.term, 0
+            while isinstance(term, Successor):
+                term, offset = term.argument, offset + 1
+            if term == variable and (best is None or offset < best[1]):
+                best = (port, offset)
+        return best
+
+    def fire(self, states: List[np.ndarray], runs: np.ndarray,
+             generator: np.random.Generator) -> np.ndarray:
+        size = self.size
+        enabled = np.full(len(runs), self.feasible)
+        assignment: Dict[Variable, Any] = {}
+        for v in self.variables:
+            sampling = self.sampling[v]
+            if sampling is None:
+                assignment[v] = generator.integers(0, size, len(runs))
+                continue
+            port, offset = sampling
+            candidates = states[port.component][runs] == port.source
+            keys = np.where(candidates,
+                            generator.random(candidates.shape), -1.0)
+            enabled &= candidates.any(axis=1)
+            assignment[v] = (keys.argmax(axis=1) - offset) % size
+        guarded = np.zeros(len(runs), dtype=bool)
+        for guard in self.clause.guards:
+            holds = np.ones(len(runs), dtype=bool)
+            for r in guard.restrictions:
+                holds &= r.evaluate(assignment, size)
+            guarded |= holds
+        enabled &= guarded
+        agents = [np.broadcast_to(p.term.evaluate(assignment, size),
+                                  (len(runs),)) % size
+                  for p in self.ports]
+        for port, agent in zip(self.ports, agents):
+            enabled &= states[port.component][runs, agent] == port.source
+        for (i, first), (j, second) in combinations(enumerate(self.ports), 2):
+            if first.component == second.component:
+                enabled &= agents[i] != agents[j]
+        choices = []
+        for b in self.broadcasts:
+            participating, choice = self._broadcast(b, states, runs,
+                                                    assignment, agents,
+                                                    generator)
+            enabled &= ~(participating & (choice < 0)).any(axis=1)
+            choices.append((b, participating, choice))
+        firing = runs[enabled]
+        if not len(firing):
+            return enabled
+        for port, agent in zip(self.ports, agents):
+            states[port.component][firing, agent[enabled]] = port.target
+        for b, participating, choice in choices:
+            for k, option in enumerate(b.options):
+                index = self._broadcast_agents(b, option)
+                selected = (participating & (choice == k))[enabled]
+                current = states[b.component][firing][:, index]
+                states[b.component][firing[:, None], index[None, :]] = \
+                    np.where(selected, option.target, current)
+        return enabled
+
+    def _broadcast_agents(self, b: _CompiledBroadcast, option: _Port
+                          ) -> np.ndarray:
+        size = self.size
+        assignment = {b.broadcast.variable: np.arange(size)}
+        return np.broadcast_to(option.term.evaluate(assignment, size),
+                               (size,)) % size
+
+    def _broadcast(self, b: _CompiledBroadcast, states: List[np.ndarray],
+                   runs: np.ndarray, assignment: Dict[Variable, Any],
+                   agents: List[np.ndarray],
+                   generator: np.random.Generator
+                   ) -> Tuple[np.ndarray, np.ndarray]:
+        size = self.size
+        everyone = np.arange(size)
+        local = {v: value[:, None] for v, value in assignment.items()}
+        local[b.broadcast.variable] = everyone[None, :]
+        participating = np.zeros((len(runs), size), dtype=bool)
+        for conjunct in b.broadcast.guard.restrictions:
+            holds = np.ones((len(runs), size), dtype=bool)
+            for r in cast(RestrictionCollection, conjunct).restrictions:
+                holds &= r.evaluate(local, size)
+            participating |= holds
+        # as in the normalization, ports of the same type are never shadowed
+        # by the broadcast
+        for port, agent in zip(self.ports, agents):
+            if port.component == b.component:
+                participating &= everyone[None, :] != agent[:, None]
+        keys = np.full((len(runs), size), -1.0)
+        choice = np.full((len(runs), size), -1)
+        for k, option in enumerate(b.options):
+            if not self._valid_constant(option.term):
+                continue
+            index = self._broadcast_agents(b, option)
+            current = states[option.component][runs][:, index]
+            possible = current == option.source
+            draw = np.where(possible, generator.random(possible.shape), -1.0)
+            better = draw > keys
+            keys = np.where(better, draw, keys)
+            choice = np.where(better, k, choice)
+        return participating, choice
+
+
+@dataclass
+class Violation:
+    property_name: str
+    run: int
+    step: int
+    marking: Dict[str, List[int]] = field(repr=False)
+
+
+@dataclass
+class SimulationResult:
+    size: int
+    runs: int
+    steps: int
+    fired: int
+    seconds: float
+    violations: Dict[str, Violation]
+
+    @property
+    def agent_steps_per_second(self) -> float:
+        return self.size * self.runs * self.steps / max(self.seconds, 1e-9)
+
+
+class Simulator:
+    def __init__(self, interaction: Interaction, size: int, runs: int = 64,
+                 seed: Optional[int] = None, attempts: int = 4):
+        if size < 2:
+            raise SimulationError("Instances have at least two agents")
+        self.interaction = interaction
+        self.system: System = interaction.system
+        self.size = size
+        self.runs = runs
+        self.attempts = attempts
+        self.generator = np.random.default_rng(seed)
+        index = self.system.index
+        self.components = index.components
+        self.component_ids = index.component_ids
+        self.state_ids: Dict[str, Tuple[int, int]] = index.locations
+        if interaction.assumptions:
+            logger.warning("ignoring assumptions "
+                           + f"{sorted(interaction.assumptions)}"
+                           + " in simulation")
+        self.clauses = [CompiledClause(c, self) for c in interaction.clauses]
+        self.properties: List[CompiledProperty] = []
+        for name, text in sorted(interaction.properties.items()):
+            try:
+                compiled = CompiledProperty(name, text)
+            except SimulationError as e:
+                logger.warning(f"cannot simulate property {name}: {e}")
+                continue
+            if not compiled.supported_size(size):
+                logger.warning(f"cannot simulate property {name}: too many"
+                               + f" quantified variables for size {size}")
+                continue
+            self.properties.append(compiled)
+        self.states = [np.full((runs, size),
+                               self.state_ids[c.initial_state][1],
+                               dtype=np.min_scalar_type(len(c.states)))
+                       for c in self.components]
+        self.step_count = 0
+
+    def port(self, predicate: Predicate) -> _Port:
+        component, source = self.state_ids[predicate.pre]
+        _, target = self.state_ids[predicate.post]
+        return _Port(component, source, target, predicate.argument)
+
+    def membership(self, state: str) -> np.ndarray:
+        try:
+            component, state_id = self.state_ids[state]
+        except KeyError:
+            raise SimulationError(f"Unknown state {state}")
+        return self.states[component] == state_id
+
+    def marking(self, run: int) -> Dict[str, List[int]]:
+        return {s: np.flatnonzero(self.states[c][run] == j).tolist()
+                for s, (c, j) in self.state_ids.items()}
+
+    def step(self, active: np.ndarray) -> int:
+        pending = np.flatnonzero(active)
+        fired = 0
+        for _ in range(self.attempts):
+            if not len(pending) or not self.clauses:
+                break
+            choice = self.generator.integers(0, len(self.clauses),
+                                             len(pending))
+            still_pending = []
+            for number, clause in enumerate(self.clauses):
+                runs = pending[choice == number]
+                if not len(runs):
+                    continue
+                enabled = clause.fire(self.states, runs, self.generator)
+                fired += int(enabled.sum())
+                still_pending.append(runs[~enabled])
+            pending = (np.concatenate(still_pending) if still_pending
+                       else pending[:0])
+        self.step_count += 1
+        return fired
+
+    def check(self) -> Dict[str, np.ndarray]:
+        cache: Dict[str, np.ndarray] = {}
+
+        def membership(state: str) -> np.ndarray:
+            if state not in cache:
+                cache[state] = self.membership(state)
+            return cache[state]
+        return {p.name: p.holds(membership, self.runs, self.size)
+                for p in self.properties}
+
+    def run(self, steps: int, stop_on_violation: bool = True
+            ) -> SimulationResult:
+        start = time.perf_counter()
+        active = np.ones(self.runs, dtype=bool)
+        violations: Dict[str, Violation] = {}
+        fired = 0
+        for _ in range(steps):
+            fired += self.step(active)
+            for name, holds in self.check().items():
+                found = np.flatnonzero(holds & active)
+                if not len(found):
+                    continue
+                if name not in violations:
+                    run = int(found[0])
+                    logger.info(f"run {run} reached {name} after "
+                                + f"{self.step_count} steps")
+                    violations[name] = Violation(name, run, self.step_count,
+                                                 self.marking(run))
+                if stop_on_violation:
+                    active[found] = False
+            if not active.any():
+                break
+        return SimulationResult(self.size, self.runs, self.step_count, fired,
+                                time.perf_counter() - start, violations)
@@ -0,0 +1,412 @@
+from dataclasses import dataclass
+
+from typing import List, Dict, Tuple, Optional, Callable
+from itertools import product
+
+from processnet import PetriNet, gather
+from instantiation import Instance
+
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class StructuralError(Exception):
+    pass
+
+
+Row = Dict[int, int]
+
+# sparse integer rows (indptr, columns, values) with sorted columns and no
+# zeros in a row
+Sparse = Tuple[np.ndarray, np.ndarray, np.ndarray]
+
+# products of two coefficients below the limit stay in int64
+_COEFFICIENT_LIMIT = 1 << 31
+
+
+def _summed(keys: np.ndarray, values: np.ndarray
+            ) -> Tuple[np.ndarray, np.ndarray]:
+    # the distinct keys in order and their summed values, without zeros
+    order = np.argsort(keys, kind="stable")
+    keys = keys[order]
+    starts = np.flatnonzero(np.diff(keys, prepend=-1))
+    if not len(starts):
+        return keys, values[:0]
+    summed = np.add.reduceat(values[order], starts)
+    return keys[starts][summed != 0], summed[summed != 0]
+
+
+def _check(values: np.ndarray):
+    if len(values) and np.abs(values).max() >= _COEFFICIENT_LIMIT:
+        raise StructuralError("coefficients of the P-invariants exceed"
+                              + f" {_COEFFICIENT_LIMIT}")
+
+
+def _sparse(rows: np.ndarray, columns: np.ndarray, values: np.ndarray,
+            width: int) -> Sparse:
+    # the summed entries with rows divided by their gcd; rows that sum to
+    # zero are dropped and the others renumbered in order
+    keys, summed = _summed(rows * width + columns, values)
+    _, lengths = np.unique(keys // width, return_counts=True)
+    indptr = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=indptr[1:])
+    if len(summed):
+        divisors = np.gcd.reduceat(np.abs(summed), indptr[:-1])
+        summed //= np.repeat(divisors, lengths)
+    _check(summed)
+    return indptr, keys % width, summed
+
+
+def _rows(matrix: Sparse, rows: np.ndarray) -> Sparse:
+    indptr, columns, values = matrix
+    _, entries = gather(indptr, np.arange(len(columns)), rows)
+    selected = np.zeros(len(rows) + 1, dtype=np.int64)
+    np.cumsum(indptr[rows + 1] - indptr[rows], out=selected[1:])
+    return selected, columns[entries], values[entries]
+
+
+def _effects(net: PetriNet) -> Sparse:
+    # rows post - pre of the transitions
+    net.compile()
+    transitions = np.arange(net.number_of_transitions)
+    rows = np.concatenate([np.repeat(transitions, np.diff(net.pre_indptr)),
+                           np.repeat(transitions, np.diff(net.post_indptr))])
+    values = np.concatenate([np.full(len(net.pre_indices), -1),
+                             np.full(len(net.post_indices), 1)])
+    return _sparse(rows, np.concatenate([net.pre_indices, net.post_indices]),
+                   values, net.number_of_places)
+
+
+def _pivots(matrix: Sparse, priority: np.ndarray
+            ) -> Tuple[np.ndarray, np.ndarray]:
+    # rows and pivot columns that can be eliminated at once: no pivot row
+    # contains the pivot of another. A row pivots on its column that occurs
+    # in the fewest rows, which limits the fill; a column is claimed by its
+    # shortest row, and of two claims in conflict the one with the lower
+    # priority of its column wins, so the lowest claim always does.
+    indptr, columns, _ = matrix
+    lengths = np.diff(indptr)
+    rows = np.repeat(np.arange(len(lengths)), lengths)
+    width = len(priority)
+    occurrences = np.bincount(columns, minlength=width)
+    pivots = np.minimum.reduceat(occurrences[columns] * width + columns,
+                                 indptr[:-1]) % width
+    order = np.lexsort((np.arange(len(pivots)), lengths, pivots))
+    first = np.flatnonzero(np.diff(pivots[order], prepend=-1))
+    claims = order[first]
+    owner = np.full(width, -1)
+    owner[pivots[claims]] = claims
+    conflicting = np.full(len(lengths), len(priority))
+    others = owner[columns]
+    edges = (others >= 0) & (others != rows) & (owner[pivots[rows]] == rows)
+    left, right = rows[edges], others[edges]
+    np.minimum.at(conflicting, left, priority[pivots[right]])
+    np.minimum.at(conflicting, right, priority[pivots[left]])
+    winners = claims[priority[pivots[claims]] < conflicting[claims]]
+    return winners, pivots[winners]
+
+
+def _eliminate(matrix: Sparse, pivot_rows: np.ndarray,
+               pivots: np.ndarray, width: int) -> Sparse:
+    # fraction-free elimination of the pivot columns from all other rows,
+    # every row r becomes l * r - sum over its pivots k of l * c / a * row k
+    # for its coefficients c at and a of the pivot, l the least multiple
+    # that keeps the result integral
+    indptr, columns, values = matrix
+    lengths = np.diff(indptr)
+    rows = np.repeat(np.arange(len(lengths)), lengths)
+    owner = np.full(width, -1)
+    owner[pivots] = pivot_rows
+    is_pivot_row = np.zeros(len(lengths), dtype=bool)
+    is_pivot_row[pivot_rows] = True
+    pairs = np.flatnonzero((owner[columns] >= 0) & ~is_pivot_row[rows])
+    pair_rows, pivot_of = rows[pairs], owner[columns[pairs]]
+    at_pivot = np.zeros(len(lengths), dtype=np.int64)
+    own = owner[columns] == rows
+    at_pivot[rows[own]] = values[own]
+    a, c = at_pivot[pivot_of], values[pairs]
+    g = np.gcd(a, c)
+    needed = np.abs(a // g)
+    scale = np.ones(len(lengths), dtype=np.int64)
+    if len(pairs):
+        starts = np.flatnonzero(np.diff(pair_rows, prepend=-1))
+        scale[pair_rows[starts]] = np.lcm.reduceat(needed, starts)
+    factors = scale[pair_rows] // needed * (c // g) * np.sign(a)
+    positions, entries = gather(indptr, np.arange(len(columns)), pivot_of)
+    keep = ~is_pivot_row[rows]
+    return _sparse(
+            np.concatenate([rows[keep], pair_rows[positions]]),
+            np.concatenate([columns[keep], columns[entries]]),
+            np.concatenate([values[keep] * scale[rows[keep]],
+                            -factors[positions] * values[entries]]),
+            width)
+
+
+@dataclass
+class InvariantBasis:
+    # rows y of a basis of {y | y * (post - pre) = 0} in sparse row form;
+    # every reachable marking m satisfies y * m = y * initial marking
+    places: int
+    indptr: np.ndarray
+    indices: np.ndarray
+    data: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.indptr) - 1
+
+    def rows(self) -> List[Row]:
+        return [{int(p): int(v) for p, v in zip(
+                    self.indices[self.indptr[i]:self.indptr[i + 1]],
+                    self.data[self.indptr[i]:self.indptr[i + 1]])}
+                for i in range(len(self))]
+
+    def values(self, markings: np.ndarray) -> np.ndarray:
+        markings = np.atleast_2d(markings)
+        batch = len(markings)
+        rows = np.repeat(np.arange(len(self)), np.diff(self.indptr))
+        weights = markings[:, self.indices] * self.data[None, :]
+        keys = (np.arange(batch)[:, None] * len(self) + rows[None, :])
+        return np.bincount(keys.ravel(), weights=weights.ravel(),
+                           minlength=batch * len(self)
+                           ).reshape(batch, len(self)).astype(np.int64)
+
+
+def p_invariants(net: PetriNet) -> InvariantBasis:
+    # echelon form of the transition effects by rounds of sparse elimination
+    # with many pivots each, then back substitution from the last round on:
+    # every column that is never a pivot gives an invariant that is 0 at the
+    # other such columns
+    width = net.number_of_places
+    priority = np.random.default_rng(0).permutation(width)
+    matrix = _effects(net)
+    rounds: List[Tuple[np.ndarray, Sparse]] = []
+    while len(matrix[0]) > 1:
+        pivot_rows, pivots = _pivots(matrix, priority)
+        rounds.append((pivots, _rows(matrix, pivot_rows)))
+        matrix = _eliminate(matrix, pivot_rows, pivots, width)
+    free = np.ones(width, dtype=bool)
+    for pivots, _ in rounds:
+        free[pivots] = False
+    # entries (column, invariant, value) of all invariants
+    y_columns = np.flatnonzero(free)
+    invariants = len(y_columns)
+    y_rows = np.arange(invariants)
+    y_values = np.ones(invariants, dtype=np.int64)
+    for pivots, (indptr, columns, values) in reversed(rounds):
+        order = np.argsort(y_columns, kind="stable")
+        y_columns, y_rows = y_columns[order], y_rows[order]
+        y_values = y_values[order]
+        y_indptr = np.zeros(width + 1, dtype=np.int64)
+        np.cumsum(np.bincount(y_columns, minlength=width),
+                  out=y_indptr[1:])
+        rows = np.repeat(np.arange(len(pivots)), np.diff(indptr))
+        at_pivot = columns == pivots[rows]
+        a = values[at_pivot]
+        rows, columns = rows[~at_pivot], columns[~at_pivot]
+        values = values[~at_pivot]
+        # y at a pivot is -1 / a times the sum over the rest of its row
+        positions, entries = gather(y_indptr, np.arange(len(y_rows)),
+                                    columns)
+        keys, sums = _summed(rows[positions] * invariants + y_rows[entries],
+                             values[positions] * y_values[entries])
+        pivot_rows, targets = keys // invariants, keys % invariants
+        divisors = a[pivot_rows]
+        scale = np.ones(invariants, dtype=np.int64)
+        np.lcm.at(scale, targets,
+                  np.abs(divisors) // np.gcd(divisors, sums))
+        y_values = y_values * scale[y_rows]
+        y_columns = np.concatenate([y_columns, pivots[pivot_rows]])
+        y_rows = np.concatenate([y_rows, targets])
+        y_values = np.concatenate(
+                [y_values, -sums * scale[targets] // divisors])
+        _check(y_values)
+    indptr, indices, data = _sparse(y_rows, y_columns, y_values, width)
+    logger.info(f"found {invariants} independent P-invariants in"
+                + f" {len(rounds)} rounds of elimination")
+    return InvariantBasis(width, indptr, indices, data)
+
+
+def _maximal_closed(net: PetriNet, places: np.ndarray,
+                    consumed: Tuple[np.ndarray, np.ndarray],
+                    producing: Tuple[np.ndarray, np.ndarray]) -> np.ndarray:
+    # largest subset Q of places with: every transition consuming from Q
+    # produces into Q; consumed lists the places a transition consumes from,
+    # producing the transitions producing into a place. Counts for every
+    # transition how many of its produced places are in Q and only updates
+    # the counts of transitions next to removed places.
+    places = np.array(np.atleast_2d(places), dtype=bool)
+    batch = len(places)
+    transitions = net.number_of_transitions
+    producing_indptr, producing_indices = producing
+    produced = np.repeat(np.arange(net.number_of_places),
+                         np.diff(producing_indptr))
+    rows = np.arange(batch)[:, None]
+    hits = np.bincount(
+            (rows * transitions + producing_indices[None, :]).ravel(),
+            weights=places[:, produced].ravel(),
+            minlength=batch * transitions
+            ).reshape(batch, transitions).astype(np.int64)
+    violated_b, violated_t = np.nonzero(hits == 0)
+    while len(violated_t):
+        positions, candidates = gather(*consumed, violated_t)
+        removed_b = violated_b[positions]
+        keep = places[removed_b, candidates]
+        removed_b, removed_p = removed_b[keep], candidates[keep]
+        if not len(removed_p):
+            return places
+        places[removed_b, removed_p] = False
+        # a place may be removed for several transitions at once
+        if len(removed_p) * 8 > places.size:
+            mask = np.zeros_like(places)
+            mask[removed_b, removed_p] = True
+            removed_b, removed_p = np.nonzero(mask)
+        else:
+            removed = np.unique(removed_b * net.number_of_places + removed_p)
+            removed_b = removed // net.number_of_places
+            removed_p = removed % net.number_of_places
+        positions, affected = gather(producing_indptr, producing_indices,
+                                     removed_p)
+        keys = removed_b[positions] * transitions + affected
+        flat = hits.reshape(-1)
+        if len(keys) * 8 > len(flat):
+            decrements = np.bincount(keys, minlength=len(flat))
+            flat -= decrements
+            dropped = np.flatnonzero((decrements > 0) & (flat == 0))
+        else:
+            dropped, counts = np.unique(keys, return_counts=True)
+            flat[dropped] -= counts
+            dropped = dropped[flat[dropped] == 0]
+        violated_b, violated_t = dropped // transitions, dropped % transitions
+    return places
+
+
+def maximal_trap(net: PetriNet, places: np.ndarray) -> np.ndarray:
+    # for a batch of place sets (batch, places) the maximal trap in each
+    producers = net.producers
+    return _maximal_closed(net, places, (net.pre_indptr, net.pre_indices),
+                           producers)
+
+
+def maximal_siphon(net: PetriNet, places: np.ndarray) -> np.ndarray:
+    # for a batch of place sets (batch, places) the maximal siphon in each
+    consumers = net.consumers
+    return _maximal_closed(net, places, (net.post_indptr, net.post_indices),
+                           consumers)
+
+
+class StructuralFilter:
+    # necessary conditions for reachability from the initial marking: the
+    # P-invariants, no initially marked trap is emptied and no initially
+    # empty siphon gets marked
+    def __init__(self, net: PetriNet):
+        self.net = net
+        self.initial = net.initial_marking
+        self.invariants = p_invariants(net)
+        self.initial_values = self.invariants.values(self.initial)
+        self.empty_siphon = maximal_siphon(net, self.initial <= 0)[0]
+
+    def violates_invariants(self, markings: np.ndarray) -> np.ndarray:
+        values = self.invariants.values(markings)
+        return (values != self.initial_values).any(axis=1)
+
+    def empties_trap(self, markings: np.ndarray) -> np.ndarray:
+        traps = maximal_trap(self.net, np.atleast_2d(markings) <= 0)
+        return np.any(traps & (self.initial > 0)[None, :], axis=1)
+
+    def marks_siphon(self, markings: np.ndarray) -> np.ndarray:
+        marked = np.atleast_2d(markings) > 0
+        return (marked & self.empty_siphon[None, :]).any(axis=1)
+
+    def refutes(self, markings: np.ndarray) -> np.ndarray:
+        markings = np.atleast_2d(markings)
+        refuted = self.violates_invariants(markings)
+        refuted |= self.marks_siphon(markings)
+        open_markings = np.flatnonzero(~refuted)
+        if len(open_markings):
+            refuted[open_markings] = self.empties_trap(
+                    markings[open_markings])
+        return refuted
+
+
+@dataclass
+class PropertyCheck:
+    property_name: str
+    size: int
+    markings: int
+    bad: int
+    refuted: int
+    # a bad marking that is not refuted, by state
+    witness: Optional[Dict[str, List[int]]] = None
+
+    @property
+    def proven(self) -> bool:
+        return self.bad == self.refuted
+
+
+def _consistent_markings(instance: Instance, limit: int, chunk: int):
+    # all markings with exactly one state per agent and component
+    index = instance.interaction.system.index
+    local = [[index.state_ids[s] for s in product_states]
+             for product_states in product(*[c.states
+                                             for c in index.components])]
+    total = len(local) ** instance.size
+    if total > limit:
+        raise StructuralError(f"{total} markings of size {instance.size}"
+                              + f" exceed the limit of {limit}")
+    states = len(index.states)
+    agents = np.arange(instance.size) * states
+    choices = np.array(local, dtype=np.int64)
+    for start in range(0, total, chunk):
+        numbers = np.arange(start, min(start + chunk, total))
+        markings = np.zeros((len(numbers), instance.size * states),
+                            dtype=np.int32)
+        for agent in range(instance.size):
+            selected = choices[numbers % len(local)]
+            numbers = numbers // len(local)
+            rows = np.repeat(np.arange(len(selected)), selected.shape[1])
+            markings[rows, (agents[agent] + selected).ravel()] = 1
+        yield markings
+
+
+def bad_markings(instance: Instance, property_name: str
+                 ) -> Callable[[np.ndarray], np.ndarray]:
+    # for a batch of markings (batch, places) whether each violates the
+    # property, deadlock holds if no transition is enabled
+    from simulation import CompiledProperty
+    if property_name == "deadlock":
+        return lambda markings: ~np.any(instance.net.enabled(markings),
+                                        axis=1)
+    compiled = CompiledProperty(property_name,
+                                instance.interaction.properties[property_name])
+    states = instance.interaction.system.index.state_ids
+
+    def is_bad(markings: np.ndarray) -> np.ndarray:
+        markings = np.atleast_2d(markings)
+        by_agent = markings.reshape(len(markings), instance.size, -1)
+        return compiled.holds(lambda s: by_agent[:, :, states[s]] > 0,
+                              len(markings), instance.size)
+    return is_bad
+
+
+def check_property(instance: Instance, property_name: str,
+                   limit: int = 1 << 20, chunk: int = 1 << 12,
+                   structural_filter: Optional[StructuralFilter] = None
+                   ) -> PropertyCheck:
+    # enumerates the bad markings of a property in the instance and checks
+    # whether the structural conditions show all of them unreachable
+    net = instance.net
+    structural_filter = structural_filter or StructuralFilter(net)
+    is_bad = bad_markings(instance, property_name)
+    result = PropertyCheck(property_name, instance.size, 0, 0, 0)
+    for markings in _consistent_markings(instance, limit, chunk):
+        bad = markings[is_bad(markings)]
+        refuted = structural_filter.refutes(bad)
+        result.markings += len(markings)
+        result.bad += len(bad)
+        result.refuted += int(refuted.sum())
+        if result.witness is None and not refuted.all():
+            result.witness = instance.marking(bad[np.argmin(refuted)])
+    return result
@@ -1,4 +1,4 @@
-from typing import Set, Optional, Tuple, cast, FrozenSet, List, Dict
+from typing import Optional, Tuple, cast, FrozenSet, List, Dict
 from dataclasses import dataclass
 from enum import Enum, unique
 
@@ -41,6 +41,10 @@ class Component:
         # TODO: maybe check for connectivity
         object.__setattr__(self, '_transition_by_label', collection_by_label)
         object.__setattr__(self, '_states', sorted(list(states)))
+        object.__setattr__(self, '_state_variables',
+                           [mona.Variable(s) for s in self._states])
+        object.__setattr__(self, '_labels',
+                           frozenset(collection_by_label.keys()))
 
     @property
     def states(self) -> List[str]:
@@ -52,15 +56,15 @@ class Component:
 
     @property
     def state_variables(self) -> List[mona.Variable]:
-        return sorted([mona.Variable(s) for s in self.states], key=str)  # type: ignore # noqa: E501, F723
+        return self._state_variables  # type: ignore # noqa: F723
 
     @property
     def number_of_states(self) -> int:
         return len(self.states)  # type: ignore
 
     @property
-    def labels(self) -> Set[str]:
-        return set(self.transition_by_label.keys())  # type: ignore
+    def labels(self) -> FrozenSet[str]:
+        return self._labels  # type: ignore # noqa: F723
 
     @property
     def number_of_labels(self) -> int:
@@ -92,6 +96,41 @@ class SystemAddition(Enum):
     ASSUMPTION = "assumption"
 
 
+@dataclass(frozen=True)
+class SystemIndex:
+    # states get consecutive integer ids per component, components are
+    # ordered by name
+    components: Tuple[Component, ...]
+    component_ids: Dict[Component, int]
+    states: Tuple[str, ...]
+    state_ids: Dict[str, int]
+    state_ranges: Tuple[range, ...]
+    # state -> (component id, position within the component)
+    locations: Dict[str, Tuple[int, int]]
+    # label -> (component id, source state id, target state id)
+    edges: Dict[str, Tuple[int, int, int]]
+
+    @classmethod
+    def of(cls, components: FrozenSet[Component]) -> "SystemIndex":
+        ordered = tuple(sorted(components, key=lambda c: c.name))
+        states: List[str] = []
+        state_ranges: List[range] = []
+        for c in ordered:
+            state_ranges.append(range(len(states),
+                                      len(states) + c.number_of_states))
+            states += c.states
+        state_ids = {s: i for i, s in enumerate(states)}
+        locations = {s: (i, j)
+                     for i, c in enumerate(ordered)
+                     for j, s in enumerate(c.states)}
+        edges = {label: (i, state_ids[source], state_ids[target])
+                 for i, c in enumerate(ordered)
+                 for label, (source, target) in c.transition_by_label.items()}
+        return cls(ordered, {c: i for i, c in enumerate(ordered)},
+                   tuple(states), state_ids, tuple(state_ranges), locations,
+                   edges)
+
+
 @dataclass(frozen=True)
 class System:
     components: FrozenSet[Component]
@@ -108,19 +147,27 @@ class System:
         sum_of_labels = sum([c.number_of_labels for c in self.components])
         if len(all_labels) != sum_of_labels:
             raise SystemDefinitionError(f"Not disjoint labels in components!")
+        states = frozenset(s for c in self.components for s in c.states)
+        object.__setattr__(self, '_states', states)
+        object.__setattr__(self, '_state_variables',
+                           [mona.Variable(s) for s in sorted(states)])
+        object.__setattr__(self, '_index', SystemIndex.of(self.components))
 
     @property
     def components_of_labels(self) -> Dict[str, Component]:
         return self._components_of_labels  # type: ignore # noqa: F723, E501
 
     @property
-    def states(self) -> Set[str]:
-        return set(sum([c.states for c in self.components],
-                       []))
+    def states(self) -> FrozenSet[str]:
+        return self._states  # type: ignore # noqa: F723
 
     @property
     def state_variables(self) -> List[mona.Variable]:
-        return sorted([mona.Variable(s) for s in self.states], key=str)
+        return self._state_variables  # type: ignore # noqa: F723
+
+    @property
+    def index(self) -> SystemIndex:
+        return self._index  # type: ignore # noqa: F723
 
     def edge_with_label(self, label: str) -> Optional[Tuple[str, str]]:
         try:
@@ -1,6 +1,6 @@
 import unittest
 
-from system import Component, SystemDefinitionError
+from system import Component, System, SystemDefinitionError
 
 class ComponentTest(unittest.TestCase):
     def setUp(self):
@@ -28,5 +28,18 @@ class ComponentTest(unittest.TestCase):
             Component("Test Component", "first", self.same_label_transitions)
 
 
+class SystemIndexTest(unittest.TestCase):
+    def test_index(self):
+        first = Component("b", "p", frozenset({("p", "go", "q"),
+                                               ("q", "back", "p")}))
+        second = Component("a", "s", frozenset({("s", "idle", "s")}))
+        index = System(frozenset({first, second})).index
+        self.assertEqual(index.components, (second, first))
+        self.assertEqual(index.states, ("s", "p", "q"))
+        self.assertEqual(index.state_ranges, (range(0, 1), range(1, 3)))
+        self.assertEqual(index.locations["q"], (1, 1))
+        self.assertEqual(index.edges["back"], (1, 2, 1))
+
+
 if __name__ == '__main__':
     unittest.main()
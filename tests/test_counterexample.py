@@ -0,0 +1,64 @@
+import unittest
+
+from parser import parse_file
+from formula import Backend
+from counterexample import CounterexampleError, Verdict
+from counterexample import parse_example, replay
+
+EXAMPLE = """A counter-example of least length (0) is:
+n                X
+crit             X
+init             X
+
+n = 0
+crit = {}
+init = {}
+
+A satisfying example of least length (3) is:
+n                X 0 0 1
+crit             X 1 1 0
+init             X 0 0 1
+
+n = 2
+crit = {0,1}
+init = {2}
+"""
+
+
+class CounterexampleTest(unittest.TestCase):
+    def setUp(self):
+        self.nomutex = parse_file("examples/nomutex.sys")
+        self.burns = parse_file("examples/burns.sys")
+
+    def test_parse(self):
+        counterexample = parse_example(EXAMPLE, self.nomutex)
+        self.assertEqual(counterexample.size, 2)
+        self.assertEqual(counterexample.states["crit"], {0, 1})
+        self.assertEqual(counterexample.states["init"], set())
+
+    def test_parse_m2l_str(self):
+        output = EXAMPLE.replace("n = 2\n", "")
+        counterexample = parse_example(output, self.nomutex, Backend.M2L_STR)
+        self.assertEqual(counterexample.size, 3)
+        with self.assertRaises(CounterexampleError):
+            parse_example(output, self.nomutex)
+
+    def test_genuine(self):
+        counterexample = parse_example(EXAMPLE, self.nomutex)
+        result = replay(self.nomutex, counterexample, "mutex")
+        self.assertEqual(result.verdict, Verdict.GENUINE)
+        self.assertEqual(result.witness["crit"], [0, 1])
+
+    def test_spurious(self):
+        output = EXAMPLE.replace("crit = {0,1}", "pc6 = {0,1}").replace(
+                "init = {2}", "pc1 = {}\npc2 = {}\npc3 = {}\npc4 = {}\n"
+                + "pc5 = {2}")
+        counterexample = parse_example(output, self.burns)
+        result = replay(self.burns, counterexample, "nomutex")
+        self.assertEqual(result.verdict, Verdict.SPURIOUS)
+        result = replay(self.burns, counterexample, "nomutex", limit=5)
+        self.assertEqual(result.verdict, Verdict.UNKNOWN)
+
+
+if __name__ == '__main__':
+    unittest.main()
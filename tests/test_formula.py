@@ -1,5 +1,10 @@
 import unittest
 
+import pickle
+
+from itertools import product
+from tempfile import NamedTemporaryFile
+
 from formula import *
 
 class FormulaTest(unittest.TestCase):
@@ -33,5 +38,333 @@ class FormulaTest(unittest.TestCase):
         b = Broadcast(self.x, self.guard_xy, self.port_succ_x, 0)
         self.assertEqual(b.free_variables, {self.y})
 
+
+class ExactlyOneTest(unittest.TestCase):
+    def evaluate(self, formula, values):
+        if isinstance(formula, mona.BooleanVariable):
+            return values[formula.name]
+        elif isinstance(formula, mona.Negation):
+            return not self.evaluate(formula.inner, values)
+        elif isinstance(formula, mona.Conjunction):
+            return all(self.evaluate(s, values) for s in formula.statements)
+        elif isinstance(formula, mona.Disjunction):
+            return any(self.evaluate(s, values) for s in formula.statements)
+        elif isinstance(formula, mona.Implication):
+            return (not self.evaluate(formula.left, values)
+                    or self.evaluate(formula.right, values))
+        names = [v.name for v in formula.variables]
+        return any(self.evaluate(formula.inner,
+                                 {**values, **dict(zip(names, choice))})
+                   for choice in product([False, True], repeat=len(names)))
+
+    def items(self, size):
+        return [(mona.BooleanVariable(f"a{i}"),
+                 mona.Negation(mona.BooleanVariable(f"a{i}")))
+                for i in range(size)]
+
+    def test_linear_encoding_is_equivalent(self):
+        from unittest.mock import patch
+        for size in range(1, 6):
+            items = self.items(size)
+            quadratic = exactly_one("q", items, ExactlyOneEncoding.QUADRATIC)
+            with patch("formula.LINEAR_EXACTLY_ONE_MINIMUM", 3):
+                linear = exactly_one("l", items, ExactlyOneEncoding.LINEAR)
+            self.assertEqual(isinstance(linear, mona.ExistentialZeroOrder),
+                             size >= 3)
+            for choice in product([False, True], repeat=size):
+                values = {f"a{i}": v for i, v in enumerate(choice)}
+                self.assertEqual(self.evaluate(quadratic, values),
+                                 sum(choice) == 1)
+                self.assertEqual(self.evaluate(linear, values),
+                                 sum(choice) == 1)
+
+    def test_short_lists_stay_quadratic(self):
+        short = self.items(LINEAR_EXACTLY_ONE_MINIMUM - 1)
+        self.assertEqual(
+                exactly_one("l", short, ExactlyOneEncoding.LINEAR).render(),
+                exactly_one("q", short,
+                            ExactlyOneEncoding.QUADRATIC).render())
+        long = self.items(LINEAR_EXACTLY_ONE_MINIMUM)
+        self.assertLess(
+                len(exactly_one("l", long, ExactlyOneEncoding.LINEAR
+                                ).render()),
+                len(exactly_one("q", long, ExactlyOneEncoding.QUADRATIC
+                                ).render()))
+
+
+class OptimizeClausesTest(unittest.TestCase):
+    def parse(self, clauses):
+        from parser import parse_file
+        text = ("Component agent <a> {\n a -> go -> b\n b -> back -> a\n"
+                + " a -> isA -> a\n b -> isB -> b\n}\n"
+                + "Formula {\n" + clauses + "\n}\n")
+        with NamedTemporaryFile("w", suffix=".sys") as f:
+            print(text, file=f, flush=True)
+            return parse_file(f.name).normalize()
+
+    def test_removes_renamed_duplicates(self):
+        interaction = self.parse("p < q. go(p) & isA(q);"
+                                 + " s < t. isA(t) & go(s);")
+        self.assertEqual(len(interaction.optimize_clauses().clauses), 1)
+
+    def test_merges_guards(self):
+        interaction = self.parse("p < q. go(p) & isA(q);"
+                                 + " q < p. go(p) & isA(q);"
+                                 + " back(p);")
+        clauses = interaction.optimize_clauses().clauses
+        self.assertEqual(len(clauses), 2)
+        self.assertEqual(len(clauses[0].guards), 2)
+        self.assertEqual(clauses[0].free_variables,
+                         interaction.clauses[0].free_variables)
+
+    def test_keeps_different_ports(self):
+        interaction = self.parse("w < p. isA(w) & go(p);"
+                                 + " w < p. isB(w) & go(p);")
+        self.assertEqual(len(interaction.optimize_clauses().clauses), 2)
+
+    def test_keeps_labels_named_like_variables(self):
+        interaction = self.parse("p < q. go(p) & isA(q);")
+        system = interaction.system
+        ports = {p.name: p for p in interaction.clauses[0].ports.predicates}
+        go, is_a = Variable(system, "go"), Variable(system, "isA")
+
+        def clause(smaller, larger):
+            guard = RestrictionCollection(
+                    system, frozenset([Less(system, smaller, larger)]))
+            return Clause(system, guard, PredicateCollection(system, frozenset(
+                    [Predicate(system, p.name, v, p.pre, p.post)
+                     for p, v in [(ports["go"], go), (ports["isA"], is_a)]])),
+                [])
+        # a renaming of the variables must leave the labels alone
+        self.assertNotEqual(clause_key(clause(go, is_a)),
+                            clause_key(clause(is_a, go)))
+
+
+class ConeOfInfluenceTest(unittest.TestCase):
+    def setUp(self):
+        from parser import parse_file
+        text = ("Component left <l> {\n l -> go -> m\n m -> back -> l\n}\n"
+                + "Component right <r> {\n r -> up -> s\n s -> down -> r\n}\n"
+                + "Component other <o> {\n o -> in -> p\n p -> out -> o\n}\n"
+                + "Formula {\n go(x); y ~= x. back(x) & up(y); down(x);"
+                + " in(x); out(x);\n}\n"
+                + 'property "right" {\n "ex1 i: i in s"\n}\n'
+                + 'property "other" {\n "ex1 i: i in p"\n}\n')
+        with NamedTemporaryFile("w", suffix=".sys") as f:
+            print(text, file=f, flush=True)
+            self.interaction = parse_file(f.name).normalize()
+
+    def names(self, components):
+        return sorted(c.name for c in components)
+
+    def test_shared_clauses_connect_components(self):
+        reduced = self.interaction.cone_of_influence("right")
+        self.assertEqual(self.names(reduced.system.components),
+                         ["left", "right"])
+        self.assertEqual(len(reduced.clauses), 3)
+        self.assertEqual(reduced.property_names, ["deadlock", "right"])
+        self.assertEqual(reduced.state_order, ["l", "m", "r", "s"])
+        other = self.interaction.cone_of_influence("other")
+        self.assertEqual(self.names(other.system.components), ["other"])
+        self.assertNotIn("var2 l,", other.render_base_theory())
+
+    def test_unreduced_properties(self):
+        self.assertIs(self.interaction.cone_of_influence("deadlock"),
+                      self.interaction)
+        # an assumption on a state keeps its component
+        assumed = self.interaction.with_assumption("a", "all1 i: i notin o")
+        self.assertIs(assumed.cone_of_influence("right"), assumed)
+        left = frozenset(c for c in self.interaction.system.components
+                         if c.name == "left")
+        with self.assertRaises(FormulaError):
+            self.interaction.restricted_to(left, "right")
+
+
+class InterningTest(unittest.TestCase):
+    def setUp(self):
+        from system import Component, System
+        self.system = System(frozenset({Component(
+            "agent", "a", frozenset({("a", "go", "a")}))}))
+        self.x = Variable(self.system, "x")
+        self.y = Variable(self.system, "y")
+
+    def test_equal_terms_are_shared(self):
+        self.assertIs(Variable(self.system, "x"), self.x)
+        self.assertIs(Successor(self.system, self.x),
+                      Successor(self.system, Variable(self.system, "x")))
+        self.assertIs(Less(self.system, self.x, self.y),
+                      Less(self.system, left=self.x, right=self.y))
+        self.assertEqual(pickle.loads(pickle.dumps(self.x)), self.x)
+
+    def test_symmetric_restrictions(self):
+        xy = Unequal(self.system, self.x, self.y)
+        yx = Unequal(self.system, self.y, self.x)
+        self.assertEqual(xy, yx)
+        self.assertEqual(hash(xy), hash(yx))
+        self.assertNotEqual(Less(self.system, self.x, self.y),
+                            Less(self.system, self.y, self.x))
+        self.assertNotEqual(xy, Equal(self.system, self.x, self.y))
+
+
+class RenderTest(unittest.TestCase):
+    def test_streamed_proof_script(self):
+        from io import StringIO
+        from parser import parse_file
+        interaction = parse_file("examples/burns.sys").normalize()
+        base_theory = interaction.render_base_theory()
+        expected = interaction.render_property_unreachability("nomutex",
+                                                              base_theory)
+        self.assertEqual(
+                interaction.render_property_unreachability("nomutex"),
+                expected)
+        sink = StringIO()
+        interaction.write_property_unreachability("nomutex", sink,
+                                                  StringIO(base_theory))
+        self.assertEqual(sink.getvalue(), expected)
+
+    def test_default_where(self):
+        from dataclasses import replace
+        from parser import parse_file
+        interaction = parse_file("examples/burns.sys")
+        guarded = interaction.normalize().render_property_unreachability(
+                "nomutex")
+        restricted = replace(
+                interaction, options=EmissionOptions(default_where=True)
+                ).normalize().render_property_unreachability("nomutex")
+        self.assertNotIn("defaultwhere1", guarded)
+        self.assertIn("defaultwhere1(p) = p < n;", restricted)
+        self.assertIn("x_0 < n\n", guarded)
+        self.assertNotIn("x_0 < n\n", restricted)
+        self.assertLess(len(restricted), len(guarded))
+
+    def test_default_where_bounds_raw_formulas(self):
+        # quantifiers written by users are emitted as they are, so only the
+        # default restriction bounds them
+        from dataclasses import replace
+        from parser import parse_file
+        interaction = (parse_file("examples/burns.sys")
+                       .with_assumption("first", "ex1 q: q = 0")
+                       .with_property("late", "ex1 q: q > 2"))
+        for default_where in [False, True]:
+            options = EmissionOptions(default_where=default_where)
+            normalized = replace(interaction, options=options).normalize()
+            script = normalized.render_property_unreachability("late")
+            self.assertIn("ex1 q: q = 0;", script)
+            self.assertIn("ex1 q: q > 2\n", script)
+            if default_where:
+                self.assertLess(script.index("defaultwhere1(p) = p < n;"),
+                                script.index("ex1 q: q = 0;"))
+            else:
+                self.assertNotIn("defaultwhere1", script)
+
+    def test_suspended_stream_keeps_guards(self):
+        from dataclasses import replace
+        from parser import parse_file
+        interaction = parse_file("examples/burns.sys")
+        expected = interaction.normalize().render_property_unreachability(
+                "nomutex")
+        plain = parse_file("examples/burns.sys").normalize()
+        restricted = replace(
+                interaction, options=EmissionOptions(default_where=True)
+                ).normalize()
+        stream = restricted.stream_property_unreachability("nomutex")
+        first = next(stream)
+        self.assertEqual(plain.render_property_unreachability("nomutex"),
+                         expected)
+        self.assertEqual(first + "".join(stream),
+                         restricted.render_property_unreachability("nomutex"))
+        self.assertEqual(plain.render_property_unreachability("nomutex"),
+                         expected)
+
+    def test_m2l_str(self):
+        from dataclasses import replace
+        from parser import parse_file
+        interaction = replace(
+                parse_file("examples/mesi.sys"),
+                options=EmissionOptions(backend=Backend.M2L_STR)).normalize()
+        script = interaction.render_property_unreachability("deadlock")
+        self.assertTrue(script.startswith("m2l-str;"))
+        self.assertNotIn("var1 n", script)
+        self.assertNotIn(" < n", script)
+        self.assertEqual(m2l_str_formula("0 <= x & x < n & y = n-1"),
+                         "0 <= x & x <= $ & y = $")
+        with self.assertRaises(FormulaError):
+            m2l_str_formula("n in X")
+
+    def test_incremental_changes(self):
+        from dataclasses import replace
+        from parser import parse_file
+        interaction = parse_file("examples/burns.sys")
+        normalized = interaction.normalize()
+        normalized.render_base_theory()
+        removed = interaction.without_clause(0).normalize()
+        for old, new in zip(normalized.clauses[1:], removed.clauses):
+            self.assertIs(old, new)
+        # reused predicates are renumbered after their new position
+        scratch = replace(interaction, clauses=interaction.clauses[1:])
+        self.assertEqual(removed.render_base_theory(),
+                         scratch.normalize().render_base_theory())
+        restored = removed.with_clause(interaction.clauses[0], 0)
+        self.assertEqual(restored.normalize().render_base_theory(),
+                         normalized.render_base_theory())
+        for old, new in zip(normalized.clauses,
+                            normalized.normalize().clauses):
+            self.assertIs(old, new)
+        changed = (normalized.with_property("none", "true")
+                   .without_property("nomutex")
+                   .with_assumption("small", "n < 3"))
+        self.assertEqual(changed.property_names, ["deadlock", "none"])
+        self.assertIn("n < 3;", changed.render_base_theory())
+        self.assertEqual(normalized.property_names, ["deadlock", "nomutex"])
+        with self.assertRaises(FormulaError):
+            changed.without_assumption("nomutex")
+
+    def test_cache_keeps_guards_of_suspended_streams(self):
+        from dataclasses import replace
+        from parser import parse_file
+        interaction = parse_file("examples/burns.sys")
+        expected = interaction.normalize().render_base_theory()
+        plain = parse_file("examples/burns.sys").normalize()
+        restricted = replace(
+                interaction, options=EmissionOptions(default_where=True)
+                ).normalize()
+        stream = restricted.stream_base_theory()
+        next(stream)
+        # fills the clause cache shared with plain while the stream waits
+        plain.with_property("none", "true").render_base_theory()
+        "".join(stream)
+        self.assertEqual(plain.render_base_theory(), expected)
+
+
+class VariableOrderTest(unittest.TestCase):
+    def interaction(self, **options):
+        from dataclasses import replace
+        from parser import parse_file
+        interaction = parse_file("examples/dijkstra-ring.sys")
+        return replace(interaction,
+                       options=EmissionOptions(**options)).normalize()
+
+    def test_orders_are_permutations(self):
+        states = sorted(self.interaction().system.states)
+        for order in VariableOrder:
+            interaction = self.interaction(variable_order=order)
+            self.assertEqual(sorted(interaction.state_order), states)
+        grouped = self.interaction(variable_order=VariableOrder.COMPONENT)
+        position = {s: i for i, s in enumerate(grouped.state_order)}
+        for c in grouped.system.components:
+            ranks = sorted(position[s] for s in c.states)
+            self.assertEqual(ranks[-1] - ranks[0], len(ranks) - 1)
+
+    def test_copies_follow_order(self):
+        interaction = self.interaction(
+                variable_order=VariableOrder.COOCCURRENCE,
+                interleave_copies=True)
+        first = interaction.state_order[0]
+        signature = interaction.intersection_predicate().render()
+        self.assertIn(f"var2 one{first}, var2 two{first},", signature)
+        trap = interaction.trap_invariant_predicate().render()
+        self.assertIn(f"intersection(T{first}, {first},", trap)
+
+
 if __name__ == '__main__':
     unittest.main()
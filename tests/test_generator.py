@@ -0,0 +1,50 @@
+import unittest
+
+from tempfile import NamedTemporaryFile
+
+from generator import SystemShape, generate
+from benchmark import measure
+from instantiation import instantiate
+from parser import parse_file
+
+
+class GeneratorTest(unittest.TestCase):
+    def parse(self, shape):
+        with NamedTemporaryFile(mode="w", suffix=".sys") as system_file:
+            system_file.write(generate(shape))
+            system_file.flush()
+            return parse_file(system_file.name)
+
+    def test_shapes(self):
+        for shape in [SystemShape(),
+                      SystemShape(components=3, states=6, clauses=24,
+                                  broadcasts=30, guard_size=3, succ_depth=3,
+                                  seed=1),
+                      SystemShape(components=1, states=2, clauses=1,
+                                  broadcasts=0, guard_size=0)]:
+            interaction = self.parse(shape)
+            self.assertEqual(len(interaction.clauses), shape.clauses)
+            self.assertEqual(len(interaction.system.components),
+                             shape.components)
+            self.assertEqual(len(interaction.system.states),
+                             shape.components * shape.states)
+            normalized = interaction.normalize()
+            self.assertIn("crowded(", normalized.render_base_theory())
+            instantiate(interaction, 3)
+
+    def test_deterministic(self):
+        shape = SystemShape(succ_depth=2, seed=7)
+        self.assertEqual(generate(shape), generate(shape))
+        self.assertIn("succ(succ(", generate(shape))
+
+    def test_measure(self):
+        measurements = measure(SystemShape(clauses=2), "clauses")
+        self.assertEqual([m.stage for m in measurements],
+                         ["parse", "normalize", "base theory",
+                          "proof scripts"])
+        self.assertTrue(all(m.value == 2 for m in measurements))
+        self.assertGreater(measurements[2].output_chars, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,43 @@
+import unittest
+
+from tempfile import TemporaryDirectory
+import os
+
+from history import History, Run
+
+
+class HistoryTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = TemporaryDirectory()
+        self.history = History(os.path.join(self.directory.name, "h.sqlite"))
+
+    def tearDown(self):
+        self.history.close()
+        self.directory.cleanup()
+
+    def record(self, started, duration, verdict="proven", digest="a"):
+        self.history.record(Run(digest, "burns.sys", "deadlock", "default",
+                                started, duration, 1024 * duration,
+                                verdict))
+
+    def test_estimate_averages_recent_runs(self):
+        self.assertIsNone(self.history.estimate("a", "deadlock", "default"))
+        for started in range(10):
+            self.record(started, started)
+        self.record(10, 100, verdict="error")
+        estimate = self.history.estimate("a", "deadlock", "default")
+        self.assertEqual(estimate.duration, 7)
+        self.assertEqual(estimate.peak_rss, 9 * 1024)
+        self.assertIsNone(self.history.estimate("a", "deadlock", "other"))
+
+    def test_report(self):
+        self.record(0, 2.0)
+        self.record(1, 1.0, digest="b")
+        lines = self.history.report("burns.sys")
+        self.assertEqual(lines[0], "burns.sys: 2 runs of 2 versions")
+        self.assertIn("deadlock: 2 runs", lines[1])
+        self.assertIn("(-50%)", lines[1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,37 @@
+import unittest
+
+import numpy as np
+
+from parser import parse_file
+from instantiation import instantiate, InstantiationError
+from processnet import ProcessnetError
+
+
+class InstantiationTest(unittest.TestCase):
+    def critical(self, filename, state, size):
+        instance = instantiate(parse_file(filename), size)
+        return max(len(instance.marking(m)[state])
+                   for m in instance.net.reachable_markings())
+
+    def test_burns_keeps_mutex(self):
+        self.assertEqual(self.critical("examples/burns.sys", "pc6", 3), 1)
+
+    def test_nomutex_violates_mutex(self):
+        self.assertEqual(self.critical("examples/nomutex.sys", "crit", 3), 3)
+
+    def test_fire_requires_enabled(self):
+        net = instantiate(parse_file("examples/nomutex.sys"), 2).net
+        enabled = net.enabled(net.initial_marking)[0]
+        self.assertTrue(enabled.any())
+        self.assertFalse(enabled.all())
+        with self.assertRaises(ProcessnetError):
+            net.fire(net.initial_marking, [int(np.argmin(enabled))])
+
+    def test_transition_limit(self):
+        with self.assertRaises(InstantiationError):
+            instantiate(parse_file("examples/dragon.sys"), 4,
+                        max_transitions=100)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,50 @@
+import unittest
+
+from parser import parse_file
+from memory import MemoryAccounting
+import tracemalloc
+
+
+class MemoryAccountingTest(unittest.TestCase):
+    def test_phases(self):
+        accounting = MemoryAccounting()
+        try:
+            with accounting.phase("parse"):
+                interaction = parse_file("examples/burns.sys")
+            with accounting.phase("render"):
+                rendered = interaction.normalize().render_base_theory()
+                discarded = "x" * (1 << 20)
+                del discarded
+        finally:
+            accounting.stop()
+        self.assertFalse(tracemalloc.is_tracing())
+        self.assertEqual(list(accounting.phases), ["parse", "render"])
+        parse = accounting.phases["parse"]
+        self.assertEqual(parse.sections, 1)
+        self.assertGreater(parse.retained, 0)
+        self.assertGreaterEqual(parse.peak, parse.retained)
+        self.assertGreater(parse.types["formula.Clause"][1], 0)
+        self.assertTrue(any(site.startswith("parser.py:")
+                            for site in parse.sites))
+        render = accounting.phases["render"]
+        # the peak includes the discarded string, the retained memory only
+        # the base theory, less strings freed meanwhile
+        self.assertGreater(render.peak, 1 << 19)
+        self.assertLess(render.retained, 1 << 19)
+        self.assertGreater(render.types["builtins.str"][0],
+                           len(rendered) // 2)
+        report = accounting.report()
+        self.assertTrue(report[0].startswith("parse: peak"))
+        self.assertIn("  retained by allocation site:", report)
+
+    def test_leaves_foreign_tracing_running(self):
+        tracemalloc.start()
+        try:
+            MemoryAccounting().stop()
+            self.assertTrue(tracemalloc.is_tracing())
+        finally:
+            tracemalloc.stop()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,74 @@
+import unittest
+
+from processnet import Process, PetriNet, ProcessnetError
+
+
+class ProcessTest(unittest.TestCase):
+    def setUp(self):
+        self.root = Process(0, "system")
+        for agent in range(20):
+            process = self.root.add_child_process(agent)
+            for state in ["idle", "crit"]:
+                process.add_place(state)
+
+    def test_get(self):
+        place = self.root.get("3/crit")
+        self.assertEqual(self.root.get("3").get("crit"), place)
+        self.assertEqual(place.full_name[-1], "Process<1>(crit)")
+        with self.assertRaises(ProcessnetError):
+            self.root.get("3/wait")
+
+    def test_get_regex(self):
+        found = self.root.get_regex("1.*/crit")
+        self.assertEqual({p.host_process.value for p in found},
+                         {1} | set(range(10, 20)))
+
+    def test_leaves_follow_additions(self):
+        self.assertEqual(len(self.root.all_leaves), 40)
+        process = self.root.get("4")
+        self.assertEqual(len(process.all_leaves), 2)
+        process.add_place("wait")
+        self.assertEqual(len(self.root.all_leaves), 41)
+        self.assertEqual(len(process.all_leaves), 3)
+        self.assertIn(self.root.get("4/wait"), self.root.all_leaves)
+
+
+class PetriNetTest(unittest.TestCase):
+    def setUp(self):
+        root = Process(0, "system")
+        self.net = PetriNet(root)
+        for name in ["a", "b", "c"]:
+            self.net.add_place(root.add_place(name))
+
+    def test_duplicates_are_not_added(self):
+        first = self.net.add_transition([0], [1], "first")
+        self.assertEqual(self.net.add_transition([0, 0], [1], "second"),
+                         first)
+        self.assertEqual(self.net.number_of_transitions, 1)
+        self.assertEqual(self.net.labels[first], "first")
+        self.assertEqual(self.net.transition_id([0], [1]), first)
+        with self.assertRaises(ProcessnetError):
+            self.net.transition_id([1], [0])
+
+    def test_adjacency(self):
+        self.net.add_transition([0], [1])
+        self.net.add_transition([0, 1], [2])
+        self.net.add_transition([2], [0])
+        self.assertEqual(self.net.consuming(0).tolist(), [0, 1])
+        self.assertEqual(self.net.producing(0).tolist(), [2])
+        self.assertEqual(self.net.producing(2).tolist(), [1])
+        transition = self.net.transition(1)
+        self.assertEqual(hash(transition), hash(self.net.transition(1)))
+        self.assertIn("->", str(transition))
+
+    def test_compile(self):
+        self.net.add_transition([0, 1], [2])
+        self.assertEqual(self.net.pre_indices.tolist(), [])
+        self.net.compile()
+        self.assertEqual(self.net.pre_indptr.tolist(), [0, 2])
+        self.assertEqual(self.net.pre_indices.tolist(), [0, 1])
+        self.assertEqual(self.net.post_indices.tolist(), [2])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,44 @@
+import unittest
+
+from tempfile import TemporaryDirectory
+import os
+
+from parser import parse_file
+from profiling import Profiler
+
+
+class ProfilingTest(unittest.TestCase):
+    def test_phases_and_worker_parts(self):
+        with TemporaryDirectory() as directory:
+            profiler = Profiler(directory)
+            with profiler.phase("parse"):
+                interaction = parse_file("examples/burns.sys")
+            # a worker profiles the same phase and leaves its part behind
+            worker = Profiler(directory, profiler.run)
+            with worker.phase("normalize"):
+                interaction.normalize()
+            worker.write_parts()
+            # parts of another run are neither merged nor removed
+            other = Profiler(directory)
+            with other.phase("simulate"):
+                interaction.normalize()
+            other.write_parts()
+            with profiler.phase("normalize"):
+                interaction.normalize()
+            self.assertEqual(profiler.write(), ["normalize", "parse"])
+            parts = os.listdir(os.path.join(directory, "parts"))
+            self.assertEqual(parts, [f"simulate.{other.run}"
+                                     + f".{os.getpid()}-{id(other)}.prof"])
+            with open(os.path.join(directory, "normalize.collapsed")) as f:
+                lines = f.read().splitlines()
+            self.assertTrue(lines)
+            for line in lines:
+                stack, count = line.rsplit(" ", 1)
+                self.assertGreater(int(count), 0)
+            self.assertTrue(any("normalize" in line for line in lines))
+            self.assertTrue(os.path.exists(
+                os.path.join(directory, "parse.prof")))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+import unittest
+
+import sys
+
+from subprocess import Popen
+
+from scheduler import Job, order, run
+
+
+def job(text, duration=None, peak_rss=None):
+    return Job([sys.executable, "-c", f"print({text!r})"], duration,
+               peak_rss, payload=text)
+
+
+def sleeper(seconds):
+    # prints when it started and ended
+    return Job([sys.executable, "-c",
+                "import time; start = time.time();"
+                + f" time.sleep({seconds}); print(start, time.time())"])
+
+
+class SchedulerTest(unittest.TestCase):
+    def test_order(self):
+        jobs = [job("short", 1.0), job("new"), job("long", 5.0),
+                job("other new")]
+        self.assertEqual([j.payload for j in order(jobs)],
+                         ["new", "other new", "long", "short"])
+
+    def test_run(self):
+        jobs = [job(str(i), peak_rss=60) for i in range(4)]
+        jobs.append(Job(["/nonexistent/mona"], payload="missing"))
+        completions = list(run(jobs, workers=3, memory_budget=100))
+        self.assertEqual(sorted(c.job.payload for c in completions),
+                         ["0", "1", "2", "3", "missing"])
+        for c in completions:
+            if c.job.payload == "missing":
+                self.assertNotEqual(c.returncode, 0)
+            else:
+                self.assertEqual(c.returncode, 0)
+                self.assertEqual(c.output.strip(), c.job.payload)
+                self.assertGreater(c.peak_rss, 0)
+
+    def test_leaves_other_children_alone(self):
+        other = Popen([sys.executable, "-c", "raise SystemExit(3)"])
+        list(run([sleeper(0.3)]))
+        self.assertEqual(other.wait(), 3)
+
+    def test_unestimated_jobs_run_alone(self):
+        def overlapping(**limits):
+            completions = list(run([sleeper(0.3) for _ in range(2)],
+                                   workers=2, **limits))
+            (_, end), (start, _) = sorted(
+                    [float(t) for t in c.output.split()] for c in completions)
+            return start < end
+        self.assertFalse(overlapping(memory_budget=100))
+        self.assertTrue(overlapping(memory_budget=100, default_peak_rss=40))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+import unittest
+
+import numpy as np
+
+from parser import parse_file
+from simulation import CompiledProperty, PropertyParser, Simulator
+from simulation import SimulationError, _evaluate
+
+
+class PropertyTest(unittest.TestCase):
+    def setUp(self):
+        generator = np.random.default_rng(0)
+        self.states = {s: generator.random((16, 6)) < 0.3
+                       for s in ["a", "b", "c"]}
+
+    def membership(self, state):
+        return self.states[state]
+
+    def test_quantifier_scope(self):
+        tree = PropertyParser("ex1 x: x in a & all1 y: y in b => y in c"
+                              ).parse()
+        self.assertEqual(tree[0], "ex")
+        self.assertEqual(tree[2][0], "and")
+        self.assertEqual(tree[2][2][0], "all")
+        self.assertEqual(tree[2][2][2][0], "implies")
+
+    def test_unsupported(self):
+        with self.assertRaises(SimulationError):
+            CompiledProperty("p", "ex2 X: 0 in X")
+
+    def test_counting_agrees_with_enumeration(self):
+        texts = [
+            "ex1 i, j: 0 <= i & i < n & 0 <= j & j < n & i ~= j"
+            + " & i in a & j in a",
+            "ex1 i, j, k: i ~= j & j ~= k & i ~= k & i in a & j in b"
+            + " & k notin c",
+            "ex1 i, j: i in a & j in b & 0 < j",
+            ]
+        for text in texts:
+            compiled = CompiledProperty("p", text)
+            self.assertIsNotNone(compiled.counting)
+            expected = _evaluate(compiled.tree, {}, 0, 6, self.membership)
+            self.assertTrue((compiled.holds(self.membership, 16, 6)
+                             == expected.reshape(-1)).all())
+
+
+class SimulatorTest(unittest.TestCase):
+    def test_finds_mutex_violation(self):
+        interaction = parse_file("examples/nomutex.sys")
+        result = Simulator(interaction, 100, runs=8, seed=0).run(20)
+        self.assertIn("mutex", result.violations)
+        marking = result.violations["mutex"].marking
+        self.assertGreaterEqual(len(marking["crit"]), 2)
+
+    def test_burns_keeps_mutex(self):
+        interaction = parse_file("examples/burns.sys")
+        result = Simulator(interaction, 20, runs=32, seed=0).run(200)
+        self.assertGreater(result.fired, 0)
+        self.assertEqual(result.violations, {})
+
+
+if __name__ == '__main__':
+    unittest.main()
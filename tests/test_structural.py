@@ -0,0 +1,46 @@
+import unittest
+
+import numpy as np
+
+from parser import parse_file
+from instantiation import instantiate
+from structural import StructuralFilter, check_property, p_invariants
+
+
+class StructuralTest(unittest.TestCase):
+    def test_invariants(self):
+        net = instantiate(parse_file("examples/mux-array.sys"), 4).net
+        invariants = p_invariants(net)
+        self.assertGreater(len(invariants), 0)
+        effects = np.zeros((net.number_of_transitions, net.number_of_places),
+                           dtype=np.int64)
+        for t in range(net.number_of_transitions):
+            np.add.at(effects[t], net.pre_indices[
+                net.pre_indptr[t]:net.pre_indptr[t + 1]], -1)
+            np.add.at(effects[t], net.post_indices[
+                net.post_indptr[t]:net.post_indptr[t + 1]], 1)
+        for row in invariants.rows():
+            y = np.zeros(net.number_of_places, dtype=np.int64)
+            y[list(row)] = list(row.values())
+            self.assertFalse((effects @ y).any())
+
+    def test_reachable_markings_not_refuted(self):
+        net = instantiate(parse_file("examples/dijkstra-ring.sys"), 3).net
+        markings = net.reachable_markings()
+        self.assertFalse(StructuralFilter(net).refutes(markings).any())
+
+    def test_burns_mutex_proven(self):
+        instance = instantiate(parse_file("examples/burns.sys"), 3)
+        result = check_property(instance, "nomutex")
+        self.assertGreater(result.bad, 0)
+        self.assertTrue(result.proven)
+
+    def test_nomutex_mutex_not_proven(self):
+        instance = instantiate(parse_file("examples/nomutex.sys"), 3)
+        result = check_property(instance, "mutex")
+        self.assertFalse(result.proven)
+        self.assertGreaterEqual(len(result.witness["crit"]), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
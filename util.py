@@ -0,0 +1,15 @@
+from typing import Any, Callable, IO
+from tempfile import NamedTemporaryFile
+
+import os
+
+
+def write_tmp_file(write: Callable[[IO[str]], Any]) -> str:
+    with NamedTemporaryFile(mode="w", delete=False) as tmp_file:
+        try:
+            write(tmp_file)
+        except Exception:
+            os.unlink(tmp_file.name)
+            raise
+        tmp_file.flush()
+        return tmp_file.name